@@ -1,30 +1,39 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-import json
-import io
-import requests
-from thefuzz import fuzz
-from thefuzz import process
-import streamlit as st
 import os
-
-st.sidebar.info(f"Текущая рабочая директория: {os.getcwd()}")
+import uuid
+
+# Ядро без Streamlit (хранилище, импорт, сопоставление) — пакет sclad; здесь только страницы и кэши
+import sclad.archive
+import sclad.export
+import sclad.jobs
+import sclad.plan
+import sclad.project
+import sclad.receipts
+import sclad.stock
+from sclad.journal import JournalStore
+from sclad.matching import FUZZY_MATCH_THRESHOLD, FUZZY_USE_INDEX
+from sclad.receipts import read_receipts_file
+from sclad.stock import MATCH_MEMO_PATH, STOCK_CACHE_DIR
+from sclad.profiling import PROFILE_HISTORY, Profiler
+from sclad.storage import DEFAULT_DATA_DIR, VersionConflict, open_storage
 
 # --- КОНСТАНТЫ ---
-FUZZY_MATCH_THRESHOLD = 80
+STOCK_CACHE_ENTRIES = 8  # сколько разных файлов остатков держать в памяти
 STOCK_URL_KEY = 'last_stock_url'
+STOCK_JOB_WORKERS = 2  # сравнений с остатками, выполняемых одновременно (остальные ждут в очереди)
+STOCK_JOB_POLL_SECONDS = 0.5  # как часто страница опрашивает ход сравнения
+ACTIVE_PROJECT_KEY = 'active_pid'  # выбранный объект (запоминается в session_state)
+PROJECT_CACHE_ENTRIES = 64  # сколько версий производных данных объектов держать в кэше
+DETAIL_PAGE_SIZES = [50, 100, 250]  # строк на странице детализации
+HISTORY_PAGE_SIZES = [50, 100, 200]  # строк на странице истории
+HISTORY_CACHE_ENTRIES = 256  # сколько отобранных страниц истории (HTML) держать в кэше
+PROFILE_JSONL_PATH = os.path.join(DEFAULT_DATA_DIR, 'profiling', 'spans.jsonl')  # замеры: строка на участок кода
+PROFILE_PROM_PATH = os.path.join(DEFAULT_DATA_DIR, 'profiling', 'sclad.prom')  # метрики для Prometheus (textfile)
+PROFILE_SESSION_KEY = 'profile_session'  # метка сессии в замерах
 WORKERS_LIST = ["Выберите сотрудника...", "Хазбулат Р.", "Никулин Д.", "Волыкина Е.", "Ивонин К.", "Никонов Е.", "Губанов А.", "Яшковец В."]
 
-# Базовая структура БД для первого запуска
-EMPTY_DB_STRUCTURE = {
-    'projects': pd.DataFrame(columns=['id', 'name']),
-    'materials': pd.DataFrame(columns=['id', 'project_id', 'name', 'unit', 'planned_qty']),
-    'shipments': pd.DataFrame(columns=['id', 'material_id', 'qty', 'user_name', 'arrival_date', 'store', 'doc_number', 'note', 'op_type'])
-}
-
-st.set_page_config(page_title="Склад обьекта", layout="wide")
-
 # #######################################################
 # 🔐 СЕРВИС: АУТЕНТИФИКАЦИЯ
 # #######################################################
@@ -61,294 +70,108 @@ def logout():
         del st.session_state["password_correct"]
     st.rerun()
 
+
 # #######################################################
-# 💾 ФУНКЦИИ ХРАНЕНИЯ В SECRETS (CRUD)
+# 💾 ХРАНИЛИЩЕ
 # #######################################################
 
-def enforce_types(df, table_name):
-    """Приводит столбцы к нужным типам после загрузки из JSON."""
-    if df.empty:
-        return EMPTY_DB_STRUCTURE[table_name].copy()
-    
-    if table_name == 'projects':
-        df['id'] = pd.to_numeric(df['id'], errors='coerce').fillna(0).astype(int)
-    elif table_name == 'materials':
-        df['id'] = pd.to_numeric(df['id'], errors='coerce').fillna(0).astype(int)
-        df['project_id'] = pd.to_numeric(df['project_id'], errors='coerce').fillna(0).astype(int)
-        df['planned_qty'] = pd.to_numeric(df['planned_qty'], errors='coerce').fillna(0.0)
-    elif table_name == 'shipments':
-        df['id'] = pd.to_numeric(df['id'], errors='coerce').fillna(0).astype(int)
-        df['material_id'] = pd.to_numeric(df['material_id'], errors='coerce').fillna(0).astype(int)
-        df['qty'] = pd.to_numeric(df['qty'], errors='coerce').fillna(0.0)
-    return df
-
-@st.cache_data(ttl=5)
-def load_db():
-    """Загружает всю базу данных из secrets.toml (кэшируется на 5 секунд)."""
-    try:
-        db_json = st.secrets.storage.database_json
-        
-        # Если база данных пуста, инициализируем пустую структуру
-        if db_json in ["{}", ""]:
-            return EMPTY_DB_STRUCTURE
-            
-        db_data = json.loads(db_json)
-        db = {}
-        
-        for key, df_json in db_data.items():
-            df = pd.read_json(df_json, orient='split')
-            db[key] = enforce_types(df, key)
-            
-        return db
-        
-    except Exception as e:
-        # Если секрет не найден или невалиден, инициализируем пустую структуру
-        if 'storage' not in st.secrets or 'database_json' not in st.secrets.storage:
-             st.error("❌ Ошибка: Не найдена секция [storage] в secrets.toml. Проверьте файл.")
-             st.stop()
-        st.warning(f"Ошибка загрузки базы данных: {e}. Создается пустая структура.")
-        return EMPTY_DB_STRUCTURE
-
-def save_db(db):
-    """Сохраняет всю базу данных обратно в secrets.toml."""
+@st.cache_resource
+def get_storage():
+    """
+    Одно хранилище на процесс (общее для всех сессий), выбирается в secrets.toml:
+    [storage] backend = "journal" (по умолчанию) или "sql" + url.
+    """
+    with get_profiler().span('open_storage', cache='miss'):
+        return open_storage(st.secrets.get('storage', {}))
+
+@st.cache_resource
+def get_profiler():
+    """
+    Замеры времени, общие для всех сессий. Секция [profiling] в secrets.toml:
+    enabled, history (сколько проходов помнить), jsonl и prometheus (пути к файлам, "" — не писать),
+    panel = true — панель «⏱️ Профилирование» в боковом меню.
+    """
+    profiling_cfg = st.secrets.get('profiling', {})
+    return Profiler(
+        jsonl_path=profiling_cfg.get('jsonl', PROFILE_JSONL_PATH) or None,
+        prom_path=profiling_cfg.get('prometheus', PROFILE_PROM_PATH) or None,
+        history=int(profiling_cfg.get('history', PROFILE_HISTORY)),
+        enabled=bool(profiling_cfg.get('enabled', True)),
+    )
+
+def span(name, **attrs):
+    """Замер участка кода в текущем проходе страницы (см. sclad.profiling)."""
+    return get_profiler().span(name, **attrs)
+
+def storage():
+    """Текущее хранилище; при ошибке подключения останавливает страницу."""
     try:
-        # Для сохранения мы должны отключить кэш!
-        st.cache_data.clear() 
-        
-        db_data = {}
-        for key, df in db.items():
-            # Преобразуем DataFrame в JSON-строку
-            db_data[key] = df.to_json(orient='split', date_format='iso')
-
-        # Сохраняем объединенный JSON в секреты
-        st.secrets["storage"]["database_json"] = json.dumps(db_data)
-        st.toast("💾 Данные сохранены в Streamlit Secrets.", icon="✅")
-        return True
+        return get_storage()
     except Exception as e:
-        st.error(f"❌ Ошибка сохранения в Streamlit Secrets: {e}")
-        return False
+        st.error(f"❌ Ошибка подключения к базе данных: {e}")
+        st.stop()
 
 # #######################################################
-# 🗃️ ФУНКЦИИ API (ОБНОВЛЕНО ДЛЯ IN-MEMORY DF)
+# 🗃️ ФУНКЦИИ API (ЧЕРЕЗ ИНТЕРФЕЙС Storage)
 # #######################################################
 
 def get_projects():
-    db = load_db()
-    return db['projects'].sort_values(by='name')
+    with span('get_projects'):
+        return storage().projects()
 
 def add_project(name):
-    db = load_db()
-    projects_df = db['projects']
-    
-    if name in projects_df['name'].tolist():
-        return False
-        
-    new_id = projects_df['id'].max() + 1 if not projects_df.empty else 1
-    new_row = pd.DataFrame([{'id': new_id, 'name': name}])
-    
-    db['projects'] = pd.concat([projects_df, new_row], ignore_index=True)
-    
-    return save_db(db)
+    return storage().add_project(name)
 
 def update_project_name(project_id, new_name):
-    db = load_db()
-    projects_df = db['projects']
-    pid = int(project_id)
-    
-    if new_name in projects_df['name'].tolist():
-        return False
-        
-    projects_df.loc[projects_df['id'] == pid, 'name'] = new_name
-    db['projects'] = projects_df
-    
-    return save_db(db)
+    return storage().rename_project(int(project_id), new_name)
 
 def delete_specific_project(project_id):
-    db = load_db()
-    pid = int(project_id)
-    
-    # 1. Удаление приходов, связанных с материалами этого проекта
-    materials_to_delete = db['materials'][db['materials']['project_id'] == pid]['id'].tolist()
-    db['shipments'] = db['shipments'][~db['shipments']['material_id'].isin(materials_to_delete)]
-    
-    # 2. Удаление материалов
-    db['materials'] = db['materials'][db['materials']['project_id'] != pid]
-
-    # 3. Удаление проекта
-    db['projects'] = db['projects'][db['projects']['id'] != pid]
-    
-    save_db(db)
+    # Удаляются приходы по материалам проекта, сами материалы и проект
+    storage().delete_project(int(project_id))
 
 def clear_project_history(project_id):
-    db = load_db()
-    pid = int(project_id)
-    
-    materials_df = db['materials']
-    
-    # Идентификаторы материалов, которые НЕ относятся к этому проекту
-    materials_to_keep = materials_df[materials_df['project_id'] != pid]['id'].tolist()
-    
-    # Оставляем только те приходы, которые не связаны с этим проектом
-    db['shipments'] = db['shipments'][db['shipments']['material_id'].isin(materials_to_keep)]
-    
-    save_db(db)
+    # Удаляются только приходы по материалам проекта
+    storage().clear_history(int(project_id))
 
-def load_excel_final(project_id, df):
-    db = load_db()
-    pid = int(project_id)
-    materials_df = db['materials']
-    
-    # 1. Удаляем старые материалы, связанные с этим проектом
-    materials_df = materials_df[materials_df['project_id'] != pid]
-    
-    success = 0
-    log = []
-    insert_data = []
-    
-    # 2. Подготавливаем новые данные
-    current_max_id = materials_df['id'].max() if not materials_df.empty else 0
-    
-    for i, row in df.iterrows():
-        try:
-            name = str(row.iloc[0]).strip()
-            unit = str(row.iloc[1]).strip()
-            qty_str = str(row.iloc[2]).replace(',', '.').replace('\xa0', '').strip()
-            
-            try:
-                qty = float(qty_str)
-            except:
-                qty = 0.0
-
-            if name and name.lower() != 'nan':
-                current_max_id += 1
-                insert_data.append({
-                    'id': current_max_id, 
-                    'project_id': pid, 
-                    'name': name, 
-                    'unit': unit, 
-                    'planned_qty': qty
-                })
-                success += 1
-        except Exception as e:
-            log.append(f"Ошибка строки {i}: {e}")
-            
-    # 3. Объединяем и сохраняем
-    if insert_data:
-        new_materials_df = pd.DataFrame(insert_data)
-        db['materials'] = pd.concat([materials_df, new_materials_df], ignore_index=True)
-        
-        if save_db(db):
-            return success, log
-    
-    return success, log
+def compact_history(project_id, before):
+    """Старые операции — в архив, вместо них остатки на дату before (sclad.archive.compact_history)."""
+    with span('compact_history', project=int(project_id)):
+        return sclad.archive.compact_history(storage(), project_id, before)
 
-def add_shipment(material_id, qty, user, date, store, doc_number, note, op_type='Приход'):
-    db = load_db()
-    shipments_df = db['shipments']
-    
-    new_id = shipments_df['id'].max() + 1 if not shipments_df.empty else 1
-    
-    new_row = pd.DataFrame([{
-        'id': new_id,
-        'material_id': int(material_id),
-        'qty': float(qty),
-        'user_name': user,
-        'arrival_date': date.strftime('%Y-%m-%d %H:%M:%S'),
-        'store': store,
-        'doc_number': doc_number,
-        'note': note,
-        'op_type': op_type
-    }])
-    
-    db['shipments'] = pd.concat([shipments_df, new_row], ignore_index=True)
-    
-    if save_db(db):
-        return new_id
-    return None
+def load_excel_final(project_id, source):
+    """Импорт плана в текущее хранилище (sclad.plan.import_plan)."""
+    with span('load_excel_final', project=int(project_id)):
+        return sclad.plan.import_plan(storage(), project_id, source)
 
-def undo_shipment(shipment_id, current_user):
-    db = load_db()
-    shipments_df = db['shipments']
-    
-    original_data = shipments_df[shipments_df['id'] == shipment_id]
-    
-    if not original_data.empty:
-        original_data = original_data.iloc[0]
-        material_id = original_data['material_id']
-        cancel_qty = -abs(original_data['qty'])
-        
-        # Записываем операцию "Отмена"
-        new_id = shipments_df['id'].max() + 1 if not shipments_df.empty else 1
-        
-        new_row = pd.DataFrame([{
-            'id': new_id,
-            'material_id': material_id,
-            'qty': cancel_qty,
-            'user_name': current_user,
-            'arrival_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'store': original_data['store'],
-            'doc_number': original_data['doc_number'],
-            'note': f"ОТМЕНА операции ID:{shipment_id}. Оригинальное Примечание: {original_data['note']}",
-            'op_type': 'Отмена'
-        }])
-        
-        db['shipments'] = pd.concat([shipments_df, new_row], ignore_index=True)
-        
-        if save_db(db):
-            return True
-    return False
-
-def get_data(project_id):
+def add_shipment(material_id, qty, user, date, store, doc_number, note, op_type='Приход'):
+    return sclad.project.add_shipment(storage(), material_id, qty, user, date, store, doc_number, note, op_type=op_type)
+
+def ingest_shipments(project_id, receipts_df, user, commit=False):
+    """Пакетный ввод приходов (sclad.receipts.ingest_shipments); подсказка списка — не выбранный сотрудник."""
+    if user == WORKERS_LIST[0]:
+        user = ''
+    with span('ingest_shipments', project=int(project_id), rows=len(receipts_df), commit=commit):
+        return sclad.receipts.ingest_shipments(storage(), project_id, receipts_df, user, commit=commit)
+
+def undo_shipment(shipment_id, current_user, project_id=None):
+    return sclad.project.undo_shipment(storage(), shipment_id, current_user, project_id=project_id)
+
+def get_data(project_id, version=None):
+    """
+    План с фактом и история объекта. Кэшируется по (объект, версия): после записи
+    в объект версия растёт и данные пересчитываются, кэш других объектов не трогается.
+    """
     pid = int(project_id)
-    db = load_db()
-    
-    materials_df = db['materials']
-    shipments_df = db['shipments']
-    
-    project_materials = materials_df[materials_df['project_id'] == pid].copy()
-    
-    if project_materials.empty:
-        return pd.DataFrame(), pd.DataFrame()
-    
-    # 1. Получение факта (total)
-    if not shipments_df.empty:
-        shipments_agg = shipments_df.groupby('material_id')['qty'].sum().reset_index()
-        shipments_agg.rename(columns={'qty': 'total'}, inplace=True)
-        
-        full_df = pd.merge(project_materials, shipments_agg, left_on='id', right_on='material_id', how='left')
-        full_df['total'] = full_df['total'].fillna(0)
-    else:
-        full_df = project_materials.copy()
-        full_df['total'] = 0.0
-    
-    # 2. Расчет прогресса
-    full_df['prog'] = full_df.apply(lambda x: x['total'] / x['planned_qty'] if x['planned_qty'] > 0 else 0, axis=1)
-
-    # 3. История операций
-    shipments_filtered = shipments_df[shipments_df['material_id'].isin(project_materials['id'])]
-    
-    if not shipments_filtered.empty:
-        history_df = pd.merge(shipments_filtered, project_materials[['id', 'name', 'unit']], 
-                             left_on='material_id', right_on='id', how='left', suffixes=('', '_mat'))
-        
-        history_df.rename(columns={
-            'name': 'Материал', 
-            'qty': 'Кол-во', 
-            'op_type': 'Тип опер.', 
-            'user_name': 'Кто', 
-            'store': 'Магазин', 
-            'doc_number': '№ Док.', 
-            'note': 'Примечание', 
-            'arrival_date': 'Дата',
-            'unit': 'Ед. изм.' # Добавляем единицу измерения в историю
-        }, inplace=True)
-        
-        history_df = history_df.sort_values(by='Дата', ascending=False)
-        history_df = history_df[['id', 'Материал', 'Ед. изм.', 'Кол-во', 'Тип опер.', 'Кто', 'Магазин', '№ Док.', 'Примечание', 'Дата']]
-    else:
-        history_df = pd.DataFrame(columns=['id', 'Материал', 'Ед. изм.', 'Кол-во', 'Тип опер.', 'Кто', 'Магазин', '№ Док.', 'Примечание', 'Дата'])
+    with span('get_data', project=pid, cache='hit'):
+        if version is None:
+            version = storage().version(pid)
+        return _load_project_data(pid, version)
 
-    return full_df, history_df
+@st.cache_data(max_entries=PROJECT_CACHE_ENTRIES, show_spinner=False)
+def _load_project_data(pid, version):
+    # Тело выполняется только при промахе кэша
+    get_profiler().annotate(cache='miss')
+    return sclad.project.project_data(storage(), pid)
 
 def submit_entry_callback(material_id, qty, user, input_key, current_pid, store, doc_number, note):
     if user == "Выберите сотрудника..." or not user:
@@ -371,7 +194,7 @@ def submit_entry_callback(material_id, qty, user, input_key, current_pid, store,
             st.session_state[input_key] = 0.0
             st.rerun() # Перезапуск для обновления данных
         else:
-            st.toast("Ошибка записи в Streamlit Secrets.", icon="🔥")
+            st.toast("Ошибка записи в журнал базы данных.", icon="🔥")
         
     except Exception as e:
         st.toast(f"Ошибка записи: {e}", icon="🔥")
@@ -381,485 +204,729 @@ def submit_entry_callback(material_id, qty, user, input_key, current_pid, store,
 # 🛠️ ФУНКЦИИ УТИЛИТ
 # #######################################################
 
-def to_excel(df):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='History')
-    processed_data = output.getvalue()
-    return processed_data
-
-def find_best_match(query, choices, threshold):
-    result = process.extractOne(query, choices, scorer=fuzz.token_sort_ratio)
-    
-    if result and result[1] >= threshold:
-        return result[0], result[1]
-    return None, 0
-
-def compare_with_stock_excel(file_source, data_df):
-    # ... (логика сравнения с Excel/URL остается без изменений, так как не зависит от БД)
-    stock_df = pd.DataFrame()
+@st.cache_resource(max_entries=PROJECT_CACHE_ENTRIES)
+def history_view(pid, version):
+    """
+    История для просмотра (sclad.project.prepare_history) и варианты фильтров; кэш по (объект, версия).
+    cache_resource — чтобы не копировать всю историю при каждом перезапуске; таблица только читается.
+    """
+    get_profiler().annotate(cache='miss')
+    _, hist_df = get_data(pid, version)
+    view = sclad.project.prepare_history(hist_df)
+    options = {
+        'materials': sorted(view['Материал'].dropna().astype(str).unique()),
+        'users': sorted(view['Кто'].dropna().astype(str).unique()),
+    }
+    return view, options
+
+@st.cache_data(max_entries=HISTORY_CACHE_ENTRIES, show_spinner=False)
+def history_rows(pid, version, date_from, date_to, materials, users):
+    """Номера строк history_view, прошедших фильтр; кэш по (объект, версия, фильтр)."""
+    get_profiler().annotate(cache='miss')
+    view, _ = history_view(pid, version)
+    filtered = sclad.project.filter_history(view, date_from, date_to, materials, users)
+    return filtered.index.to_numpy()
+
+@st.cache_data(max_entries=HISTORY_CACHE_ENTRIES, show_spinner=False)
+def history_page_html(pid, version, filters, page, page_size):
+    """HTML одной страницы истории (sclad.project.history_html); кэш по (объект, версия, фильтр, страница)."""
+    get_profiler().annotate(cache='miss')
+    view, _ = history_view(pid, version)
+    rows = history_rows(pid, version, *filters)
+    start = (page - 1) * page_size
+    return sclad.project.history_html(view.iloc[rows[start:start + page_size]])
+
+@st.cache_data(max_entries=PROJECT_CACHE_ENTRIES, show_spinner=False)
+def detail_table(pid, version):
+    """Таблица детализации плана (sclad.project.detail_table); кэш по (объект, версия)."""
+    get_profiler().annotate(cache='miss')
+    data_df, _ = get_data(pid, version)
+    return sclad.project.detail_table(data_df)
+
+@st.cache_data(max_entries=PROJECT_CACHE_ENTRIES, show_spinner=False)
+def history_export(pid, version, fmt):
+    """История объекта файлом формата fmt (sclad.export); кэш по (объект, версия, формат)."""
+    get_profiler().annotate(cache='miss')
+    _, hist_df = get_data(pid, version)
+    with span('export_frame', rows=len(hist_df), format=fmt):
+        return sclad.export.export_frame(hist_df.drop(columns=['id']), fmt, sheet_name='History')
+
+@st.cache_data(max_entries=PROJECT_CACHE_ENTRIES, show_spinner=False)
+def archive_export(pid, version, fmt):
+    """Архив истории объекта файлом формата fmt; архив меняется только сжатием, а оно меняет версию."""
+    get_profiler().annotate(cache='miss')
+    archive_df = sclad.project.archive_data(storage(), pid)
+    with span('export_frame', rows=len(archive_df), format=fmt):
+        return sclad.export.export_frame(archive_df.drop(columns=['id']), fmt, sheet_name='Archive')
+
+def on_download(name, func, **attrs):
+    """
+    Данные для st.download_button: файл готовится только по нажатию (Streamlit вызывает
+    функцию в отдельном потоке, вне прохода страницы) и замеряется своим проходом 'download'.
+    """
+    def prepare():
+        with get_profiler().run('download'), span(name, **attrs):
+            return func()
+    return prepare
+
+def export_buttons(name, export, key, label, file_stem, **attrs):
+    """
+    Кнопки скачивания во всех форматах EXPORT_FORMATS; export(fmt) -> bytes вызывается по нажатию,
+    name и attrs — спан прохода 'download'. Нажатие не перезапускает страницу.
+    """
+    formats = sclad.export.EXPORT_FORMATS
+    for col, (fmt, (fmt_label, mime)) in zip(st.columns(len(formats)), formats.items()):
+        col.download_button(
+            label=f"📥 {label} ({fmt_label})",
+            data=on_download(name, lambda fmt=fmt: export(fmt), format=fmt, **attrs),
+            file_name=f"{file_stem}.{fmt}",
+            mime=mime,
+            on_click='ignore',
+            key=f"{key}_{fmt}",
+            use_container_width=True,
+        )
+
+def render_profiling_panel():
+    """Последние проходы страницы: общее время, самый долгий участок, разбивка выбранного прохода."""
+    runs = get_profiler().recent_runs()
+    if not runs:
+        st.caption("Пока нет завершённых проходов.")
+        return
     
-    if isinstance(file_source, str):
-        original_url = file_source.strip()
-        
-        if "docs.google.com/spreadsheets/d/" in original_url and "/edit" in original_url:
-            try:
-                start_index = original_url.find('/d/') + 3
-                end_index = original_url.find('/edit')
-                sheet_id = original_url[start_index:end_index]
-                file_source = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
-            except Exception as e:
-                st.error(f"Ошибка при обработке URL Google Таблицы: {e}")
-                return pd.DataFrame()
-        
-        st.info(f"⏳ Загрузка данных по URL...")
+    def slowest(run):
+        spans = [s for s in run['spans'] if s['depth'] > 0 and 'ms' in s]
+        top = max(spans, key=lambda s: s['ms'], default=None)
+        return f"{top['name']} ({top['ms']:.0f} мс)" if top else '—'
+    
+    st.caption(f"Последние {len(runs)} проходов (текущий ещё не завершён).")
+    st.dataframe(pd.DataFrame({
+        'Время': [run['started'][11:19] for run in runs],
+        'Всего, мс': [run['ms'] for run in runs],
+        'Исход': [run['outcome'] for run in runs],
+        'Самый долгий участок': [slowest(run) for run in runs],
+    }), hide_index=True, use_container_width=True)
+    
+    selected = st.selectbox(
+        "Проход", range(len(runs)), key="profile_run",
+        format_func=lambda i: f"{runs[i]['started'][11:19]} — {runs[i]['ms']:.0f} мс",
+    )
+    spans = runs[selected]['spans']
+    st.dataframe(pd.DataFrame({
+        'Участок': ['· ' * s['depth'] + s['name'] for s in spans],
+        'Начало, мс': [s['start_ms'] for s in spans],
+        'мс': [s.get('ms') for s in spans],
+        'Детали': [', '.join(f"{k}={v}" for k, v in s['attrs'].items()) for s in spans],
+    }), hide_index=True, use_container_width=True)
+
+# --- Остатки: HTTP-сессия и разобранные файлы общие для всех сессий ---
+
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    """Общая HTTP-сессия: пул соединений и повтор при 502/503/504."""
+    return sclad.stock.make_http_session()
+
+@st.cache_resource(max_entries=STOCK_CACHE_ENTRIES, show_spinner=False)
+def build_stock_table(content_hash, cache_dir):
+    """Агрегат остатков и индекс названий (sclad.stock.build_stock_table) — один на файл для всех объектов."""
+    get_profiler().annotate(cache='miss')
+    return sclad.stock.build_stock_table(content_hash, cache_dir)
+
+@st.cache_resource(show_spinner=False)
+def get_job_runner():
+    """Общий пул фоновых заданий (sclad.jobs) для всех сессий."""
+    return sclad.jobs.JobRunner(max_workers=STOCK_JOB_WORKERS)
+
+def compare_with_stock_job(job, url, data_df, exhaustive=False):
+    """
+    Сравнение с остатками в потоке пула: загрузка, агрегат, сопоставление. Вызовов st.* нет —
+    ход выполнения пишется в job, страница его опрашивает. Замеряется своим проходом 'stock_job'.
+    """
+    with get_profiler().run('stock_job', names=len(data_df)):
+        job.update(stage="⏳ Загрузка данных по URL...")
         try:
-            response = requests.get(file_source)
-            response.raise_for_status() 
-            stock_df = pd.read_excel(io.BytesIO(response.content), header=None)
-            st.success("✅ Файл успешно загружен.")
+            with span('fetch_stock_file'):
+                content_hash, status = sclad.stock.fetch_stock_file(url, STOCK_CACHE_DIR, session=get_http_session())
+                get_profiler().annotate(status=status)
         except Exception as e:
-            st.error(f"Ошибка при загрузке по URL: {e}")
-            return pd.DataFrame()
-            
-    else:
-        st.error("Непредвиденный источник файла.")
-        return pd.DataFrame()
-    
-    MIN_COLS = 17 
-    if stock_df.shape[1] < MIN_COLS:
-        st.error(f"⚠️ Ошибка: В файле должно быть минимум {MIN_COLS} столбцов. Найдено: {stock_df.shape[1]}")
-        return pd.DataFrame()
+            raise RuntimeError(f"Ошибка при загрузке по URL: {e}") from e
         
-    stock_df.rename(columns={
-        1: 'Name_Stock', 12: 'Store_Stock', 13: 'Qty_Stock', 16: 'Shelf_Stock' 
-    }, inplace=True)
-    
-    stock_df_cleaned = stock_df[['Name_Stock', 'Store_Stock', 'Qty_Stock', 'Shelf_Stock']].copy()
-    stock_df_cleaned.dropna(subset=['Name_Stock'], inplace=True)
-    
-    stock_names_list_lower = stock_df_cleaned['Name_Stock'].astype(str).str.strip().str.lower().unique().tolist()
-    
-    project_materials = data_df[['name', 'unit']].copy()
-    project_materials.rename(columns={'name': 'Name_Project'}, inplace=True)
-    project_materials['Name_Project_Lower'] = project_materials['Name_Project'].astype(str).str.strip().str.lower()
-    
-    project_materials['Name_Stock_Match'] = None
-    project_materials['Match_Score'] = 0
-    
-    st.info(f"🔎 Запуск нечеткого сопоставления с порогом **{FUZZY_MATCH_THRESHOLD}%**...")
+        # Агрегат и индекс названий строятся один раз на файл и переиспользуются другими объектами
+        job.update(stage="📊 Разбор файла остатков...")
+        with span('build_stock_table', cache='hit'):
+            stock_table = build_stock_table(content_hash, STOCK_CACHE_DIR)
+        
+        # exhaustive — полный перебор для проверки индекса
+        job.update(stage=f"🔎 Нечеткое сопоставление с порогом {FUZZY_MATCH_THRESHOLD}%...")
+        with span('match_stock', names=len(data_df)):
+            result_df = sclad.stock.match_stock(stock_table, data_df, memo_path=MATCH_MEMO_PATH,
+                                                exhaustive=exhaustive or not FUZZY_USE_INDEX,
+                                                progress=lambda done, total: job.update(done=done, total=total))
+            get_profiler().annotate(memo_hits=result_df.attrs['memo_hits'], memo_misses=result_df.attrs['memo_misses'])
+        result_df.attrs['file_status'] = status
+        return result_df
+
+def start_stock_comparison(pid, version, url, data_df, exhaustive=False):
+    """
+    Ставит сравнение в пул и запоминает id задания в session_state. Такое же сравнение
+    (ссылка, объект, версия данных), ещё не завершённое, не запускается второй раз — подхватывается.
+    """
+    try:
+        url = sclad.stock.normalize_stock_url(url)
+    except Exception as e:
+        st.error(f"Ошибка при обработке URL Google Таблицы: {e}")
+        return False
+    job = get_job_runner().submit(('stock', url, pid, version, exhaustive), compare_with_stock_job,
+                                  url, data_df, exhaustive=exhaustive)
+    st.session_state[f"stock_job_{pid}"] = job.id
+    return True
+
+@st.fragment(run_every=STOCK_JOB_POLL_SECONDS)
+def stock_job_progress(job_id):
+    """Ход сравнения; перезапускается сам по себе, пока задание идёт, затем — вся страница с результатом."""
+    job = get_job_runner().get(job_id)
+    if job is None or not job.running:
+        st.rerun()
+    text = f"{job.stage} {job.done} из {job.total}" if job.total else job.stage
+    st.progress(job.progress(), text=text or "⏳ В очереди...")
+
+def render_stock_comparison(pid, pname):
+    """Результат (или ход) последнего сравнения объекта; результат хранится в пуле заданий."""
+    job_id = st.session_state.get(f"stock_job_{pid}")
+    job = get_job_runner().get(job_id) if job_id else None
+    if job is None:
+        return
+    if job.running:
+        stock_job_progress(job.id)
+        return
+    if job.error is not None:
+        st.error(str(job.error))
+        return
     
-    matched_stock_data = {} 
+    comparison_result = job.result
+    if comparison_result.attrs['file_status'] == 'not_modified':
+        st.success("✅ Файл не изменился — используются сохраненные данные.")
+    elif comparison_result.attrs['file_status'] == 'cached':
+        st.warning("⚠️ Сервер с файлом недоступен — используются последние сохраненные данные.")
+    else:
+        st.success("✅ Файл успешно загружен.")
+    st.success(f"🏁 Сопоставление завершено за {job.finished - job.started:.1f} с. "
+               f"Из памяти: {comparison_result.attrs['memo_hits']}, пересчитано: {comparison_result.attrs['memo_misses']}.")
+    if comparison_result.empty:
+        return
     
-    for index, row in project_materials.iterrows():
-        project_name = row['Name_Project_Lower']
+    found_df = comparison_result[comparison_result['Склады'] != '—']
+    not_found_df = comparison_result[comparison_result['Склады'] == '—']
+    
+    st.subheader(f"✅ Найдено совпадений: {len(found_df)} из {len(comparison_result)}")
+    st.dataframe(found_df, use_container_width=True)
+    
+    if not not_found_df.empty:
+        st.subheader(f"❌ Материалы из плана, не найденные в файле остатков:")
+        st.dataframe(not_found_df.drop(columns=['Количество (Склад)', 'Склады', 'Номера полок', 'Сходство (%)']), use_container_width=True)
+    
+    export_buttons('stock_export', lambda fmt: sclad.export.export_frame(comparison_result, fmt, sheet_name='Stock'),
+                   key=f"dl_stock_{pid}", label="Скачать сравнение", file_stem=f"Остатки_{pname}")
+
+def page_selector(container, key, total_rows, page_size):
+    """Номер страницы (с 1) для total_rows строк по page_size на странице."""
+    # После смены фильтра номер страницы может оказаться за концом списка
+    pages = max(1, -(-total_rows // page_size))
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    return container.number_input(f"Страница (из {pages})", min_value=1, max_value=pages, step=1, key=key)
+
+def render_details(pid, version):
+    """
+    Детализация плана одной таблицей: фильтр по состоянию и названию, постраничный вывод.
+    В браузер уходит только текущая страница, сколько бы строк ни было в плане.
+    """
+    with span('detail_table', cache='hit'):
+        table = detail_table(pid, version)
+    counts = table['status'].value_counts()
+    
+    status = st.radio(
+        "Показать", ['all', *sclad.project.MATERIAL_STATUSES], horizontal=True, key=f"det_status_{pid}",
+        format_func=lambda key: f"Все ({len(table)})" if key == 'all'
+        else f"{sclad.project.MATERIAL_STATUSES[key]} ({counts.get(key, 0)})",
+    )
+    c_search, c_size, c_page = st.columns([3, 1, 1])
+    query = c_search.text_input("Поиск по названию", key=f"det_search_{pid}")
+    page_size = c_size.selectbox("Строк на странице", DETAIL_PAGE_SIZES, key=f"det_size_{pid}")
+    
+    mask = pd.Series(True, index=table.index)
+    if status != 'all':
+        mask &= table['status'] == status
+    if query.strip():
+        mask &= table['Материал'].astype(str).str.contains(query.strip(), case=False, regex=False)
+    filtered = table[mask]
+    
+    page = page_selector(c_page, f"det_page_{pid}", len(filtered), page_size)
+    
+    start = (page - 1) * page_size
+    page_df = filtered.iloc[start:start + page_size]
+    st.dataframe(
+        page_df.drop(columns=['id', 'status']),
+        column_config={
+            'План': st.column_config.NumberColumn(format="%.2f"),
+            'Факт': st.column_config.NumberColumn(format="%.2f"),
+            'Выполнено': st.column_config.ProgressColumn(min_value=0.0, max_value=1.0, format="percent"),
+            'Осталось': st.column_config.NumberColumn(format="%.2f"),
+            'Перерасход': st.column_config.NumberColumn(format="%.2f"),
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
+    if filtered.empty:
+        st.caption("Нет материалов по выбранному фильтру.")
+    else:
+        st.caption(f"Строки {start + 1}–{start + len(page_df)} из {len(filtered)}")
+
+def render_history(pid, version):
+    """
+    История операций постранично: фильтр по периоду, материалам и сотрудникам.
+    Отбор строк и HTML каждой страницы кэшируются, в браузер уходит только текущая страница.
+    """
+    with span('history_view', cache='hit'):
+        view, options = history_view(pid, version)
+    
+    c_dates, c_mat, c_user = st.columns([2, 3, 2])
+    dates = c_dates.date_input("Период", value=(), format="DD.MM.YYYY", key=f"hist_dates_{pid}")
+    materials = c_mat.multiselect("Материал", options['materials'], key=f"hist_mat_{pid}")
+    users = c_user.multiselect("Кто", options['users'], key=f"hist_user_{pid}")
+    
+    # Пока выбрана только первая дата периода, фильтруем с неё и до конца
+    date_from = dates[0] if len(dates) > 0 else None
+    date_to = dates[1] if len(dates) > 1 else None
+    filters = (date_from, date_to, tuple(materials), tuple(users))
+    with span('history_rows', cache='hit'):
+        rows = history_rows(pid, version, *filters)
+    
+    c_size, c_page, _ = st.columns([1, 1, 3])
+    page_size = c_size.selectbox("Строк на странице", HISTORY_PAGE_SIZES, key=f"hist_size_{pid}")
+    page = page_selector(c_page, f"hist_page_{pid}", len(rows), page_size)
+    
+    if not len(rows):
+        st.caption("Нет операций по выбранному фильтру.")
+        return
+    with span('history_page_html', cache='hit', rows=len(rows)):
+        page_html = history_page_html(pid, version, filters, page, page_size)
+    st.markdown(page_html, unsafe_allow_html=True)
+    start = (page - 1) * page_size
+    st.caption(f"Строки {start + 1}–{min(start + page_size, len(rows))} из {len(rows)} (всего операций: {len(view)})")
+
+def render_project(pid, pname):
+    """Рисует страницу одного объекта (вызывается только для выбранного)."""
+    # --- СЕКЦИЯ НАСТРОЕК / УДАЛЕНИЕ ---
+    with st.expander("⚙️ Настройки / Удаление объекта"):
+        # Блок Редактирования Названия
+        st.write("**Редактирование названия**")
+        new_pname = st.text_input("Новое название объекта", value=pname, key=f"edit_name_{pid}")
+        if st.button("📝 Сохранить название", key=f"save_name_{pid}", type="secondary"):
+            if new_pname and new_pname != pname:
+                if update_project_name(pid, new_pname):
+                    st.toast("Название обновлено!")
+                    st.rerun()
+                else:
+                    st.error("Ошибка: Такое название уже используется.")
+            else:
+                st.warning("Название не изменилось или пусто.")
+        st.divider()
+
+        # Блок Архива истории
+        st.write("**🗄️ Архив истории** (операции до даты — в архив, вместо них остаток по материалу)")
+        col_arch1, col_arch2 = st.columns([2, 1])
+        archive_before = col_arch1.date_input("Перенести операции раньше", value=datetime.now().date().replace(day=1),
+                                              format="DD.MM.YYYY", key=f"archive_before_{pid}")
+        col_arch2.write("")
+        if col_arch2.button("🗄️ В архив", key=f"archive_{pid}"):
+            try:
+                summary = compact_history(pid, archive_before)
+            except VersionConflict:
+                st.error("❌ Объект сейчас активно изменяется другими пользователями — попробуйте ещё раз.")
+            else:
+                if summary['archived'] or summary['dropped']:
+                    st.toast(f"В архив: {summary['archived']} операций (пар с отменой: {summary['pairs']}), "
+                             f"строк «Остаток»: {summary['balances']}", icon="🗄️")
+                    st.rerun()
+                st.info(f"Нет операций раньше {archive_before:%d.%m.%Y}.")
+        st.divider()
+
+        # Блок Сброса и Удаления
+        col_del1, col_del2 = st.columns(2)
         
-        best_match, score = find_best_match(project_name, stock_names_list_lower, FUZZY_MATCH_THRESHOLD)
+        confirm_reset_key = f"confirm_reset_{pid}"
+        confirm_delete_key = f"confirm_delete_{pid}"
+
+        with col_del1:
+            st.write("**Сброс данных** (только история приходов)")
+            if not st.session_state.get(confirm_reset_key, False):
+                if st.button("🧹 Сбросить историю", key=f"pre_reset_{pid}"):
+                    st.session_state[confirm_reset_key] = True
+                    st.rerun()
+            else:
+                st.warning("Вы уверены?")
+                col_yes, col_no = st.columns(2)
+                if col_yes.button("ДА, СБРОСИТЬ", key=f"yes_reset_{pid}", type="primary"):
+                    clear_project_history(pid)
+                    st.session_state[confirm_reset_key] = False
+                    st.toast("История очищена!", icon="↩️")
+                    st.rerun()
+                if col_no.button("Отмена", key=f"no_reset_{pid}"):
+                    st.session_state[confirm_reset_key] = False
+                    st.rerun()
         
-        if score > 0:
-            project_materials.at[index, 'Name_Stock_Match'] = best_match
-            project_materials.at[index, 'Match_Score'] = score
+        with col_del2:
+            st.write("**Удаление объекта** (полное)")
+            if not st.session_state.get(confirm_delete_key, False):
+                if st.button("❌ Удалить объект", key=f"pre_del_{pid}"):
+                    st.session_state[confirm_delete_key] = True
+                    st.rerun()
+            else:
+                st.error("ВНИМАНИЕ: Все данные будут удалены!")
+                col_yes_d, col_no_d = st.columns(2)
+                if col_yes_d.button("ДА, УДАЛИТЬ", key=f"yes_del_{pid}", type="primary"):
+                    delete_specific_project(pid)
+                    st.session_state[confirm_delete_key] = False
+                    st.success("Объект удален")
+                    st.rerun()
+                if col_no_d.button("Отмена", key=f"no_del_{pid}"):
+                    st.session_state[confirm_delete_key] = False
+                    st.rerun()
+    
+    # --- ДАННЫЕ (План и История) ---
+    # Одна версия на весь проход: план, история и выгрузки согласованы между собой
+    version = storage().version(pid)
+    data_df, hist_df = get_data(pid, version)
+    
+    plan_upload_key = f"u_{pid}"
+    plan_confirm_key = f"plan_confirm_{pid}"
+    plan_log_key = f"plan_log_{pid}"
+    
+    is_expanded = data_df.empty or st.session_state.get(plan_confirm_key, False)
+    
+    with st.expander("📥 Обновить план (Excel)", expanded=is_expanded):
+        uploaded_file = st.file_uploader(f"Файл для '{pname}'", type='xlsx', key=plan_upload_key)
+        
+        if uploaded_file:
             
-            if best_match not in matched_stock_data:
-                match_data = stock_df_cleaned[stock_df_cleaned['Name_Stock'].astype(str).str.strip().str.lower() == best_match]
-                
-                total_qty = match_data['Qty_Stock'].sum()
-                all_stores = "; ".join(match_data['Store_Stock'].astype(str).unique().tolist())
-                all_shelves = "; ".join(match_data['Shelf_Stock'].astype(str).unique().tolist())
-                
-                matched_stock_data[best_match] = {
-                    'Qty_Stock_Agg': total_qty,
-                    'Store_Stock_Agg': all_stores,
-                    'Shelf_Stock_Agg': all_shelves
-                }
-
-    matched_df = pd.DataFrame.from_dict(matched_stock_data, orient='index').reset_index()
-    matched_df.rename(columns={'index': 'Name_Stock_Match'}, inplace=True)
-    
-    final_df = pd.merge(
-        project_materials, 
-        matched_df, 
-        on='Name_Stock_Match', 
-        how='left'
-    ).drop_duplicates(subset=['Name_Project']) 
-    
-    result_df = final_df[[
-        'Name_Project', 'unit', 'Qty_Stock_Agg', 'Store_Stock_Agg', 'Shelf_Stock_Agg', 'Match_Score'
-    ]].copy()
-    
-    result_df.columns = ['Материал (План)', 'Ед. изм.', 'Количество (Склад)', 'Склады', 'Номера полок', 'Сходство (%)']
-    
-    result_df['Количество (Склад)'] = result_df['Количество (Склад)'].fillna(0).astype(float).round(2)
-    result_df['Склады'] = result_df['Склады'].fillna('—')
-    result_df['Номера полок'] = result_df['Номера полок'].fillna('—') 
-    
-    result_df['Сходство (%)'] = result_df['Сходство (%)'].apply(lambda x: f"{int(x)}%")
-    
-    st.success("🏁 Сопоставление завершено.")
-    return result_df.sort_values(by=['Сходство (%)', 'Материал (План)'], ascending=[False, True])
-
-
-# #######################################################
-# 🖥️ ЛОГИКА ПРИЛОЖЕНИЯ (Streamlit UI)
-# #######################################################
-
-if not check_password():
-    st.stop()
-
-# --- САЙДБАР ---
-with st.sidebar:
-    st.header("📂 Управление объектами")
-    new_name = st.text_input("Имя нового объекта")
-    if st.button("Добавить объект"):
-        if new_name:
-            if add_project(new_name):
-                st.toast("Объект создан!")
-                st.rerun()
+            can_load = st.session_state.get(plan_confirm_key, False) or data_df.empty
+            
+            if not can_load:
+                st.warning("⚠️ Внимание: Загрузка нового файла обновит текущий **ПЛАН**: изменённые строки будут исправлены, новые добавлены, отсутствующие в файле — исключены из плана. Вся история приходов **будет СОХРАНЕНА**.")
+                if st.button("ПОДТВЕРДИТЬ И ЗАГРУЗИТЬ", key=f"confirm_load_{pid}", type="primary"):
+                    st.session_state[plan_confirm_key] = True
+                    st.rerun() 
+            
+            if can_load:
+                if st.button("ЗАПИСАТЬ В БАЗУ", key=f"btn_{pid}", type="primary"):
+                    try:
+                        summary, errs = load_excel_final(pid, uploaded_file)
+                    except VersionConflict:
+                        st.error("❌ Объект сейчас активно изменяется другими пользователями — попробуйте ещё раз.")
+                    else:
+                        st.session_state[plan_confirm_key] = False
+                        st.session_state[plan_log_key] = (summary, errs)
+                        st.rerun()
+        
+        # Итог загрузки показывается один раз после rerun
+        if plan_log_key in st.session_state:
+            summary, errs = st.session_state.pop(plan_log_key)
+            if summary['same_file']:
+                st.info("Файл не изменился с прошлой загрузки — план уже актуален.")
             else:
-                st.error("Такое имя уже есть")
-    
-    st.divider()
-    
-    with st.expander("💾 Резервное копирование"):
-        st.info("Данные хранятся в файле `.streamlit/secrets.toml`.")
-        st.warning("Для резервного копирования сохраните содержимое секции `[storage]` из этого файла.")
-
-    st.divider()
-    if st.button("Выйти из аккаунта"):
-        logout()
+                st.success(f"План обновлён: добавлено {summary['added']}, изменено {summary['updated']}, "
+                           f"исключено {summary['removed']}, без изменений {summary['unchanged']}")
+            if errs:
+                st.warning(f"⚠️ Замечания при загрузке: {len(errs)}")
+                st.text("\n".join(errs))
+
+    if not data_df.empty:
+        # --- ОБЩАЯ ШКАЛА ---
+        st.divider()
+        total_planned = data_df['planned_qty'].sum()
+        total_shipped = data_df['total'].sum()
+        
+        if total_planned > 0:
+            overall_percent = total_shipped / total_planned
+        else:
+            overall_percent = 0.0
+        
+        bar_value = min(overall_percent, 1.0)
+        st.subheader("Общий прогресс по объекту")
+        st.progress(bar_value, text=f"Выполнение: {overall_percent:.1%} (Всего принято: {total_shipped:.1f} / План: {total_planned:.1f})")
+        
+        st.divider()
 
-# --- ОСНОВНОЕ ОКНО ---
-st.title("🏗️Список всех объектов")
+        # --- ВВОД ПРИХОДА ---
+        st.subheader("Ввод прихода")
+        
+        c1, c2, c3 = st.columns([3, 1, 2])
+        
+        opts = dict(zip(data_df['name'], data_df['id']))
+        
+        with c1:
+            s_name = st.selectbox("Материал", list(opts.keys()), key=f"sel_{pid}")
+            s_id = opts[s_name]
+            curr = data_df[data_df['id']==s_id].iloc[0]
+            st.caption(f"План: {curr['planned_qty']} {curr['unit']} | Факт: {curr['total']:.2f}")
+            
+        input_key = f"num_{pid}"
+        
+        with c2:
+            val = st.number_input("Кол-во", min_value=0.0, step=1.0, key=input_key)
+        
+        with c3:
+            last_worker = st.session_state.get('current_user', WORKERS_LIST[0])
+            who = st.selectbox("Кто принял", WORKERS_LIST, key=f"who_{pid}", index=WORKERS_LIST.index(last_worker) if last_worker in WORKERS_LIST else 0)
+        
+        # --- СКРЫТИЕ ДОПОЛНИТЕЛЬНЫХ ПОЛЕЙ ПОД EXPANDER ---
+        with st.expander("📝 Дополнительные данные (Магазин, Док. №, Прим.)"):
+            r2_c1, r2_c2 = st.columns(2)
+            
+            store_key = f"store_{pid}"
+            doc_key = f"doc_{pid}"
+            note_key = f"note_{pid}"
 
-# Проверка и загрузка данных
-projects = get_projects()
+            if store_key not in st.session_state: st.session_state[store_key] = ""
+            if doc_key not in st.session_state: st.session_state[doc_key] = ""
+            if note_key not in st.session_state: st.session_state[note_key] = ""
+            
+            with r2_c1:
+                store_input = st.text_input("Магазин / Поставщик", key=store_key, value=st.session_state[store_key])
 
-if projects.empty:
-    st.info("Список объектов пуст. Добавьте первый объект в меню слева.")
-else:
-    project_tabs_names = [f"🛠️ {name}" for name in projects['name'].tolist()]
-    tabs = st.tabs(project_tabs_names)
-    
-    for i, tab in enumerate(tabs):
-        pid = int(projects.iloc[i]['id'])
-        pname = projects.iloc[i]['name']
+            with r2_c2:
+                doc_input = st.text_input("Номер документа", key=doc_key, value=st.session_state[doc_key])
+                
+            note_input = st.text_area("Примечание", height=50, key=note_key, value=st.session_state[note_key])
+            
+        # --- БЛОК КНОПОК УПРАВЛЕНИЯ ОПЕРАЦИЕЙ ---
+        st.divider()
+        st.subheader("Управление операцией")
         
-        st.session_state['current_pid'] = pid
+        btn_c1, btn_c2 = st.columns([1, 1])
         
-        with tab:
-            # --- СЕКЦИЯ НАСТРОЕК / УДАЛЕНИЕ ---
-            with st.expander("⚙️ Настройки / Удаление объекта"):
-                # Блок Редактирования Названия
-                st.write("**Редактирование названия**")
-                new_pname = st.text_input("Новое название объекта", value=pname, key=f"edit_name_{pid}")
-                if st.button("📝 Сохранить название", key=f"save_name_{pid}", type="secondary"):
-                    if new_pname and new_pname != pname:
-                        if update_project_name(pid, new_pname):
-                            st.toast("Название обновлено!")
-                            st.rerun()
-                        else:
-                            st.error("Ошибка: Такое название уже используется.")
-                    else:
-                        st.warning("Название не изменилось или пусто.")
-                st.divider()
-
-                # Блок Сброса и Удаления
-                col_del1, col_del2 = st.columns(2)
+        show_undo = st.session_state.get('last_shipment_id') and st.session_state.get('last_shipment_pid') == pid
+        current_user = st.session_state.get('current_user', 'Система')
+        
+        with btn_c1:
+            st.button("Внести (записать приход)", 
+                      key=f"ok_{pid}", 
+                      type="primary",
+                      use_container_width=True, 
+                      on_click=submit_entry_callback,
+                      args=(s_id, val, who, input_key, pid, st.session_state[store_key], st.session_state[doc_key], st.session_state[note_key]) 
+                      )
+        
+        with btn_c2:
+            if st.button("↩️ Отменить последний ввод", 
+                         key=f"undo_{pid}", 
+                         type="secondary",
+                         disabled=not show_undo, 
+                         use_container_width=True
+                         ):
                 
-                confirm_reset_key = f"confirm_reset_{pid}"
-                confirm_delete_key = f"confirm_delete_{pid}"
-
-                with col_del1:
-                    st.write("**Сброс данных** (только история приходов)")
-                    if not st.session_state.get(confirm_reset_key, False):
-                        if st.button("🧹 Сбросить историю", key=f"pre_reset_{pid}"):
-                            st.session_state[confirm_reset_key] = True
-                            st.rerun()
-                    else:
-                        st.warning("Вы уверены?")
-                        col_yes, col_no = st.columns(2)
-                        if col_yes.button("ДА, СБРОСИТЬ", key=f"yes_reset_{pid}", type="primary"):
-                            clear_project_history(pid)
-                            st.session_state[confirm_reset_key] = False
-                            st.toast("История очищена!", icon="↩️")
-                            st.rerun()
-                        if col_no.button("Отмена", key=f"no_reset_{pid}"):
-                            st.session_state[confirm_reset_key] = False
-                            st.rerun()
+                undone = undo_shipment(st.session_state['last_shipment_id'], current_user, project_id=pid)
                 
-                with col_del2:
-                    st.write("**Удаление объекта** (полное)")
-                    if not st.session_state.get(confirm_delete_key, False):
-                        if st.button("❌ Удалить объект", key=f"pre_del_{pid}"):
-                            st.session_state[confirm_delete_key] = True
-                            st.rerun()
-                    else:
-                        st.error("ВНИМАНИЕ: Все данные будут удалены!")
-                        col_yes_d, col_no_d = st.columns(2)
-                        if col_yes_d.button("ДА, УДАЛИТЬ", key=f"yes_del_{pid}", type="primary"):
-                            delete_specific_project(pid)
-                            st.session_state[confirm_delete_key] = False
-                            st.success("Объект удален")
-                            st.rerun()
-                        if col_no_d.button("Отмена", key=f"no_del_{pid}"):
-                            st.session_state[confirm_delete_key] = False
-                            st.rerun()
+                del st.session_state['last_shipment_id']
+                del st.session_state['last_shipment_pid']
+                if undone:
+                    st.toast("Последний приход отменен и добавлен в историю!", icon="↩️")
+                    st.rerun()
+                # Операции нет в истории: её перенесли в архив (sclad.archive) или историю очистили
+                st.error("❌ Операция уже перенесена в архив (или история очищена) — отменить её нельзя.")
+        
+        # --- ПАКЕТНЫЙ ВВОД ПРИХОДА (ФАЙЛ) ---
+        batch_report_key = f"batch_report_{pid}"
+        batch_gen_key = f"batch_gen_{pid}"  # новый ключ загрузчика после записи — файл не запишется дважды
+        
+        with st.expander("📦 Пакетный ввод прихода (CSV / Excel)"):
+            st.caption("Столбцы по порядку: материал (название или id), кол-во, магазин, № документа, примечание. "
+                       "Первая строка — заголовок. Сотрудник — из поля «Кто принял».")
+            batch_file = st.file_uploader("Файл прихода", type=['csv', 'xlsx'],
+                                          key=f"batch_{pid}_{st.session_state.get(batch_gen_key, 0)}")
             
-            # --- ДАННЫЕ (План и История) ---
-            data_df, hist_df = get_data(pid)
+            if batch_file:
+                try:
+                    receipts_df = read_receipts_file(batch_file, batch_file.name)
+                    preview = ingest_shipments(pid, receipts_df, who)
+                except Exception as e:
+                    st.error(f"❌ Не удалось прочитать файл: {e}")
+                    preview = None
+                
+                if preview is not None:
+                    errors_count = int(preview['Статус'].str.startswith('❌').sum())
+                    st.dataframe(preview, hide_index=True, use_container_width=True)
+                    if errors_count:
+                        st.warning(f"⚠️ Строк с ошибками: {errors_count}. Исправьте файл — пакет записывается только целиком.")
+                    
+                    if st.button(f"Записать {len(preview)} строк", key=f"batch_ok_{pid}", type="primary",
+                                 disabled=bool(errors_count) or preview.empty):
+                        batch_file.seek(0)
+                        st.session_state[batch_report_key] = ingest_shipments(pid, read_receipts_file(batch_file, batch_file.name), who, commit=True)
+                        st.session_state[batch_gen_key] = st.session_state.get(batch_gen_key, 0) + 1
+                        st.session_state['current_user'] = who
+                        st.rerun()
+            
+            # Отчёт о записанном пакете показывается один раз после rerun
+            if batch_report_key in st.session_state:
+                report = st.session_state.pop(batch_report_key)
+                st.success(f"✅ Записано операций: {len(report)}")
+                st.dataframe(report, hide_index=True, use_container_width=True)
+        
+        # --- НОВЫЙ БЛОК: Сравнение с фактическими остатками (С СОХРАНЕНИЕМ ССЫЛКИ) ---
+        st.divider()
+        
+        with st.expander("🔍 **Сравнение с фактическими остатками склада (по URL)**"):
+            st.info(f"Сравнение будет произведено с порогом сходства **{FUZZY_MATCH_THRESHOLD}%**.")
+            exhaustive = st.checkbox("🔬 Полный перебор без индекса (медленно, для проверки)", key=f"exhaustive_{pid}")
             
-            plan_upload_key = f"u_{pid}"
-            plan_confirm_key = f"plan_confirm_{pid}"
+            col_url, col_btn = st.columns([4, 1])
             
-            is_expanded = data_df.empty or st.session_state.get(plan_confirm_key, False)
+            current_url = st.session_state.get(STOCK_URL_KEY, "")
             
-            with st.expander("📥 Обновить план (Excel)", expanded=is_expanded):
-                uploaded_file = st.file_uploader(f"Файл для '{pname}'", type='xlsx', key=plan_upload_key)
+            with col_url:
+                new_url = st.text_input(
+                    "URL-ссылка на Excel/Google Таблицу", 
+                    value=current_url, 
+                    key=f"input_url_{pid}",
+                    help="Вставьте ссылку Google Таблицы (с экспортом в xlsx) или прямую ссылку на Excel-файл."
+                )
                 
-                if uploaded_file:
-                    
-                    can_load = st.session_state.get(plan_confirm_key, False) or data_df.empty
-                    
-                    if not can_load:
-                        st.warning("⚠️ Внимание: Загрузка нового файла заменит текущий **ПЛАН** (список материалов), но вся история приходов **будет СОХРАНЕНА**.")
-                        if st.button("ПОДТВЕРДИТЬ И ЗАГРУЗИТЬ", key=f"confirm_load_{pid}", type="primary"):
-                            st.session_state[plan_confirm_key] = True
-                            st.rerun() 
-                    
-                    if can_load:
-                        if st.button("ЗАПИСАТЬ В БАЗУ", key=f"btn_{pid}", type="primary"):
-                            df_preview = pd.read_excel(uploaded_file)
-                            cnt, errs = load_excel_final(pid, df_preview)
-                            st.session_state[plan_confirm_key] = False
-                            st.success(f"Обновлено: {cnt} строк")
+            with col_btn:
+                st.text(" ")
+                if st.button("💾 Сохранить и сравнить", key=f"save_compare_btn_{pid}", type="primary", use_container_width=True):
+                    if not new_url:
+                        st.error("Поле ссылки не может быть пустым.")
+                    elif data_df.empty:
+                        st.error("Сначала загрузите план материалов для текущего объекта.")
+                    else:
+                        st.session_state[STOCK_URL_KEY] = new_url
+                        if start_stock_comparison(pid, version, new_url, data_df, exhaustive=exhaustive):
                             st.rerun()
-
-            if not data_df.empty:
-                # --- ОБЩАЯ ШКАЛА ---
-                st.divider()
-                total_planned = data_df['planned_qty'].sum()
-                total_shipped = data_df['total'].sum()
-                
-                if total_planned > 0:
-                    overall_percent = total_shipped / total_planned
-                else:
-                    overall_percent = 0.0
                 
-                bar_value = min(overall_percent, 1.0)
-                st.subheader("Общий прогресс по объекту")
-                st.progress(bar_value, text=f"Выполнение: {overall_percent:.1%} (Всего принято: {total_shipped:.1f} / План: {total_planned:.1f})")
+            # КНОПКА ОБНОВЛЕНИЯ ПО СОХРАНЕННОЙ ССЫЛКЕ
+            if current_url:
+                st.markdown("---")
+                st.success(f"Текущая сохраненная ссылка: **{current_url[:60]}...**")
                 
-                st.divider()
+                if st.button("🔄 Обновить данные по сохраненной ссылке", key=f"refresh_compare_btn_{pid}", type="secondary", use_container_width=True):
+                    if data_df.empty:
+                        st.error("Сначала загрузите план материалов для текущего объекта.")
+                    elif start_stock_comparison(pid, version, current_url, data_df, exhaustive=exhaustive):
+                        st.rerun()
 
-                # --- ВВОД ПРИХОДА ---
-                st.subheader("Ввод прихода")
-                
-                c1, c2, c3 = st.columns([3, 1, 2])
-                
-                opts = dict(zip(data_df['name'], data_df['id']))
-                
-                with c1:
-                    s_name = st.selectbox("Материал", list(opts.keys()), key=f"sel_{pid}")
-                    s_id = opts[s_name]
-                    curr = data_df[data_df['id']==s_id].iloc[0]
-                    st.caption(f"План: {curr['planned_qty']} {curr['unit']} | Факт: {curr['total']:.2f}")
-                    
-                input_key = f"num_{pid}"
-                
-                with c2:
-                    val = st.number_input("Кол-во", min_value=0.0, step=1.0, key=input_key)
-                
-                with c3:
-                    who = st.selectbox("Кто принял", WORKERS_LIST, key=f"who_{pid}", value=st.session_state.get('current_user', WORKERS_LIST[0]))
+            # РЕЗУЛЬТАТ: сравнение идёт в фоне, смена виджетов его не прерывает
+            render_stock_comparison(pid, pname)
+
+        
+        # --- ДЕТАЛИЗАЦИЯ (СКРЫТАЯ) ---
+        st.divider()
+        
+        with span('render_details', rows=len(data_df)), st.expander("📊 Детализация (Остатки) — Нажмите, чтобы развернуть", expanded=False):
+            render_details(pid, version)
+
+        # --- ИСТОРИЯ ---
+        if not hist_df.empty:
+            st.divider()
+            with span('render_history', rows=len(hist_df)), st.expander("📜 История операций (Скачать)"):
+                # Отображаем как HTML для цвета, постранично
+                render_history(pid, version)
                 
-                # --- СКРЫТИЕ ДОПОЛНИТЕЛЬНЫХ ПОЛЕЙ ПОД EXPANDER ---
-                with st.expander("📝 Дополнительные данные (Магазин, Док. №, Прим.)"):
-                    r2_c1, r2_c2 = st.columns(2)
-                    
-                    store_key = f"store_{pid}"
-                    doc_key = f"doc_{pid}"
-                    note_key = f"note_{pid}"
+                # Скачивание (исходные данные без HTML-разметки); файл готовится по нажатию
+                export_buttons('history_export', lambda fmt: history_export(pid, version, fmt), key=f"dl_{pid}",
+                               label="Скачать историю", file_stem=f"История_{pname}", cache='hit')
+                # Архив (операции, перенесённые сжатием истории) читается с диска только по нажатию
+                export_buttons('archive_export', lambda fmt: archive_export(pid, version, fmt), key=f"dl_arch_{pid}",
+                               label="Скачать архив", file_stem=f"Архив_{pname}", cache='hit')
 
-                    if store_key not in st.session_state: st.session_state[store_key] = ""
-                    if doc_key not in st.session_state: st.session_state[doc_key] = ""
-                    if note_key not in st.session_state: st.session_state[note_key] = ""
-                    
-                    with r2_c1:
-                        store_input = st.text_input("Магазин / Поставщик", key=store_key, value=st.session_state[store_key])
 
-                    with r2_c2:
-                        doc_input = st.text_input("Номер документа", key=doc_key, value=st.session_state[doc_key])
-                        
-                    note_input = st.text_area("Примечание", height=50, key=note_key, value=st.session_state[note_key])
-                    
-                # --- БЛОК КНОПОК УПРАВЛЕНИЯ ОПЕРАЦИЕЙ ---
-                st.divider()
-                st.subheader("Управление операцией")
-                
-                btn_c1, btn_c2 = st.columns([1, 1])
-                
-                show_undo = st.session_state.get('last_shipment_id') and st.session_state.get('last_shipment_pid') == pid
-                current_user = st.session_state.get('current_user', 'Система')
-                
-                with btn_c1:
-                    st.button("Внести (записать приход)", 
-                              key=f"ok_{pid}", 
-                              type="primary",
-                              use_container_width=True, 
-                              on_click=submit_entry_callback,
-                              args=(s_id, val, who, input_key, pid, st.session_state[store_key], st.session_state[doc_key], st.session_state[note_key]) 
-                              )
-                
-                with btn_c2:
-                    if st.button("↩️ Отменить последний ввод", 
-                                 key=f"undo_{pid}", 
-                                 type="secondary",
-                                 disabled=not show_undo, 
-                                 use_container_width=True
-                                 ):
-                        
-                        undo_shipment(st.session_state['last_shipment_id'], current_user)
-                        
-                        del st.session_state['last_shipment_id']
-                        del st.session_state['last_shipment_pid']
-                        st.toast("Последний приход отменен и добавлен в историю!", icon="↩️")
-                        st.rerun()
-                
-                # --- НОВЫЙ БЛОК: Сравнение с фактическими остатками (С СОХРАНЕНИЕМ ССЫЛКИ) ---
-                st.divider()
-                
-                with st.expander("🔍 **Сравнение с фактическими остатками склада (по URL)**"):
-                    st.info(f"Сравнение будет произведено с порогом сходства **{FUZZY_MATCH_THRESHOLD}%**.")
-                    
-                    col_url, col_btn = st.columns([4, 1])
-                    
-                    current_url = st.session_state.get(STOCK_URL_KEY, "")
-                    
-                    with col_url:
-                        new_url = st.text_input(
-                            "URL-ссылка на Excel/Google Таблицу", 
-                            value=current_url, 
-                            key=f"input_url_{pid}",
-                            help="Вставьте ссылку Google Таблицы (с экспортом в xlsx) или прямую ссылку на Excel-файл."
-                        )
-                        
-                    with col_btn:
-                        st.text(" ")
-                        if st.button("💾 Сохранить и сравнить", key=f"save_compare_btn_{pid}", type="primary", use_container_width=True):
-                            if new_url:
-                                st.session_state[STOCK_URL_KEY] = new_url
-                                st.session_state['trigger_compare'] = new_url
-                                st.rerun()
-                            else:
-                                st.error("Поле ссылки не может быть пустым.")
-                        
-                    # КНОПКА ОБНОВЛЕНИЯ ПО СОХРАНЕННОЙ ССЫЛКЕ
-                    if current_url:
-                        st.markdown("---")
-                        st.success(f"Текущая сохраненная ссылка: **{current_url[:60]}...**")
-                        
-                        if st.button("🔄 Обновить данные по сохраненной ссылке", key=f"refresh_compare_btn_{pid}", type="secondary", use_container_width=True):
-                            st.session_state['trigger_compare'] = current_url
-                            st.rerun()
+# #######################################################
+# 🖥️ ЛОГИКА ПРИЛОЖЕНИЯ (Streamlit UI)
+# #######################################################
 
-                    # ЛОГИКА ОТОБРАЖЕНИЯ РЕЗУЛЬТАТОВ
-                    if st.session_state.get('trigger_compare'):
-                        url_to_use = st.session_state.pop('trigger_compare')
-                        
-                        if data_df.empty:
-                            st.error("Сначала загрузите план материалов для текущего объекта.")
-                        else:
-                            with st.spinner('Обработка файла и нечеткое сопоставление...'):
-                                comparison_result = compare_with_stock_excel(url_to_use, data_df)
-                            
-                            if not comparison_result.empty:
-                                
-                                found_df = comparison_result[comparison_result['Склады'] != '—']
-                                not_found_df = comparison_result[comparison_result['Склады'] == '—']
-                                
-                                st.subheader(f"✅ Найдено совпадений: {len(found_df)} из {len(comparison_result)}")
-                                st.dataframe(found_df, use_container_width=True)
-                                
-                                if not not_found_df.empty:
-                                    st.subheader(f"❌ Материалы из плана, не найденные в файле остатков:")
-                                    st.dataframe(not_found_df.drop(columns=['Количество (Склад)', 'Склады', 'Номера полок', 'Сходство (%)']), use_container_width=True)
+def main():
+    """Страница приложения. Не выполняется при импорте модуля (бенчмарки, скрипты)."""
+    st.set_page_config(page_title="Склад обьекта", layout="wide")
+    
+    # Каждый перезапуск страницы — один проход замеров; метка сессии отличает пользователей в файле замеров
+    session = st.session_state.setdefault(PROFILE_SESSION_KEY, uuid.uuid4().hex[:8])
+    with get_profiler().run(session=session):
+        render_page()
+
+def render_page():
+    st.sidebar.info(f"Текущая рабочая директория: {os.getcwd()}")
+    
+    if not check_password():
+        st.stop()
+
+    # --- САЙДБАР ---
+    with st.sidebar:
+        st.header("📂 Управление объектами")
+        new_name = st.text_input("Имя нового объекта")
+        if st.button("Добавить объект"):
+            if new_name:
+                if add_project(new_name):
+                    st.toast("Объект создан!")
+                    st.rerun()
+                else:
+                    st.error("Такое имя уже есть")
 
-                
-                # --- ДЕТАЛИЗАЦИЯ (СКРЫТАЯ) ---
-                st.divider()
-                
-                with st.expander("📊 Детализация (Остатки) — Нажмите, чтобы развернуть", expanded=False):
-                    
-                    data_df = data_df.sort_values(by=['prog', 'name'], ascending=[False, True])
-                    
-                    for index, row in data_df.iterrows():
-                        if row['prog'] >= 1.0:
-                            icon = "✅"
-                        elif row['prog'] > 0:
-                            icon = "⏳"
-                        else:
-                            icon = "⚪"
-                        
-                        label = f"{icon} {row['name']} — {row['prog']:.0%}"
-                        
-                        with st.expander(label):
-                            c_det1, c_det2, c_det3 = st.columns(3)
-                            with c_det1:
-                                st.caption("Ед. изм.")
-                                st.write(row['unit'])
-                            with c_det2:
-                                st.caption("План")
-                                st.write(f"{row['planned_qty']:.2f}")
-                            with c_det3:
-                                st.caption("Факт")
-                                st.write(f"{row['total']:.2f}")
-                            
-                            ostalos = row['planned_qty'] - row['total']
-                            if ostalos > 0:
-                                st.info(f"Осталось принять: {ostalos:.2f} {row['unit']}")
-                            elif ostalos < 0:
-                                st.warning(f"Перерасход: {abs(ostalos):.2f} {row['unit']}")
-                            else:
-                                st.success("План выполнен!")
-
-                # --- ИСТОРИЯ ---
-                if not hist_df.empty:
-                    st.divider()
-                    with st.expander("📜 История операций (Скачать)"):
-                        
-                        def format_qty_and_type(row):
-                            qty = row['Кол-во']
-                            op_type = row['Тип опер.']
-                            
-                            if op_type == 'Отмена':
-                                color = 'red'
-                                qty_str = f"- {abs(qty):.2f}"
-                            elif op_type == 'Приход' and qty > 0:
-                                color = 'green'
-                                qty_str = f"+ {qty:.2f}"
-                            else:
-                                color = 'black'
-                                qty_str = f"{qty:.2f}"
-                                
-                            return f"<span style='color: {color}; font-weight: bold;'>{qty_str}</span>"
-
-                        
-                        display_df = hist_df.copy()
-                        # Форматируем столбец "Кол-во"
-                        display_df['Кол-во'] = display_df.apply(format_qty_and_type, axis=1)
-
-                        # Отображаем как HTML для цвета
-                        st.markdown(display_df.drop(columns=['id', 'Тип опер.']).to_html(escape=False, index=False), unsafe_allow_html=True)
-                        
-                        # Скачивание (используем исходный DataFrame без HTML-разметки)
-                        excel_data = to_excel(hist_df.drop(columns=['id']))
-                        st.download_button(
-                            label="📥 Скачать историю (Excel)",
-                            data=excel_data,
-                            file_name=f"История_{pname}.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                            key=f"dl_{pid}"
-                        )
+        st.divider()
+
+        with st.expander("💾 Резервное копирование"):
+            current_storage = storage()
+            if isinstance(current_storage, JournalStore):
+                st.info(f"Данные хранятся в папке `{current_storage.data_dir}` (`index/` — список объектов, `projects/<id>/` — данные каждого объекта).")
+                st.warning("Для резервного копирования сохраните эту папку целиком.")
+            else:
+                st.info(f"Данные хранятся в SQL-базе `{current_storage.engine.url.render_as_string(hide_password=True)}`.")
+                st.warning("Для резервного копирования используйте средства самой СУБД (pg_dump и т.п.).")
+
+        with st.expander("🩺 Проверка целостности"):
+            st.caption("Сверяет сохранённые итоги по материалам с пересчётом по всей истории операций.")
+            if st.button("Проверить итоги", key="check_totals_btn"):
+                drift_df = storage().check_totals()
+                if drift_df.empty:
+                    st.success("✅ Итоги совпадают с историей операций.")
+                else:
+                    st.error(f"❌ Расхождения по {len(drift_df)} материалам:")
+                    st.dataframe(drift_df, use_container_width=True)
 
+        if st.secrets.get('profiling', {}).get('panel', False):
+            with st.expander("⏱️ Профилирование"):
+                render_profiling_panel()
+
+        st.divider()
+        if st.button("Выйти из аккаунта"):
+            logout()
+
+    # --- ОСНОВНОЕ ОКНО ---
+    st.title("🏗️Список всех объектов")
+
+    # Проверка и загрузка данных
+    projects = get_projects()
+
+    if projects.empty:
+        st.info("Список объектов пуст. Добавьте первый объект в меню слева.")
+    else:
+        project_names = dict(zip(projects['id'].astype(int), projects['name']))
+        project_ids = list(project_names.keys())
+
+        # Последний выбранный объект хранится в session_state; если его удалили — берём первый
+        if st.session_state.get(ACTIVE_PROJECT_KEY) not in project_names:
+            st.session_state[ACTIVE_PROJECT_KEY] = project_ids[0]
+
+        # Считается и рисуется только выбранный объект, а не все вкладки сразу
+        pid = st.selectbox(
+            "Объект",
+            project_ids,
+            format_func=lambda x: f"🛠️ {project_names[x]}",
+            key=ACTIVE_PROJECT_KEY,
+        )
+        st.session_state['current_pid'] = pid
 
+        with span('render_project', project=pid):
+            render_project(pid, project_names[pid])
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Генератор синтетических данных склада для бенчмарков.
+
+    python bench/generate.py --out /tmp/sclad-bench --projects 10 --materials 2000 --shipments 10000
+
+Создаёт базу (N объектов × M материалов плана × K операций на объект) через
+интерфейс Storage, файл плана (xlsx) и файл остатков (xlsx, 17 столбцов как в
+выгрузке 1С) с «шумными» названиями: другой регистр и порядок слов, опечатки,
+латинские буквы вместо кириллических, лишние пробелы.
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MATERIAL_TYPES = [
+    'Цемент', 'Песок строительный', 'Щебень гранитный', 'Арматура', 'Кабель ВВГнг', 'Кабель NYM',
+    'Провод ПуГВ', 'Труба ПНД', 'Труба ПП', 'Труба стальная', 'Профиль ПП', 'Профиль ПН',
+    'Гипсокартон', 'Саморез', 'Дюбель-гвоздь', 'Анкер', 'Болт', 'Гайка', 'Шайба', 'Уголок стальной',
+    'Швеллер', 'Лист оцинкованный', 'Доска обрезная', 'Брус', 'Фанера', 'Утеплитель минвата',
+    'Пена монтажная', 'Герметик', 'Грунтовка', 'Краска фасадная', 'Шпатлёвка', 'Штукатурка',
+    'Клей плиточный', 'Плитка керамическая', 'Кирпич облицовочный', 'Блок газобетонный',
+    'Сетка кладочная', 'Хомут', 'Муфта', 'Отвод', 'Тройник', 'Кран шаровый', 'Автомат',
+    'Розетка', 'Выключатель', 'Гофротруба', 'Кабель-канал', 'Изолента', 'Лента ФУМ', 'Мешок',
+]
+MATERIAL_SPECS = [
+    'М500', 'М400', 'А500С', 'd12', 'd16', 'd20', 'd32', 'd50', '3х2.5', '3х1.5', '5х4', '2х0.75',
+    '12.5мм', '9.5мм', '50х50х5', '63х63х6', '16П', '20П', '4.2х25', '3.5х35', '6х40', 'М8', 'М10',
+    'М12', '25х150х6000', '100х100х6000', '1500х3000', 'ГКЛВ', 'ГКЛ', '750мл', '10л', '25кг',
+    '50кг', 'С25', 'IP44', '16А', '25А', 'белый', 'серый', 'оцинк.', 'ПЭ100', 'SDR11', 'PN20',
+]
+MATERIAL_BRANDS = ['', '', '', 'Кнауф', 'Ceresit', 'Tikkurila', 'ТЕХНОНИКОЛЬ', 'IEK', 'Legrand', 'Rehau', 'Волма']
+UNITS = ['шт', 'м', 'кг', 'т', 'м2', 'м3', 'уп', 'л', 'компл']
+STORES = ['Леруа Мерлен', 'Петрович', 'ВсеИнструменты', 'Максидом', 'База №1', 'Поставщик ООО "СтройТорг"']
+
+# Латинские буквы, которые в выгрузках часто стоят вместо кириллических
+HOMOGLYPHS = {'А': 'A', 'В': 'B', 'Е': 'E', 'К': 'K', 'М': 'M', 'Н': 'H', 'О': 'O', 'Р': 'P', 'С': 'C', 'Т': 'T', 'Х': 'X',
+              'а': 'a', 'е': 'e', 'о': 'o', 'р': 'p', 'с': 'c', 'х': 'x'}
+
+def material_names(count, rng):
+    """count разных правдоподобных названий материалов."""
+    names, seen = [], set()
+    while len(names) < count:
+        parts = [rng.choice(MATERIAL_TYPES)] + rng.sample(MATERIAL_SPECS, rng.randint(1, 2))
+        brand = rng.choice(MATERIAL_BRANDS)
+        if brand:
+            parts.append(brand)
+        name = ' '.join(parts)
+        if name in seen:
+            name = f'{name} арт.{rng.randint(100, 99999)}'
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+def noisy_name(name, rng):
+    """Название в том виде, в каком оно может оказаться в выгрузке остатков."""
+    words = name.split()
+    roll = rng.random()
+    if roll < 0.25 and len(words) > 1:
+        i = rng.randrange(len(words) - 1)
+        words[i], words[i + 1] = words[i + 1], words[i]
+    text = ' '.join(words)
+
+    roll = rng.random()
+    if roll < 0.2:
+        text = text.upper()
+    elif roll < 0.35:
+        text = text.lower()
+
+    if rng.random() < 0.2 and len(text) > 6:
+        # Опечатка: пропуск, повтор или замена буквы
+        i = rng.randrange(1, len(text) - 1)
+        kind = rng.randrange(3)
+        if kind == 0:
+            text = text[:i] + text[i + 1:]
+        elif kind == 1:
+            text = text[:i] + text[i] + text[i:]
+        else:
+            text = text[:i] + rng.choice('аеиоуклмнрст') + text[i + 1:]
+
+    if rng.random() < 0.15:
+        text = ''.join(HOMOGLYPHS.get(ch, ch) if rng.random() < 0.5 else ch for ch in text)
+    if rng.random() < 0.1:
+        text = f'  {text} '
+    return text
+
+def plan_frame(names, rng):
+    """Лист плана: название, ед. изм., количество (часть — с запятой и неразрывным пробелом)."""
+    rows = []
+    for name in names:
+        qty = round(rng.uniform(1, 5000), rng.choice([0, 1, 2]))
+        qty_text = qty if rng.random() < 0.7 else f'{qty:,.2f}'.replace(',', '\xa0').replace('.', ',')
+        rows.append([name, rng.choice(UNITS), qty_text])
+    return pd.DataFrame(rows, columns=['Наименование', 'Ед. изм.', 'Количество'])
+
+def stock_frame(names, extra_rows, rng):
+    """Лист остатков в формате выгрузки: 17 столбцов, название в 1-м, склад — 12-м, кол-во — 13-м, полка — 16-м."""
+    rows = []
+    pool = list(names) + material_names(extra_rows, rng)
+    for name in pool:
+        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+            row = [None] * 17
+            row[0] = rng.randint(1, 10 ** 6)
+            row[1] = noisy_name(name, rng)
+            row[12] = rng.choice(['Основной', 'Склад №2', 'Контейнер', 'Объект'])
+            row[13] = round(rng.uniform(0, 500), 2)
+            row[16] = f'{rng.choice("АБВГД")}-{rng.randint(1, 40)}'
+            rows.append(row)
+    rng.shuffle(rows)
+    return pd.DataFrame(rows)
+
+def receipts_frame(names, count, rng):
+    """Пакет приходов: материал (название с шумом или id), кол-во, магазин, № док., примечание."""
+    rows = []
+    for i in range(count):
+        name = rng.choice(names)
+        material = name.lower() if rng.random() < 0.5 else name
+        rows.append([material, str(round(rng.uniform(1, 100), 1)).replace('.', ','),
+                     rng.choice(STORES), f'УПД-{rng.randint(1, 9999)}', ''])
+    return pd.DataFrame(rows, columns=['Материал', 'Кол-во', 'Магазин', '№ Док.', 'Примечание'])
+
+def generate_database(store, n_projects, n_materials, n_shipments, rng, batch_size=5000):
+    """Заполняет хранилище: объекты, планы и операции. Возвращает {pid: [названия материалов]}."""
+    from app import WORKERS_LIST
+
+    plans = {}
+    start = datetime(2025, 1, 1)
+    for p in range(n_projects):
+        name = f'Объект {p + 1:03d} ({rng.choice(["ЖК", "ТЦ", "Школа", "Склад", "Офис"])})'
+        store.add_project(name)
+        pid = int(store.projects().set_index('name').loc[name, 'id'])
+
+        names = material_names(n_materials, rng)
+        plan = plan_frame(names, rng)
+        inserts = [{'project_id': pid, 'name': row_name, 'unit': unit, 'planned_qty': rng.uniform(1, 5000)}
+                   for row_name, unit in zip(plan['Наименование'], plan['Ед. изм.'])]
+        store.apply_plan_diff(pid, inserts, [], [], plan_hash=None)
+        plans[pid] = names
+
+        material_ids = store.project_materials(pid)['id'].astype(int).tolist()
+        for offset in range(0, n_shipments, batch_size):
+            rows = []
+            for i in range(offset, min(offset + batch_size, n_shipments)):
+                rows.append({
+                    'material_id': rng.choice(material_ids),
+                    'qty': round(rng.uniform(1, 100), 2),
+                    'user_name': rng.choice(WORKERS_LIST[1:]),
+                    'arrival_date': (start + timedelta(minutes=7 * i)).strftime('%Y-%m-%d %H:%M:%S'),
+                    'store': rng.choice(STORES),
+                    'doc_number': f'УПД-{rng.randint(1, 99999)}',
+                    'note': '',
+                    'op_type': 'Приход',
+                })
+            store.add_shipments(rows)
+    return plans
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетическая база склада, план и остатки для бенчмарков')
+    parser.add_argument('--out', required=True, help='папка для данных')
+    parser.add_argument('--projects', type=int, default=5)
+    parser.add_argument('--materials', type=int, default=500, help='строк плана на объект')
+    parser.add_argument('--shipments', type=int, default=2000, help='операций на объект')
+    parser.add_argument('--stock-extra', type=int, default=2000, help='названий на складе, которых нет в плане')
+    parser.add_argument('--backend', choices=['journal', 'sql'], default='journal')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    from sclad.journal import JournalStore
+    from sclad.sql import SqlStorage
+
+    rng = random.Random(args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    data_dir = os.path.join(args.out, 'data')
+    if args.backend == 'sql':
+        store = SqlStorage(f"sqlite:///{os.path.join(data_dir, 'sclad.db')}")
+    else:
+        store = JournalStore(data_dir)
+
+    plans = generate_database(store, args.projects, args.materials, args.shipments, rng)
+    first_plan = next(iter(plans.values()))
+    plan_frame(first_plan, rng).to_excel(os.path.join(args.out, 'plan.xlsx'), index=False)
+    stock_frame(first_plan, args.stock_extra, rng).to_excel(os.path.join(args.out, 'stock.xlsx'), index=False, header=False)
+    print(f'Готово: {args.out}')
+
+if __name__ == '__main__':
+    main()
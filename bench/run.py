@@ -0,0 +1,223 @@
+"""
+Бенчмарки без сервера Streamlit: время и пиковая память основных операций на разных объёмах.
+
+    python bench/run.py                         # масштабы small и medium
+    python bench/run.py --scales small,large --backend sql
+
+Для каждого масштаба данные генерируются один раз (bench/generate.py) и кэшируются
+в --work. Каждый проход идёт в отдельном процессе на копии данных: сначала замер
+времени, затем — памяти (tracemalloc замедляет код, поэтому отдельно).
+Результаты пишутся в bench/results/<время>.json.
+"""
+
+import argparse
+import functools
+import http.server
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+SCALES = {
+    'small': {'projects': 3, 'materials': 200, 'shipments': 1000, 'stock_extra': 1000},
+    'medium': {'projects': 10, 'materials': 2000, 'shipments': 10000, 'stock_extra': 5000},
+    'large': {'projects': 30, 'materials': 20000, 'shipments': 50000, 'stock_extra': 20000},
+}
+REPEAT = 20  # повторов для быстрых операций (берётся медиана)
+RECEIPTS_BATCH = 200  # строк в пакете приходов
+
+# --- Рабочий процесс: замеры на одной копии данных ---
+
+class Probe:
+    """Замер одной операции: время (mode='time') или пик памяти сверх текущей (mode='memory')."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.results = []
+        if mode == 'memory':
+            tracemalloc.start()
+
+    def measure(self, op, func, repeat=1):
+        if self.mode == 'memory':
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            value = func()
+            _, peak = tracemalloc.get_traced_memory()
+            self.results.append({'op': op, 'peak_mb': round((peak - current) / 2 ** 20, 3)})
+            return value
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            value = func()
+            timings.append(time.perf_counter() - start)
+        self.results.append({'op': op, 'seconds': round(statistics.median(timings), 6), 'repeat': repeat})
+        return value
+
+def serve_directory(directory):
+    """Файл остатков раздаётся локальным HTTP-сервером (с Last-Modified, как Google Таблицы)."""
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=directory)
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+def run_worker(workdir, mode):
+    os.chdir(workdir)
+    logging.disable(logging.WARNING)  # предупреждения Streamlit о работе без сервера
+    sys.path.insert(0, ROOT)
+    probe = Probe(mode)
+    rng = random.Random(7)
+
+    # Запуск CLI (отдельный процесс): справка без загрузки данных и список объектов
+    cli = [sys.executable, '-m', 'sclad']
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    probe.measure('cli_help', lambda: subprocess.run(cli + ['--help'], env=env, check=True, capture_output=True))
+    probe.measure('cli_projects', lambda: subprocess.run(cli + ['projects'], env=env, check=True, capture_output=True))
+
+    probe.measure('import_core', lambda: __import__('sclad.project'))
+    app = probe.measure('import_app', lambda: __import__('app'))
+    import pandas as pd
+    from bench.generate import receipts_frame
+    from sclad.jobs import Job
+    from sclad.receipts import RECEIPT_COLUMNS
+
+    store = probe.measure('open_storage', app.get_storage)
+    projects = app.get_projects()
+    pid = int(projects['id'].iloc[0])
+
+    probe.measure('get_data_all_projects_cold', lambda: [app.get_data(p) for p in projects['id']])
+    version = app.storage().version(pid)
+    data_df, _ = probe.measure('get_data_warm', lambda: app.get_data(pid, version), repeat=REPEAT)
+    probe.measure('history_export', lambda: app.history_export(pid, version, 'xlsx'))
+
+    material_ids = data_df['id'].astype(int).tolist()
+    probe.measure('add_shipment', lambda: app.add_shipment(
+        rng.choice(material_ids), 1.0, 'Бенчмарк', datetime.now(), '', '', ''), repeat=REPEAT)
+
+    names = data_df['name'].tolist()
+    receipts = receipts_frame(names, RECEIPTS_BATCH, rng)
+    receipts.columns = RECEIPT_COLUMNS
+    probe.measure('ingest_shipments_batch', lambda: app.ingest_shipments(pid, receipts, 'Бенчмарк', commit=True))
+
+    # Импорт плана: новый объект, повторная загрузка с изменениями, тот же файл
+    store.add_project('Бенчмарк: импорт плана')
+    new_pid = int(app.get_projects().set_index('name').loc['Бенчмарк: импорт плана', 'id'])
+    with open('plan.xlsx', 'rb') as f:
+        plan_bytes = f.read()
+    probe.measure('import_plan_new', lambda: app.load_excel_final(new_pid, io.BytesIO(plan_bytes)))
+
+    # 5% строк с другим количеством
+    changed = pd.read_excel(io.BytesIO(plan_bytes))
+    changed.loc[changed.sample(frac=0.05, random_state=1).index, 'Количество'] = 1.0
+    changed_file = io.BytesIO()
+    changed.to_excel(changed_file, index=False)
+    changed_bytes = changed_file.getvalue()
+    probe.measure('import_plan_diff', lambda: app.load_excel_final(new_pid, io.BytesIO(changed_bytes)))
+    probe.measure('import_plan_same_file', lambda: app.load_excel_final(new_pid, io.BytesIO(changed_bytes)))
+
+    # Сравнение с остатками: первый раз (скачивание, разбор, индекс, сопоставление) и повторно (304 + память)
+    url = serve_directory(workdir) + '/stock.xlsx'
+    data_df, _ = app.get_data(pid)
+    # Тело фонового задания — синхронно, без пула
+    probe.measure('compare_stock_cold', lambda: app.compare_with_stock_job(Job('bench'), url, data_df))
+    probe.measure('compare_stock_warm', lambda: app.compare_with_stock_job(Job('bench'), url, data_df))
+
+    probe.measure('check_totals', store.check_totals)
+    print(json.dumps(probe.results, ensure_ascii=False))
+
+# --- Управляющий процесс ---
+
+def prepare_scale(work, scale, backend, seed):
+    """Сгенерированные данные масштаба (создаются один раз и переиспользуются)."""
+    params = SCALES[scale]
+    pristine = os.path.join(work, f'{scale}-{backend}-{seed}')
+    if not os.path.exists(os.path.join(pristine, 'stock.xlsx')):
+        shutil.rmtree(pristine, ignore_errors=True)
+        subprocess.run([
+            sys.executable, os.path.join(ROOT, 'bench', 'generate.py'), '--out', pristine,
+            '--projects', str(params['projects']), '--materials', str(params['materials']),
+            '--shipments', str(params['shipments']), '--stock-extra', str(params['stock_extra']),
+            '--backend', backend, '--seed', str(seed),
+        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return pristine
+
+def run_pass(pristine, backend, mode):
+    workdir = pristine + f'-run-{mode}'
+    shutil.rmtree(workdir, ignore_errors=True)
+    shutil.copytree(pristine, workdir)
+
+    # Хранилище настраивается так же, как в приложении — через .streamlit/secrets.toml
+    os.makedirs(os.path.join(workdir, '.streamlit'), exist_ok=True)
+    with open(os.path.join(workdir, '.streamlit', 'secrets.toml'), 'w', encoding='utf-8') as f:
+        if backend == 'sql':
+            f.write('[storage]\nbackend = "sql"\nurl = "sqlite:///data/sclad.db"\n')
+        else:
+            f.write('[storage]\nbackend = "journal"\ndata_dir = "data"\n')
+
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', workdir, '--mode', mode],
+                               check=True, capture_output=True, text=True)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def git_commit():
+    try:
+        return subprocess.run(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки склада без сервера Streamlit')
+    parser.add_argument('--scales', default='small,medium', help=f'через запятую: {", ".join(SCALES)}')
+    parser.add_argument('--backend', choices=['journal', 'sql'], default='journal')
+    parser.add_argument('--work', default=os.path.join(ROOT, 'bench', '.data'), help='папка для сгенерированных данных')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='файл результатов (по умолчанию bench/results/<время>.json)')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--mode', default='time', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.mode)
+        return
+
+    started = datetime.now(timezone.utc)
+    rows = []
+    for scale in args.scales.split(','):
+        pristine = prepare_scale(args.work, scale, args.backend, args.seed)
+        timings = run_pass(pristine, args.backend, 'time')
+        memory = {row['op']: row['peak_mb'] for row in run_pass(pristine, args.backend, 'memory')}
+        for row in timings:
+            rows.append({'scale': scale, **SCALES[scale], **row, 'peak_mb': memory.get(row['op'])})
+            print(f"{scale:<8} {row['op']:<28} {row['seconds'] * 1000:>10.1f} ms {memory.get(row['op'], 0):>9.1f} MB")
+
+    report = {
+        'started': started.isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'backend': args.backend,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, started.strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'Результаты: {output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""
+Ядро склада без Streamlit: хранилище, импорт плана, приходы, сопоставление с остатками.
+
+    sclad.storage   — интерфейс Storage, open_storage(настройки [storage])
+    sclad.journal   — локальное хранилище: снимки + журнал (pyarrow)
+    sclad.sql       — хранилище в SQL-базе (SQLAlchemy)
+    sclad.plan      — импорт плана из Excel (openpyxl)
+    sclad.receipts  — пакетный ввод приходов
+    sclad.project   — план с фактом, история, приход и отмена
+    sclad.archive   — сжатие истории: старые операции в архив, остатки на дату
+    sclad.export    — выгрузка таблиц в xlsx / csv / parquet
+    sclad.matching  — нечёткое сопоставление названий (thefuzz)
+    sclad.stock     — файл остатков и сравнение с планом (requests)
+    sclad.jobs      — фоновые задания в общем пуле потоков (ход выполнения, без повторов)
+    sclad.cli       — командная строка (python -m sclad)
+
+Пакет ничего не импортирует сам: модули подключаются по мере надобности,
+поэтому тяжёлые зависимости загружаются только той функцией, которой они нужны.
+"""
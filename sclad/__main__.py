@@ -0,0 +1,3 @@
+from sclad.cli import main
+
+main()
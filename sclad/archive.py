@@ -0,0 +1,105 @@
+"""
+Сжатие истории объекта: операции закрытого периода переносятся в архив, а в истории
+вместо них остаётся по строке «Остаток» на материал — итоги (факт) не меняются.
+
+    summary = compact_history(storage, 12, before=date(2025, 1, 1))
+    archive_df = storage.archived_history(12, date_from=date(2024, 6, 1))
+
+Пары «операция + её отмена» убираются из истории (тоже в архив) в любом периоде.
+"""
+
+import re
+
+import pandas as pd
+
+from sclad.storage import DATE_FORMAT, TOTALS_TOLERANCE, VersionConflict
+
+# --- КОНСТАНТЫ ---
+OPENING_OP_TYPE = 'Остаток'  # тип строки остатка на начало открытого периода
+ARCHIVE_COMPRESSION = 'zstd'  # сжатие файлов архива (parquet)
+COMPACT_WRITE_ATTEMPTS = 5  # попыток записать сжатие, если объект меняется параллельно
+
+# Примечание операции «Отмена» (sclad.project.undo_shipment)
+CANCEL_NOTE = re.compile(r'^ОТМЕНА операции ID:(\d+)')
+
+ARCHIVE_COLUMNS = ['id', 'material_id', 'qty', 'user_name', 'arrival_date', 'store', 'doc_number', 'note', 'op_type']
+
+def cancel_pairs(history_df):
+    """
+    Пары (id операции, id её отмены), которые взаимно гасятся: обе строки есть в history_df,
+    сумма кол-ва равна нулю. На одну операцию — одна (первая) отмена.
+    """
+    cancels = history_df[history_df['op_type'] == 'Отмена']
+    if cancels.empty:
+        return []
+
+    original_ids = pd.to_numeric(cancels['note'].astype(str).str.extract(CANCEL_NOTE, expand=False), errors='coerce')
+    by_id = history_df.set_index('id')
+    pairs, used = [], set()
+    for cancel_id, original_id, cancel_qty in zip(cancels['id'].tolist(), original_ids.tolist(), cancels['qty'].tolist()):
+        if pd.isna(original_id) or int(original_id) in used or int(original_id) not in by_id.index:
+            continue
+        original = by_id.loc[int(original_id)]
+        if original['op_type'] == OPENING_OP_TYPE or abs(original['qty'] + cancel_qty) > TOTALS_TOLERANCE:
+            continue
+        used.add(int(original_id))
+        pairs.append((int(original_id), int(cancel_id)))
+    return pairs
+
+def plan_compaction(history_df, before):
+    """
+    Что сделать с историей объекта (столбцы Storage.project_history) при сжатии до даты before:
+
+        archived  — операции в архив: всё раньше before + пары «операция + отмена»
+        balances  — новые строки «Остаток» (без id), по одной на материал с ненулевой суммой
+        dropped   — id прежних строк «Остаток» раньше before (их сумма входит в новые)
+
+    Сумма кол-ва по материалу в истории после сжатия та же, что и до него.
+    """
+    before = pd.Timestamp(before)
+    dates = pd.to_datetime(history_df['arrival_date'], errors='coerce')
+    opening = history_df['op_type'] == OPENING_OP_TYPE
+
+    pairs = cancel_pairs(history_df[~opening])
+    paired = history_df['id'].isin([row_id for pair in pairs for row_id in pair])
+    archived = history_df[((dates < before) | paired) & ~opening]
+    dropped = history_df[opening & (dates < before)]
+
+    carried = pd.concat([archived, dropped]).groupby('material_id')['qty'].sum()
+    carried = carried[carried.abs() > TOTALS_TOLERANCE]
+    # Остаток датирован последней секундой закрытого периода — ниже всех оставшихся операций
+    opening_date = (before - pd.Timedelta(seconds=1)).strftime(DATE_FORMAT)
+    balances = [{
+        'material_id': int(material_id),
+        'qty': float(qty),
+        'user_name': '',
+        'arrival_date': opening_date,
+        'store': '',
+        'doc_number': '',
+        'note': f"Остаток на {before:%d.%m.%Y} (операции раньше — в архиве)",
+        'op_type': OPENING_OP_TYPE,
+    } for material_id, qty in carried.items()]
+
+    return archived[ARCHIVE_COLUMNS], balances, [int(row_id) for row_id in dropped['id']], len(pairs)
+
+def compact_history(storage, project_id, before):
+    """
+    Сжимает историю объекта в хранилище storage до даты before (не включая её).
+    Возвращает итоги: archived (операций в архив), pairs (убрано пар с отменой),
+    balances (строк «Остаток»), dropped (заменено прежних остатков).
+    """
+    pid = int(project_id)
+    for attempt in range(COMPACT_WRITE_ATTEMPTS):
+        version = storage.version(pid)
+        archived, balances, dropped, pairs = plan_compaction(storage.project_history(pid), before)
+        # Нечего переносить — прежние остатки не переписываем
+        if archived.empty:
+            dropped, balances = [], []
+            break
+        try:
+            storage.archive_shipments(pid, archived, balances, dropped, expected_version=version)
+            break
+        except VersionConflict:
+            if attempt == COMPACT_WRITE_ATTEMPTS - 1:
+                raise
+    return {'archived': len(archived), 'pairs': pairs, 'balances': len(balances), 'dropped': len(dropped)}
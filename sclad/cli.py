@@ -0,0 +1,204 @@
+"""
+Командная строка склада без Streamlit:
+
+    python -m sclad projects
+    python -m sclad import-plan "ЖК Север" plan.xlsx --create
+    python -m sclad add-receipts "ЖК Север" receipts.csv --user "Никулин Д." [--dry-run]
+    python -m sclad compare "ЖК Север" "https://docs.google.com/spreadsheets/d/.../edit" --out stock.xlsx
+    python -m sclad export-history 12 history.xlsx [--archive]
+    python -m sclad compact-history 12 --before 2025-01-01
+    python -m sclad memory
+
+Хранилище настраивается так же, как в приложении (секция [storage] в .streamlit/secrets.toml),
+или ключами --data-dir / --sql-url. Объект задаётся id или названием.
+
+Хранилище journal рассчитано на один процесс: не записывайте через CLI, пока по тем же
+данным работает приложение (для совместной работы — backend = "sql").
+
+Тяжёлые модули (pandas, pyarrow, SQLAlchemy, openpyxl, requests) импортируются только
+внутри команд, поэтому --help и ошибки аргументов отвечают сразу.
+"""
+
+import argparse
+import os
+import sys
+
+DEFAULT_CONFIG = os.path.join('.streamlit', 'secrets.toml')
+
+def load_storage_config(args):
+    """Секция [storage] из secrets.toml; --data-dir и --sql-url имеют приоритет."""
+    storage_cfg = {}
+    if os.path.exists(args.config):
+        import tomllib
+        with open(args.config, 'rb') as f:
+            storage_cfg = dict(tomllib.load(f).get('storage', {}))
+
+    if args.sql_url:
+        storage_cfg.update(backend='sql', url=args.sql_url)
+    elif args.data_dir:
+        storage_cfg.update(backend='journal', data_dir=args.data_dir)
+    return storage_cfg
+
+def open_cli_storage(args):
+    from sclad.storage import open_storage
+    return open_storage(load_storage_config(args))
+
+def find_project(storage, ref, create=False):
+    """id объекта по id или названию; create=True — создать объект, если названия нет."""
+    projects = storage.projects()
+    if ref.isdigit() and int(ref) in set(projects['id'].astype(int)):
+        return int(ref)
+
+    by_name = projects.set_index('name')['id']
+    if ref not in by_name.index and create:
+        storage.add_project(ref)
+        by_name = storage.projects().set_index('name')['id']
+    if ref not in by_name.index:
+        sys.exit(f"Объект не найден: {ref}")
+    return int(by_name[ref])
+
+def print_frame(df):
+    print(df.to_string(index=False) if not df.empty else '(нет строк)')
+
+# --- Команды ---
+
+def cmd_projects(args):
+    storage = open_cli_storage(args)
+    projects = storage.projects()
+    versions = storage.project_versions()
+    projects['version'] = [versions.get(int(pid), 0) for pid in projects['id']]
+    print_frame(projects)
+
+def cmd_import_plan(args):
+    from sclad.plan import import_plan
+
+    storage = open_cli_storage(args)
+    pid = find_project(storage, args.project, create=args.create)
+    summary, log = import_plan(storage, pid, args.file)
+
+    if summary['same_file']:
+        print("Файл не изменился с прошлой загрузки — план не менялся.")
+    else:
+        print(f"Добавлено: {summary['added']}, изменено: {summary['updated']}, "
+              f"исключено из плана: {summary['removed']}, без изменений: {summary['unchanged']}.")
+    for line in log:
+        print(line, file=sys.stderr)
+
+def cmd_add_receipts(args):
+    from sclad.receipts import ingest_shipments, read_receipts_file
+
+    storage = open_cli_storage(args)
+    pid = find_project(storage, args.project)
+    try:
+        receipts_df = read_receipts_file(args.file, args.file)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Не удалось прочитать {args.file}: {e}")
+    report = ingest_shipments(storage, pid, receipts_df, args.user, commit=not args.dry_run)
+    print_frame(report)
+
+    if report['Статус'].str.startswith('❌').any():
+        sys.exit("Пакет не записан: исправьте строки с ошибками.")
+
+def cmd_compare(args):
+    from sclad.project import project_data
+    from sclad.stock import STOCK_CACHE_DIR, compare_with_stock, make_http_session
+
+    storage = open_cli_storage(args)
+    pid = find_project(storage, args.project)
+    data_df, _ = project_data(storage, pid)
+    if data_df.empty:
+        sys.exit("У объекта нет плана.")
+
+    result_df = compare_with_stock(args.url, data_df, cache_dir=args.cache_dir or STOCK_CACHE_DIR,
+                                   session=make_http_session(), exhaustive=args.exhaustive)
+    if args.out:
+        write_frame(result_df, args.out, sheet_name='Stock')
+        print(f"Сохранено: {args.out}")
+    else:
+        print_frame(result_df)
+    print(f"Из памяти: {result_df.attrs['memo_hits']}, пересчитано: {result_df.attrs['memo_misses']}.", file=sys.stderr)
+
+def cmd_export_history(args):
+    from sclad.project import archive_data, project_data
+
+    storage = open_cli_storage(args)
+    pid = find_project(storage, args.project)
+    hist_df = archive_data(storage, pid) if args.archive else project_data(storage, pid)[1]
+    write_frame(hist_df.drop(columns=['id']), args.out, sheet_name='History')
+    print(f"Операций: {len(hist_df)}. Сохранено: {args.out}")
+
+def cmd_compact_history(args):
+    from datetime import date
+
+    from sclad.archive import compact_history
+
+    try:
+        before = date.fromisoformat(args.before)
+    except ValueError:
+        sys.exit(f"Дата {args.before!r}: нужен формат ГГГГ-ММ-ДД.")
+    storage = open_cli_storage(args)
+    pid = find_project(storage, args.project)
+    summary = compact_history(storage, pid, before)
+    print(f"В архив: {summary['archived']} операций (пар с отменой: {summary['pairs']}), "
+          f"строк «Остаток»: {summary['balances']}, заменено прежних остатков: {summary['dropped']}.")
+
+def cmd_memory(args):
+    storage = open_cli_storage(args)
+    print_frame(storage.memory_report())
+
+def write_frame(df, path, sheet_name):
+    """xlsx, csv или parquet по расширению файла (sclad.export)."""
+    from sclad.export import format_for_path, write_export
+
+    with open(path, 'wb') as f:
+        write_export(df, format_for_path(path), f, sheet_name)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m sclad', description='Склад: работа с данными без веб-интерфейса')
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help='secrets.toml с секцией [storage] (по умолчанию %(default)s)')
+    parser.add_argument('--data-dir', help='папка хранилища journal')
+    parser.add_argument('--sql-url', help='URL SQL-базы (backend = "sql")')
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    sub = commands.add_parser('projects', help='список объектов')
+    sub.set_defaults(func=cmd_projects)
+
+    sub = commands.add_parser('import-plan', help='загрузить план объекта из Excel')
+    sub.add_argument('project', help='id или название объекта')
+    sub.add_argument('file', help='файл плана (xlsx)')
+    sub.add_argument('--create', action='store_true', help='создать объект, если его нет')
+    sub.set_defaults(func=cmd_import_plan)
+
+    sub = commands.add_parser('add-receipts', help='пакет приходов из CSV/xlsx')
+    sub.add_argument('project', help='id или название объекта')
+    sub.add_argument('file', help='материал, кол-во, магазин, № док., примечание')
+    sub.add_argument('--user', required=True, help='кто принял')
+    sub.add_argument('--dry-run', action='store_true', help='только проверить, не записывая')
+    sub.set_defaults(func=cmd_add_receipts)
+
+    sub = commands.add_parser('compare', help='сравнить план объекта с остатками на складе')
+    sub.add_argument('project', help='id или название объекта')
+    sub.add_argument('url', help='ссылка на файл остатков (Google Таблица или xlsx)')
+    sub.add_argument('--out', help='сохранить результат в xlsx/csv/parquet')
+    sub.add_argument('--cache-dir', help='папка кэша файлов остатков')
+    sub.add_argument('--exhaustive', action='store_true', help='полный перебор без индекса и памяти сопоставлений')
+    sub.set_defaults(func=cmd_compare)
+
+    sub = commands.add_parser('export-history', help='выгрузить историю операций объекта')
+    sub.add_argument('project', help='id или название объекта')
+    sub.add_argument('out', help='файл xlsx, csv или parquet')
+    sub.add_argument('--archive', action='store_true', help='выгрузить архив (операции, убранные compact-history)')
+    sub.set_defaults(func=cmd_export_history)
+
+    sub = commands.add_parser('compact-history', help='перенести операции до даты в архив, оставив остатки')
+    sub.add_argument('project', help='id или название объекта')
+    sub.add_argument('--before', required=True, help='дата ГГГГ-ММ-ДД: операции раньше неё уходят в архив')
+    sub.set_defaults(func=cmd_compact_history)
+
+    sub = commands.add_parser('memory', help='память таблиц: простые и компактные типы столбцов')
+    sub.set_defaults(func=cmd_memory)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
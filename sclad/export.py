@@ -0,0 +1,60 @@
+"""
+Выгрузка таблиц в файлы: xlsx (openpyxl в потоковом режиме write_only), csv, parquet.
+
+    data = export_frame(hist_df, 'xlsx', sheet_name='History')   # bytes для скачивания
+    with open('history.parquet', 'wb') as f:
+        write_export(hist_df, 'parquet', f)
+"""
+
+import io
+import os
+
+# --- КОНСТАНТЫ ---
+EXPORT_CHUNK_ROWS = 10_000  # строк, переводимых в значения Python за раз при записи xlsx
+# Формат -> (подпись, MIME-тип)
+EXPORT_FORMATS = {
+    'xlsx': ('Excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('CSV', 'text/csv'),
+    'parquet': ('Parquet', 'application/vnd.apache.parquet'),
+}
+
+def write_xlsx(df, output, sheet_name='History'):
+    """
+    Лист xlsx в режиме write_only: строки сразу уходят в файл и не хранятся в книге,
+    поэтому память на запись не растёт с размером таблицы.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append([str(col) for col in df.columns])
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        # Значения Python; пропуски (NaN, NaT) — пустые ячейки, как у pandas.to_excel
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            ws.append(row)
+    wb.save(output)
+
+def write_export(df, fmt, output, sheet_name='History'):
+    """Записывает таблицу без индекса в output (путь или двоичный файл) в формате fmt из EXPORT_FORMATS."""
+    if fmt == 'xlsx':
+        write_xlsx(df, output, sheet_name)
+    elif fmt == 'csv':
+        # utf-8 с BOM — чтобы Excel открыл кириллицу без мастера импорта
+        df.to_csv(output, index=False, encoding='utf-8-sig')
+    elif fmt == 'parquet':
+        df.to_parquet(output, index=False)
+    else:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+def export_frame(df, fmt, sheet_name='History'):
+    """Таблица файлом формата fmt (bytes)."""
+    output = io.BytesIO()
+    write_export(df, fmt, output, sheet_name)
+    return output.getvalue()
+
+def format_for_path(path):
+    """Формат по расширению файла; неизвестное расширение — xlsx."""
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    return ext if ext in EXPORT_FORMATS else 'xlsx'
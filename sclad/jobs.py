@@ -0,0 +1,114 @@
+"""
+Фоновые задания в общем пуле потоков: долгая работа (сравнение с остатками) идёт
+вне прохода страницы, страница только опрашивает ход выполнения.
+
+    runner = JobRunner(max_workers=2)
+    job = runner.submit(('stock', url, pid), compare, url, data_df)   # compare(job, url, data_df)
+    ...
+    job = runner.get(job.id)
+    job.done, job.total, job.stage, job.status   # 'running' / 'done' / 'error'
+
+Одинаковые задания (тот же key), пока первое не завершилось, не запускаются повторно —
+submit возвращает уже идущее. Завершённые задания с результатами хранятся (последние N).
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# --- КОНСТАНТЫ ---
+JOB_WORKERS = 2  # потоков пула по умолчанию
+JOB_HISTORY = 32  # сколько завершённых заданий (с результатами) держать в памяти
+
+class Job:
+    """Одно задание: ход выполнения (done из total, этап), результат или ошибка."""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.status = 'running'
+        self.stage = ''
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def update(self, done=None, total=None, stage=None):
+        """Ход выполнения — вызывается из функции задания (из потока пула)."""
+        with self.lock:
+            if total is not None:
+                self.total = total
+            if done is not None:
+                self.done = done
+            if stage is not None:
+                self.stage = stage
+
+    def progress(self):
+        """Доля выполнения 0..1 (0, пока total неизвестен)."""
+        with self.lock:
+            return min(self.done / self.total, 1.0) if self.total else 0.0
+
+    @property
+    def running(self):
+        return self.status == 'running'
+
+    def _finish(self, result=None, error=None):
+        with self.lock:
+            self.result = result
+            self.error = error
+            self.status = 'error' if error is not None else 'done'
+            self.finished = time.time()
+
+class JobRunner:
+    """Пул потоков с учётом заданий по id и по key; безопасен для нескольких сессий одновременно."""
+
+    def __init__(self, max_workers=JOB_WORKERS, history=JOB_HISTORY):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sclad-job')
+        self.history = history
+        self.jobs = OrderedDict()  # id -> Job, в порядке запуска
+        self.running = {}  # key -> Job, ещё не завершённые
+        self.lock = threading.Lock()
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Запускает func(job, *args, **kwargs) в пуле; результат func — job.result.
+        Если задание с тем же key ещё выполняется, возвращает его (новое не запускается).
+        """
+        with self.lock:
+            job = self.running.get(key)
+            if job is not None:
+                return job
+            job = Job(key)
+            self.jobs[job.id] = job
+            self.running[key] = job
+            self._prune()
+        self.executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """Задание по id; None, если такого нет (или оно уже вытеснено из истории)."""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job, func, args, kwargs):
+        result, error = None, None
+        try:
+            result = func(job, *args, **kwargs)
+        except Exception as e:
+            error = e
+        # Сначала освобождаем key: новое такое же задание после этого запустится заново
+        with self.lock:
+            if self.running.get(job.key) is job:
+                del self.running[job.key]
+        job._finish(result=result, error=error)
+
+    def _prune(self):
+        # Вытесняются самые старые завершённые; идущие задания не трогаем
+        finished = [job_id for job_id, job in self.jobs.items() if not job.running]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
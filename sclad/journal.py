@@ -0,0 +1,931 @@
+"""
+Локальное хранилище: колоночные снимки (Arrow IPC) + журнал операций, по шарду на объект.
+"""
+
+import bisect
+import json
+import os
+import queue
+import shutil
+import threading
+import uuid
+from concurrent.futures import Future
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sclad.archive import ARCHIVE_COLUMNS, ARCHIVE_COMPRESSION
+from sclad.storage import (EMPTY_DB_STRUCTURE, Storage, VersionConflict, concat_rows, diff_totals, enforce_types, fsync_write,
+                           memory_report, parse_db_json, plain_types)
+
+# --- КОНСТАНТЫ ---
+JOURNAL_COMPACT_EVERY = 500  # через сколько записей журнал сворачивается в новый снимок
+GROUP_COMMIT_MAX_BATCH = 256  # сколько ожидающих записей пишется одним fsync
+ID_BLOCK_SIZE = 1000  # сколько id резервируется одной записью в журнале индекса
+
+# --- Колоночный снимок (Arrow IPC): те же компактные типы, что и в памяти (TABLE_DTYPES) ---
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())  # столбец category в pandas
+
+SNAPSHOT_SCHEMA = {
+    'projects': pa.schema([('id', pa.int32()), ('name', pa.string())]),
+    'materials': pa.schema([
+        ('id', pa.int32()), ('project_id', pa.int32()), ('name', pa.string()),
+        ('unit', CATEGORY), ('planned_qty', pa.float64()), ('removed', pa.bool_()),
+    ]),
+    'shipments': pa.schema([
+        ('id', pa.int32()), ('material_id', pa.int32()), ('qty', pa.float64()),
+        ('user_name', CATEGORY), ('arrival_date', pa.timestamp('us')), ('store', CATEGORY),
+        ('doc_number', pa.string()), ('note', pa.string()), ('op_type', CATEGORY),
+    ]),
+}
+
+def write_arrow_snapshot(snapshot_dir, db, meta):
+    """Пишет каждую таблицу в отдельный файл <table>.arrow + meta.json (номер операции и пр.)."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    
+    for table_name, df in db.items():
+        schema = SNAPSHOT_SCHEMA[table_name]
+        # Типы — как в памяти (TABLE_DTYPES); строковые столбцы приводим к str, чтобы None/числа не ломали схему
+        df = enforce_types(df[schema.names].copy(), table_name)
+        for field in schema:
+            if pa.types.is_dictionary(field.type):
+                # Значения, которых больше нет в таблице, в снимок не попадают
+                df[field.name] = df[field.name].cat.remove_unused_categories()
+            elif pa.types.is_string(field.type):
+                df[field.name] = df[field.name].where(df[field.name].isna(), df[field.name].astype(str))
+        table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+        
+        path = os.path.join(snapshot_dir, f'{table_name}.arrow')
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table)
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+    
+    fsync_write(os.path.join(snapshot_dir, 'meta.json'), json.dumps(meta).encode('utf-8'))
+
+def read_arrow_snapshot(snapshot_dir, tables):
+    """Читает таблицы снимка через memory map. Возвращает (meta, db)."""
+    with open(os.path.join(snapshot_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    
+    db = {}
+    for table_name in tables:
+        with pa.memory_map(os.path.join(snapshot_dir, f'{table_name}.arrow'), 'r') as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas()
+        # Снимок старой версии: столбцы, добавленные позже, заполняем значениями по умолчанию,
+        # а прежние типы (int64, текст вместо категорий и дат) приводим к компактным
+        for field in SNAPSHOT_SCHEMA[table_name]:
+            if field.name not in df:
+                df[field.name] = False if pa.types.is_boolean(field.type) else None
+        db[table_name] = enforce_types(df, table_name)
+    return meta, db
+
+def legacy_files(data_dir):
+    """Файлы старых форматов в корне data_dir (шардированное хранилище живёт в подпапках)."""
+    return [name for name in os.listdir(data_dir)
+            if name in ('CURRENT', 'journal.jsonl', 'snapshot.json') or name.startswith('snapshot-')]
+
+def migrate_legacy_db(data_dir, seed_json):
+    """
+    Однократный перенос старых форматов в шардированное хранилище. Источник (по порядку):
+    общий колоночный снимок + журнал в корне data_dir, JSON-снимок data_dir/snapshot.json,
+    иначе database_json из secrets. Возвращает всю базу одним словарем (db).
+    Старые файлы не трогает: их убирает retire_legacy_files, когда индекс уже записан.
+    """
+    legacy_names = legacy_files(data_dir)
+    
+    if 'CURRENT' in legacy_names:
+        # Общий снимок всех таблиц: поднимаем его как один шард и проигрываем журнал
+        db = JournalShard(data_dir, tables=list(SNAPSHOT_SCHEMA)).db
+    elif 'snapshot.json' in legacy_names:
+        with open(os.path.join(data_dir, 'snapshot.json'), encoding='utf-8') as f:
+            snapshot = json.load(f)
+        db = parse_db_json(json.dumps(snapshot['tables']))
+        # Хвост журнала старого формата применяем тем же механизмом
+        if 'journal.jsonl' in legacy_names:
+            shard = JournalShard.__new__(JournalShard)
+            shard._init_state(data_dir, list(SNAPSHOT_SCHEMA), {'seq': snapshot['seq']}, db)
+            shard._replay_journal()
+            db = shard.db
+    else:
+        return parse_db_json(seed_json)
+    return db
+
+def retire_legacy_files(data_dir):
+    """
+    Переносит файлы старых форматов в data_dir/legacy-migrated/. Вызывается только после
+    записи CURRENT индекса: при сбое раньше следующий запуск повторит перенос из тех же файлов.
+    """
+    legacy_names = legacy_files(data_dir)
+    if not legacy_names:
+        return
+    legacy_dir = os.path.join(data_dir, 'legacy-migrated')
+    os.makedirs(legacy_dir, exist_ok=True)
+    for name in legacy_names:
+        os.replace(os.path.join(data_dir, name), os.path.join(legacy_dir, name))
+
+def read_shard_seq(shard_dir):
+    """
+    Версия шарда без загрузки таблиц: seq из meta.json снимка, указанного в CURRENT,
+    и последние seq журнала после него (журнал короткий — не больше JOURNAL_COMPACT_EVERY строк).
+    """
+    with open(os.path.join(shard_dir, 'CURRENT'), encoding='utf-8') as f:
+        snapshot_name = f.read().strip()
+    with open(os.path.join(shard_dir, snapshot_name, 'meta.json'), encoding='utf-8') as f:
+        seq = json.load(f)['seq']
+    
+    journal_path = os.path.join(shard_dir, 'journal.jsonl')
+    if os.path.exists(journal_path):
+        with open(journal_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    seq = max(seq, json.loads(line)['seq'])
+                except json.JSONDecodeError:
+                    # Оборванная последняя строка — как при загрузке шарда, не учитываем
+                    continue
+    return seq
+
+def material_ranges(materials_df):
+    """Непрерывные диапазоны id материалов по объектам: [[first, last, project_id], ...] по возрастанию first."""
+    if materials_df.empty:
+        return []
+    pairs = sorted(zip(materials_df['id'].astype(int).tolist(), materials_df['project_id'].astype(int).tolist()))
+    ranges = [[pairs[0][0], pairs[0][0], pairs[0][1]]]
+    for material_id, pid in pairs[1:]:
+        if pid == ranges[-1][2] and material_id == ranges[-1][1] + 1:
+            ranges[-1][1] = material_id
+        else:
+            ranges.append([material_id, material_id, pid])
+    return ranges
+
+# --- Хэш-индексы таблиц в памяти ---
+
+# Столбцы, по которым ищутся строки (кроме id): внешние ключи и имя объекта
+INDEXED_COLUMNS = {
+    'projects': ['name'],
+    'materials': ['project_id'],
+    'shipments': ['material_id'],
+}
+
+def index_by_id(df):
+    """DataFrame с индексом = id: строка по id находится через хэш индекса, а не перебором столбца."""
+    return df.set_axis(pd.Index(df['id'].to_numpy()), axis=0)
+
+class HashIndexes:
+    """
+    Индексы по INDEXED_COLUMNS: (таблица, столбец) -> {значение: множество id строк}.
+    Вставка и удаление строк обновляют их за O(k), а не пересчитывают заново.
+    """
+    
+    def __init__(self, db):
+        self.maps = {}
+        for table, df in db.items():
+            self.rebuild(table, df)
+    
+    def rebuild(self, table, df):
+        for column in INDEXED_COLUMNS.get(table, []):
+            self.maps[(table, column)] = {}
+        self.add(table, df)
+    
+    def add(self, table, rows_df):
+        for column in INDEXED_COLUMNS.get(table, []):
+            mapping = self.maps[(table, column)]
+            for value, row_id in zip(rows_df[column].tolist(), rows_df['id'].tolist()):
+                mapping.setdefault(value, set()).add(row_id)
+    
+    def remove(self, table, rows_df):
+        for column in INDEXED_COLUMNS.get(table, []):
+            mapping = self.maps[(table, column)]
+            for value, row_id in zip(rows_df[column].tolist(), rows_df['id'].tolist()):
+                ids = mapping.get(value)
+                if ids is not None:
+                    ids.discard(row_id)
+                    if not ids:
+                        del mapping[value]
+    
+    def ids(self, table, column, values):
+        """id строк, у которых table[column] входит в values."""
+        mapping = self.maps[(table, column)]
+        return [row_id for value in values for row_id in mapping.get(value, ())]
+
+# --- Журнал операций ---
+
+class GroupCommitWriter:
+    """
+    Единственный писатель журналов: очередь + фоновый поток.
+    
+    Пока идёт fsync одной порции, новые записи копятся в очереди; следующая порция
+    (до GROUP_COMMIT_MAX_BATCH записей) пишется в журнал каждого шарда одним write + fsync.
+    submit() возвращается только после того, как запись надёжно на диске.
+    """
+    
+    def __init__(self, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+        self.thread.start()
+    
+    def submit(self, shard, record, expected_version=None):
+        future = Future()
+        self.queue.put((shard, record, expected_version, future))
+        return future.result()
+    
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # Порядок записей внутри шарда сохраняется
+            by_shard = {}
+            for shard, record, expected_version, future in batch:
+                by_shard.setdefault(id(shard), (shard, []))[1].append((record, expected_version, future))
+            for shard, items in by_shard.values():
+                # Ошибка одного шарда не должна останавливать поток: иначе submit() ждал бы вечно
+                try:
+                    shard._write_batch(items)
+                except Exception as e:
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+
+class JournalShard:
+    """
+    Набор таблиц в своей папке: колоночный снимок (snapshot-<seq>/*.arrow, актуальный
+    указан в файле CURRENT) + журнал операций (journal.jsonl).
+    
+    Каждая операция записи — одна строка в журнале (с fsync), поэтому приход
+    стоит O(1), а не перезапись всех данных. Каждые JOURNAL_COMPACT_EVERY записей
+    журнал сворачивается в новый снимок.
+    
+    Если в шарде есть операции, итоги по материалам (self.totals: material_id -> сумма qty)
+    считаются один раз при загрузке и дальше только обновляются каждой операцией.
+    
+    Номер последней операции (self.seq) — версия данных шарда: растёт с каждой записью.
+    Если задан writer (GroupCommitWriter), записи от разных потоков пишутся порциями.
+    """
+    
+    def __init__(self, shard_dir, tables, seed_db=None, seed_meta=None, writer=None):
+        self.writer = writer
+        os.makedirs(shard_dir, exist_ok=True)
+        current_path = os.path.join(shard_dir, 'CURRENT')
+        
+        # Снимок + хвост журнала после него (новый шард создаётся из seed_db или пустым)
+        if os.path.exists(current_path):
+            self._load(shard_dir, tables)
+        else:
+            db = seed_db or {key: EMPTY_DB_STRUCTURE[key].copy() for key in tables}
+            self._init_state(shard_dir, tables, dict(seed_meta or {}, seq=0), db)
+            self._write_snapshot()
+            self.journal_len = self._replay_journal()
+    
+    def _init_state(self, shard_dir, tables, meta, db):
+        self.shard_dir = shard_dir
+        self.tables = tables
+        self.current_path = os.path.join(shard_dir, 'CURRENT')
+        self.journal_path = os.path.join(shard_dir, 'journal.jsonl')
+        self.archive_dir = os.path.join(shard_dir, 'archive')
+        # При перечитывании с диска блокировка та же: её держит _write_batch
+        self.lock = getattr(self, 'lock', None) or threading.RLock()
+        self.meta = meta
+        self.seq = meta['seq']
+        self.db = {table: index_by_id(df) for table, df in db.items()}
+        self.indexes = HashIndexes(self.db)
+        self.totals = self._recompute_totals()
+        self.journal_len = 0
+    
+    # --- Чтение с диска ---
+    
+    def _load(self, shard_dir, tables):
+        """Состояние шарда с диска: снимок из CURRENT + хвост журнала."""
+        with open(os.path.join(shard_dir, 'CURRENT'), encoding='utf-8') as f:
+            snapshot_name = f.read().strip()
+        meta, db = read_arrow_snapshot(os.path.join(shard_dir, snapshot_name), tables)
+        self._init_state(shard_dir, tables, meta, db)
+        self.journal_len = self._replay_journal()
+    
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return 0
+        
+        records = []
+        with open(self.journal_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная последняя строка (сбой во время записи) — пропускаем
+                    continue
+                # Записи, уже вошедшие в снимок, не применяем повторно
+                if record['seq'] > self.seq:
+                    records.append(record)
+        
+        # Подряд идущие вставки в одну таблицу склеиваем в один concat
+        pending = {}
+        for record in records:
+            if record['op'] == 'insert':
+                pending.setdefault(record['table'], []).extend(record['rows'])
+            else:
+                self._flush_inserts(pending)
+                self._apply(record)
+            self.seq = record['seq']
+        self._flush_inserts(pending)
+        
+        return len(records)
+    
+    def _flush_inserts(self, pending):
+        for table, rows in pending.items():
+            self._apply({'op': 'insert', 'table': table, 'rows': rows})
+        pending.clear()
+    
+    # --- Применение операций к данным в памяти ---
+    
+    def _check(self, record, added):
+        """
+        Проверка операции до записи в журнал: таблицы есть, строки, на которые она ссылается,
+        существуют, новые id не заняты. added — id, вставленные предыдущими операциями той же
+        порции (таблица -> множество); дополняется id этой операции. Ошибка — ValueError.
+        """
+        op = record['op']
+        db = self.db
+        
+        def require_table(table):
+            if table not in db:
+                raise ValueError(f"Таблицы {table} нет в шарде {self.shard_dir}")
+        
+        def require_rows(table, ids):
+            require_table(table)
+            missing = [row_id for row_id in ids if row_id not in db[table].index and row_id not in added.get(table, ())]
+            if missing:
+                raise ValueError(f"Строки id={missing[:10]} не найдены в таблице {table}")
+        
+        def new_rows(table, rows):
+            require_table(table)
+            ids = [row['id'] for row in rows]
+            taken = [row_id for row_id in ids if row_id in db[table].index or row_id in added.get(table, ())]
+            if taken or len(set(ids)) != len(ids):
+                raise ValueError(f"id={taken[:10] or ids[:10]} уже заняты в таблице {table}")
+            added.setdefault(table, set()).update(ids)
+        
+        if op == 'insert':
+            new_rows(record['table'], record['rows'])
+        elif op == 'update':
+            require_rows(record['table'], [record['id']])
+            unknown = set(record['values']) - set(EMPTY_DB_STRUCTURE[record['table']].columns)
+            if unknown:
+                raise ValueError(f"Нет столбцов {sorted(unknown)} в таблице {record['table']}")
+        elif op == 'archive_shipments':
+            require_rows('shipments', record['archived_ids'] + record['dropped_ids'])
+            new_rows('shipments', record['balances'])
+        elif op == 'replace_materials':
+            require_table('materials')
+            added.setdefault('materials', set()).update(row['id'] for row in record['rows'])
+        elif op == 'apply_plan_diff':
+            require_rows('materials', [row['id'] for row in record['updates']] + record['removed_ids'])
+            new_rows('materials', record['inserts'])
+        elif op not in ('delete_project', 'clear_history', 'reserve_ids', 'assign_ids', 'set_material_ranges'):
+            raise ValueError(f"Неизвестная операция журнала: {op}")
+    
+    def _apply(self, record):
+        op = record['op']
+        db = self.db
+        
+        if op == 'insert':
+            table = record['table']
+            self._append_rows(table, record['rows'])
+            
+            if table == 'shipments':
+                for row in record['rows']:
+                    material_id = int(row['material_id'])
+                    self.totals[material_id] = self.totals.get(material_id, 0.0) + float(row['qty'])
+        
+        elif op == 'update':
+            table = record['table']
+            # loc по отсутствующему id добавил бы новую строку
+            if record['id'] not in db[table].index:
+                raise ValueError(f"Строка id={record['id']} не найдена в таблице {table}")
+            # Категории — в обычные строки, иначе новое значение не записать; _set_table сожмёт обратно
+            df = plain_types(db[table], columns=list(record['values']))
+            for col, value in record['values'].items():
+                df.loc[record['id'], col] = value
+            self._set_table(table, df)
+        
+        elif op == 'delete_project':
+            # Шард объекта удаляется целиком; здесь — только записи в общих таблицах
+            pid = record['project_id']
+            if 'materials' in db:
+                materials_to_delete = self.indexes.ids('materials', 'project_id', [pid])
+                self._drop_rows('shipments', self.indexes.ids('shipments', 'material_id', materials_to_delete))
+                self._drop_rows('materials', materials_to_delete)
+                self._drop_totals(materials_to_delete)
+            if 'projects' in db:
+                self._drop_rows('projects', [pid] if pid in db['projects'].index else [])
+                if 'material_ranges' in self.meta:
+                    self.meta['material_ranges'] = [r for r in self.meta['material_ranges'] if r[2] != pid]
+        
+        elif op == 'clear_history':
+            pid = record['project_id']
+            materials_to_clear = self.indexes.ids('materials', 'project_id', [pid])
+            self._drop_rows('shipments', self.indexes.ids('shipments', 'material_id', materials_to_clear))
+            self._drop_totals(materials_to_clear)
+            self.meta['archives'] = []
+        
+        elif op == 'archive_shipments':
+            # Файл архива уже записан; здесь — замена операций остатками и ссылка на файл
+            self._drop_rows('shipments', record['archived_ids'] + record['dropped_ids'])
+            self._append_rows('shipments', record['balances'])
+            if record['archive']:
+                self.meta.setdefault('archives', []).append(record['archive'])
+            self.totals = self._recompute_totals()
+        
+        elif op == 'replace_materials':
+            pid = record['project_id']
+            self._drop_rows('materials', self.indexes.ids('materials', 'project_id', [pid]))
+            self._append_rows('materials', record['rows'])
+        
+        elif op == 'apply_plan_diff':
+            materials_df = plain_types(db['materials'], columns=['unit'])
+            if record['updates']:
+                updates = pd.DataFrame(record['updates']).set_index('id')
+                materials_df.loc[updates.index, updates.columns] = updates
+            if record['removed_ids']:
+                materials_df.loc[record['removed_ids'], 'removed'] = True
+            self._set_table('materials', materials_df)
+            self._append_rows('materials', record['inserts'])
+            self.meta['plan_hash'] = record['plan_hash']
+        
+        elif op == 'assign_ids':
+            # Диапазон id материалов [first, last] выдан объекту (поиск шарда по id материала)
+            self.meta.setdefault('material_ranges', []).append([record['first'], record['last'], record['project_id']])
+        
+        elif op == 'set_material_ranges':
+            self.meta['material_ranges'] = record['ranges']
+        
+        elif op == 'reserve_ids':
+            # Резерв блока id (hi/lo): после перезапуска выдача продолжается с конца блока
+            self.meta.setdefault('sequences', {})[record['sequence']] = record['upto']
+        
+        else:
+            raise ValueError(f"Неизвестная операция журнала: {op}")
+    
+    # Порядок обновления: при добавлении — сначала таблица, потом индекс; при удалении — наоборот
+    
+    def _append_rows(self, table, rows):
+        if not rows:
+            return
+        new_rows = index_by_id(enforce_types(pd.DataFrame(rows).reindex(columns=EMPTY_DB_STRUCTURE[table].columns), table))
+        self.db[table] = concat_rows(self.db[table], new_rows)
+        self.indexes.add(table, new_rows)
+    
+    def _drop_rows(self, table, ids):
+        if not ids:
+            return
+        self.indexes.remove(table, self.db[table].loc[ids])
+        self.db[table] = self.db[table].drop(index=ids)
+    
+    def _set_table(self, table, df):
+        self.db[table] = index_by_id(enforce_types(df, table))
+        self.indexes.rebuild(table, self.db[table])
+    
+    def contains(self, table, column, value):
+        """Есть ли строка с table[column] == value (поиск по хэш-индексу, без перебора столбца)."""
+        if column == 'id':
+            return value in self.db[table].index
+        return value in self.indexes.maps[(table, column)]
+    
+    def _drop_totals(self, material_ids):
+        for material_id in material_ids:
+            self.totals.pop(material_id, None)
+    
+    def _recompute_totals(self):
+        shipments_df = self.db.get('shipments')
+        if shipments_df is None or shipments_df.empty:
+            return {}
+        return {int(k): float(v) for k, v in shipments_df.groupby('material_id')['qty'].sum().items()}
+    
+    # --- Запись ---
+    
+    def commit(self, record, expected_version=None):
+        """
+        Дописывает операцию в журнал (fsync) и применяет её к данным в памяти.
+        expected_version — версия (seq), от которой считалась операция; если шард
+        успел измениться, запись отклоняется с VersionConflict.
+        """
+        if self.writer is not None:
+            return self.writer.submit(self, record, expected_version)
+        
+        future = Future()
+        self._write_batch([(record, expected_version, future)])
+        return future.result()
+    
+    def _write_batch(self, items):
+        """Порция операций [(record, expected_version, future)]: один write + fsync, затем применение."""
+        with self.lock:
+            accepted, lines, added = [], [], {}
+            seq = self.seq
+            for record, expected_version, future in items:
+                if expected_version is not None and expected_version != seq:
+                    future.set_exception(VersionConflict(
+                        f"Версия данных {seq}, ожидалась {expected_version}: данные изменены другим пользователем"))
+                    continue
+                # Операция, которую нельзя применить, в журнал не попадает
+                try:
+                    self._check(record, added)
+                except ValueError as e:
+                    future.set_exception(e)
+                    continue
+                seq += 1
+                record = dict(record, seq=seq)
+                accepted.append((record, future))
+                lines.append(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            
+            if not accepted:
+                return
+            offset = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            try:
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                # Недописанный хвост порции не должен остаться в журнале
+                try:
+                    self._truncate_journal(offset)
+                except OSError:
+                    pass
+                for _, future in accepted:
+                    future.set_exception(e)
+                return
+            
+            # Вставки порции склеиваются в один concat (как при чтении журнала)
+            pending = {}
+            try:
+                for record, _ in accepted:
+                    if record['op'] == 'insert':
+                        pending.setdefault(record['table'], []).extend(record['rows'])
+                    else:
+                        self._flush_inserts(pending)
+                        self._apply(record)
+                self._flush_inserts(pending)
+            except Exception as e:
+                # Память уже частично изменена, а порция — в журнале: убираем её из журнала
+                # и перечитываем шард с диска, чтобы память и диск снова совпадали
+                self._rollback(offset)
+                for _, future in accepted:
+                    future.set_exception(e)
+                return
+            for _, future in accepted:
+                future.set_result(True)
+            self.seq = seq
+            self.journal_len += len(accepted)
+            
+            if self.journal_len >= JOURNAL_COMPACT_EVERY:
+                # Записи уже на диске: если снимок не удался, журнал свернётся при следующей записи
+                try:
+                    self.compact()
+                except OSError:
+                    pass
+    
+    def _truncate_journal(self, offset):
+        with open(self.journal_path, 'r+b') as f:
+            f.truncate(offset)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _rollback(self, offset):
+        """Обрезает журнал до offset (до неудавшейся порции) и перечитывает состояние с диска."""
+        self._truncate_journal(offset)
+        self._load(self.shard_dir, self.tables)
+    
+    def compact(self):
+        """Сворачивает журнал: пишет новый снимок и очищает журнал."""
+        with self.lock:
+            self._write_snapshot()
+            # Если упадём здесь — записи журнала с seq <= seq снимка будут пропущены при загрузке
+            with open(self.journal_path, 'w', encoding='utf-8') as f:
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_len = 0
+    
+    def _write_snapshot(self):
+        snapshot_name = f'snapshot-{self.seq:012d}'
+        self.meta['seq'] = self.seq
+        write_arrow_snapshot(os.path.join(self.shard_dir, snapshot_name), self.db, self.meta)
+        
+        # Переключаем CURRENT атомарно, затем удаляем старые снимки
+        tmp_path = self.current_path + '.tmp'
+        fsync_write(tmp_path, snapshot_name.encode('utf-8'))
+        os.replace(tmp_path, self.current_path)
+        
+        for name in os.listdir(self.shard_dir):
+            if name.startswith('snapshot-') and name != snapshot_name:
+                shutil.rmtree(os.path.join(self.shard_dir, name), ignore_errors=True)
+
+class JournalStore(Storage):
+    """
+    Локальное хранилище, разбитое по объектам:
+    
+        data/index/            — список объектов и счётчики id (маленький общий шард)
+        data/projects/<id>/    — материалы и операции одного объекта
+    
+    Страница объекта читает только его шард; шарды загружаются при первом обращении.
+    Удаление объекта — удаление папки его шарда.
+    """
+    
+    def __init__(self, data_dir, seed_json=None):
+        self.data_dir = data_dir
+        self.projects_dir = os.path.join(data_dir, 'projects')
+        self.shards = {}
+        self.shards_lock = threading.RLock()
+        self.ids_lock = threading.Lock()
+        self.writer = GroupCommitWriter()
+        
+        os.makedirs(self.projects_dir, exist_ok=True)
+        index_dir = os.path.join(data_dir, 'index')
+        
+        if os.path.exists(os.path.join(index_dir, 'CURRENT')):
+            self.index = JournalShard(index_dir, tables=['projects'], writer=self.writer)
+        else:
+            # Первый запуск: раскладываем старую базу по шардам
+            self.index = self._split_into_shards(migrate_legacy_db(data_dir, seed_json), index_dir)
+        # Старые файлы — только когда индекс на диске (и если прошлый перенос прервался)
+        retire_legacy_files(data_dir)
+        
+        # id выдаются блоками; после перезапуска — с конца последнего зарезервированного блока
+        self.next_ids = {name: upto + 1 for name, upto in self.index.meta['sequences'].items()}
+        
+        # Шарды удалённых объектов, оставшиеся после сбоя во время удаления
+        project_ids = set(self.index.db['projects']['id'].tolist())
+        for name in os.listdir(self.projects_dir):
+            if not name.isdigit() or int(name) not in project_ids:
+                shutil.rmtree(os.path.join(self.projects_dir, name), ignore_errors=True)
+        
+        # Индекс старой версии: карта id материала -> объект строится один раз по всем шардам
+        if 'material_ranges' not in self.index.meta:
+            ranges = []
+            for pid in sorted(project_ids):
+                ranges += material_ranges(self.shard(pid).db['materials'])
+            self.index.commit({'op': 'set_material_ranges', 'ranges': sorted(ranges)})
+    
+    def _split_into_shards(self, db, index_dir):
+        materials_df, shipments_df = db['materials'], db['shipments']
+        
+        for pid in db['projects']['id'].tolist():
+            project_materials = materials_df[materials_df['project_id'] == pid]
+            project_shipments = shipments_df[shipments_df['material_id'].isin(project_materials['id'])]
+            JournalShard(self._shard_dir(pid), tables=['materials', 'shipments'],
+                         seed_db={'materials': project_materials, 'shipments': project_shipments})
+        
+        sequences = {name: int(db[name]['id'].max()) if not db[name].empty else 0 for name in SNAPSHOT_SCHEMA}
+        return JournalShard(index_dir, tables=['projects'], seed_db={'projects': db['projects']},
+                            seed_meta={'sequences': sequences, 'material_ranges': material_ranges(materials_df)},
+                            writer=self.writer)
+    
+    def _shard_dir(self, project_id):
+        return os.path.join(self.projects_dir, str(project_id))
+    
+    def shard(self, project_id):
+        """Шард объекта (загружается с диска при первом обращении)."""
+        with self.shards_lock:
+            if project_id not in self.shards:
+                self.shards[project_id] = JournalShard(self._shard_dir(project_id), tables=['materials', 'shipments'],
+                                                       writer=self.writer)
+            return self.shards[project_id]
+    
+    def _material_shard(self, material_id):
+        """Шард материала: объект находится по диапазонам id в индексе, загружается только его шард."""
+        ranges = self.index.meta['material_ranges']
+        pos = bisect.bisect_right(ranges, material_id, key=lambda r: r[0]) - 1
+        if pos < 0 or material_id > ranges[pos][1]:
+            return None
+        pid = ranges[pos][2]
+        if not self.index.contains('projects', 'id', pid):
+            return None
+        shard = self.shard(pid)
+        return shard if shard.contains('materials', 'id', material_id) else None
+    
+    def _shipment_shard(self, shipment_id, project_id=None):
+        """
+        Шард операции: при известном объекте — только его шард. Без project_id ищет среди
+        загруженных шардов, затем загружает остальные (для id операций карты нет).
+        """
+        if project_id is not None:
+            if not self.index.contains('projects', 'id', project_id):
+                return None
+            shard = self.shard(project_id)
+            return shard if shard.contains('shipments', 'id', shipment_id) else None
+        
+        loaded = list(self.shards.items())
+        project_ids = self.index.db['projects']['id'].tolist()
+        loaded_ids = {pid for pid, _ in loaded}
+        candidates = loaded + [(pid, None) for pid in project_ids if pid not in loaded_ids]
+        for pid, shard in candidates:
+            if pid not in project_ids:
+                continue
+            shard = shard or self.shard(pid)
+            if shard.contains('shipments', 'id', shipment_id):
+                return shard
+        return None
+    
+    def allocate_ids(self, sequence, count=1):
+        """Выдаёт count новых id; в журнал индекса пишется только резерв очередного блока."""
+        with self.ids_lock:
+            first_id = self.next_ids[sequence]
+            last_id = first_id + count - 1
+            if last_id > self.index.meta['sequences'][sequence]:
+                self.index.commit({'op': 'reserve_ids', 'sequence': sequence, 'upto': last_id + ID_BLOCK_SIZE})
+            self.next_ids[sequence] = last_id + 1
+            return list(range(first_id, last_id + 1))
+    
+    # --- Интерфейс Storage ---
+    
+    def projects(self):
+        return self.index.db['projects'].sort_values(by='name').reset_index(drop=True)
+    
+    def project_materials(self, project_id):
+        shard = self.shard(project_id)
+        # Таблица и итоги меняются потоком записи: берём согласованную копию под блокировкой шарда
+        with shard.lock:
+            project_materials = shard.db['materials'].reset_index(drop=True)
+            totals = dict(shard.totals)
+        
+        # Только поиск по готовым итогам, без groupby по всем операциям
+        project_materials['total'] = project_materials['id'].map(totals).fillna(0.0).astype(float)
+        return project_materials
+    
+    def project_history(self, project_id):
+        shard = self.shard(project_id)
+        with shard.lock:
+            project_materials = shard.db['materials']
+            # Операции по материалам плана — через индекс (в шарде могут остаться операции по прошлым планам)
+            shipments_filtered = shard.db['shipments'].loc[
+                shard.indexes.ids('shipments', 'material_id', project_materials['id'].tolist())]
+        
+        history_df = pd.merge(shipments_filtered, project_materials[['id', 'name', 'unit']], 
+                              left_on='material_id', right_on='id', how='left', suffixes=('', '_mat'))
+        return history_df.drop(columns=['id_mat']).sort_values(by='arrival_date', ascending=False)
+    
+    def plan_hash(self, project_id):
+        return self.shard(project_id).meta.get('plan_hash')
+    
+    def version(self, project_id):
+        return self.shard(project_id).seq
+    
+    def project_versions(self):
+        # Загруженные шарды знают свою версию; остальные читаются с диска без загрузки таблиц
+        with self.shards_lock:
+            loaded = dict(self.shards)
+        versions = {}
+        for pid in self.index.db['projects']['id'].tolist():
+            shard = loaded.get(pid)
+            versions[int(pid)] = shard.seq if shard else read_shard_seq(self._shard_dir(pid))
+        return versions
+    
+    def get_shipment(self, shipment_id, project_id=None):
+        shard = self._shipment_shard(shipment_id, project_id)
+        if shard is None:
+            return None
+        # Как у SQL-хранилища: обычные значения, дата — текстом, пропуски — None
+        row = plain_types(shard.db['shipments'].loc[[shipment_id]]).iloc[0]
+        return {key: None if pd.isna(value) else value for key, value in row.items()}
+    
+    def _commit_if_name_free(self, name, record, project_id=None):
+        """
+        Проверка уникального имени (и что объект project_id ещё есть) + запись без блокировки:
+        при параллельном изменении списка — повтор.
+        """
+        while True:
+            version = self.index.seq
+            if self.index.contains('projects', 'name', name):
+                return False
+            if project_id is not None and not self.index.contains('projects', 'id', project_id):
+                return False
+            try:
+                return self.index.commit(record, expected_version=version)
+            except VersionConflict:
+                continue
+    
+    def add_project(self, name):
+        if self.index.contains('projects', 'name', name):
+            return False
+        new_id = self.allocate_ids('projects')[0]
+        return self._commit_if_name_free(name, {'op': 'insert', 'table': 'projects', 'rows': [{'id': new_id, 'name': name}]})
+    
+    def rename_project(self, project_id, new_name):
+        return self._commit_if_name_free(new_name, {'op': 'update', 'table': 'projects', 'id': project_id, 'values': {'name': new_name}},
+                                         project_id=project_id)
+    
+    def delete_project(self, project_id):
+        self.index.commit({'op': 'delete_project', 'project_id': project_id})
+        with self.shards_lock:
+            self.shards.pop(project_id, None)
+            shutil.rmtree(self._shard_dir(project_id), ignore_errors=True)
+    
+    def clear_history(self, project_id):
+        shard = self.shard(project_id)
+        shard.commit({'op': 'clear_history', 'project_id': project_id})
+        shutil.rmtree(shard.archive_dir, ignore_errors=True)
+    
+    def apply_plan_diff(self, project_id, inserts, updates, removed_ids, plan_hash, expected_version=None):
+        # Все изменения плана — одна запись журнала шарда
+        new_ids = self.allocate_ids('materials', len(inserts)) if inserts else []
+        if new_ids:
+            # Сначала карта id -> объект: при сбое после неё остаётся лишь неиспользованный диапазон
+            self.index.commit({'op': 'assign_ids', 'project_id': project_id, 'first': new_ids[0], 'last': new_ids[-1]})
+        insert_data = [dict(row, id=new_id) for new_id, row in zip(new_ids, inserts)]
+        return self.shard(project_id).commit({
+            'op': 'apply_plan_diff', 'project_id': project_id, 'inserts': insert_data,
+            'updates': updates, 'removed_ids': removed_ids, 'plan_hash': plan_hash,
+        }, expected_version=expected_version)
+    
+    def add_shipment(self, row):
+        return self.add_shipments([row])[0]
+    
+    def add_shipments(self, rows):
+        if not rows:
+            return []
+        shard = self._material_shard(rows[0]['material_id'])
+        if shard is None:
+            raise ValueError(f"Материал id={rows[0]['material_id']} не найден ни в одном объекте")
+        
+        # Пакет пишется одной записью журнала, поэтому все материалы — из одного шарда
+        foreign = [row['material_id'] for row in rows if not shard.contains('materials', 'id', row['material_id'])]
+        if foreign:
+            raise ValueError(f"Материалы id={foreign} относятся к другому объекту")
+        
+        new_ids = self.allocate_ids('shipments', len(rows))
+        shard.commit({'op': 'insert', 'table': 'shipments',
+                      'rows': [dict(row, id=new_id) for new_id, row in zip(new_ids, rows)]})
+        return new_ids
+    
+    def archive_shipments(self, project_id, archived_df, balances, dropped_ids, expected_version=None):
+        """
+        Архив — файлы parquet в папке archive шарда. Файл пишется до записи в журнал;
+        читаются только файлы, перечисленные в meta['archives'] (файл от неудавшейся
+        записи не попадает в архив). После сжатия сразу пишется новый снимок.
+        """
+        shard = self.shard(project_id)
+        archive_name = None
+        if not archived_df.empty:
+            archive_name = f'history-{uuid.uuid4().hex[:12]}.parquet'
+            os.makedirs(shard.archive_dir, exist_ok=True)
+            path = os.path.join(shard.archive_dir, archive_name)
+            enforce_types(archived_df[ARCHIVE_COLUMNS].copy(), 'shipments').to_parquet(
+                path, index=False, compression=ARCHIVE_COMPRESSION)
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+        
+        new_ids = self.allocate_ids('shipments', len(balances)) if balances else []
+        try:
+            shard.commit({
+                'op': 'archive_shipments', 'project_id': project_id, 'archive': archive_name,
+                'archived_ids': [int(row_id) for row_id in archived_df['id']], 'dropped_ids': dropped_ids,
+                'balances': [dict(row, id=new_id) for new_id, row in zip(new_ids, balances)],
+            }, expected_version=expected_version)
+        except Exception:
+            if archive_name:
+                os.remove(os.path.join(shard.archive_dir, archive_name))
+            raise
+        shard.compact()
+        return True
+    
+    def archived_history(self, project_id, date_from=None, date_to=None):
+        shard = self.shard(project_id)
+        with shard.lock:
+            paths = [os.path.join(shard.archive_dir, name) for name in shard.meta.get('archives', [])]
+            project_materials = shard.db['materials'][['id', 'name', 'unit']]
+        
+        if paths:
+            # Фильтр по дате применяется при чтении: группы строк вне периода не распаковываются
+            filters = []
+            if date_from is not None:
+                filters.append(('arrival_date', '>=', pd.Timestamp(date_from)))
+            if date_to is not None:
+                filters.append(('arrival_date', '<', pd.Timestamp(date_to)))
+            archived_df = enforce_types(pq.read_table(paths, filters=filters or None).to_pandas(), 'shipments')
+        else:
+            archived_df = EMPTY_DB_STRUCTURE['shipments'].copy()
+        
+        history_df = pd.merge(archived_df, project_materials, left_on='material_id', right_on='id', how='left', suffixes=('', '_mat'))
+        return history_df.drop(columns=['id_mat']).sort_values(by=['arrival_date', 'id'], ascending=False, ignore_index=True)
+    
+    def memory_report(self):
+        frames = [('projects', self.index.db['projects'])]
+        for pid in self.index.db['projects']['id'].tolist():
+            shard = self.shard(pid)
+            frames += [(table, shard.db[table]) for table in shard.tables]
+        return memory_report(frames)
+    
+    def check_totals(self):
+        drift = []
+        for pid in self.index.db['projects']['id'].tolist():
+            shard = self.shard(pid)
+            with shard.lock:
+                drift.append(diff_totals(shard.totals, shard._recompute_totals()))
+        return pd.concat(drift, ignore_index=True) if drift else diff_totals({}, {})
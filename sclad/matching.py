@@ -0,0 +1,179 @@
+"""
+Нечёткое сопоставление названий: индекс биграмм для отбора кандидатов и память результатов.
+"""
+
+import os
+import sqlite3
+import time
+from collections import Counter
+
+import numpy as np
+from thefuzz import fuzz
+from thefuzz import process
+from thefuzz import utils
+
+# --- КОНСТАНТЫ ---
+FUZZY_MATCH_THRESHOLD = 80
+FUZZY_USE_INDEX = True  # False — полный перебор token_sort_ratio (для проверки индекса)
+MATCH_MEMO_MAX_ROWS = 200_000  # предел размера памяти сопоставлений
+
+def find_best_match(query, choices, threshold):
+    result = process.extractOne(query, choices, scorer=fuzz.token_sort_ratio)
+    
+    if result and result[1] >= threshold:
+        return result[0], result[1]
+    return None, 0
+
+def _sorted_tokens_key(processed):
+    """Строка в том виде, в каком её сравнивает token_sort_ratio: токены по алфавиту через пробел."""
+    return " ".join(sorted(processed.split()))
+
+def _bigrams(key):
+    return Counter(key[i:i + 2] for i in range(len(key) - 1))
+
+class StockNameIndex:
+    """
+    Инвертированный индекс символьных биграмм по названиям со склада.
+    
+    Строится один раз на файл остатков. Для каждого названия из плана точный
+    token_sort_ratio считается только по кандидатам, прошедшим два фильтра,
+    которые не отбрасывают ни одного названия со сходством >= порога:
+    
+    1. По длине: LCS <= min(l1, l2).
+    2. По числу общих биграмм: если LCS >= L, то общих биграмм не меньше
+       (l1 - 1) - 2 * (l1 - L) - (l2 - L) (каждое удаление ломает <= 2 биграммы
+       первой строки, каждая вставка — <= 1 биграмму общей подпоследовательности).
+    
+    Кандидаты передаются в extractOne в исходном порядке, поэтому при равенстве
+    оценок выбирается то же название, что и при полном переборе.
+    """
+    
+    def __init__(self, choices):
+        self.choices = list(choices)
+        
+        # Обработка — как у extractOne для token_sort_ratio
+        keys = [_sorted_tokens_key(utils.full_process(c, force_ascii=True)) for c in self.choices]
+        self.lengths = np.array([len(key) for key in keys], dtype=np.int64)
+        
+        postings = {}
+        for i, key in enumerate(keys):
+            for gram, cnt in _bigrams(key).items():
+                idxs, cnts = postings.setdefault(gram, ([], []))
+                idxs.append(i)
+                cnts.append(cnt)
+        self.postings = {gram: (np.array(idxs, dtype=np.int64), np.array(cnts, dtype=np.int64))
+                         for gram, (idxs, cnts) in postings.items()}
+    
+    def candidates(self, query_key, threshold):
+        """Индексы названий, у которых сходство с query_key может быть >= threshold."""
+        # Оценка округляется до целого, поэтому проходит всё, что >= threshold - 0.5
+        t = (threshold - 0.5) / 100
+        lq, lc = len(query_key), self.lengths
+        
+        # Минимальная длина общей подпоследовательности (с запасом на погрешность float)
+        l_min = np.ceil(t * (lq + lc) / 2 - 1e-9)
+        length_ok = np.minimum(lq, lc) >= l_min
+        
+        idx_parts, cnt_parts = [], []
+        for gram, query_cnt in _bigrams(query_key).items():
+            posting = self.postings.get(gram)
+            if posting is not None:
+                idx_parts.append(posting[0])
+                cnt_parts.append(np.minimum(posting[1], query_cnt))
+        
+        if idx_parts:
+            common = np.bincount(np.concatenate(idx_parts), weights=np.concatenate(cnt_parts), minlength=len(lc))
+        else:
+            common = np.zeros(len(lc))
+        
+        bound = np.maximum(
+            (lq - 1) - 2 * (lq - l_min) - (lc - l_min),
+            (lc - 1) - 2 * (lc - l_min) - (lq - l_min),
+        )
+        return np.flatnonzero(length_ok & (common >= bound))
+    
+    def find_best_match(self, query, threshold, exhaustive=False):
+        """То же, что find_best_match(query, choices, threshold), но по кандидатам из индекса."""
+        query_key = _sorted_tokens_key(utils.full_process(utils.full_process(query), force_ascii=True))
+        
+        # Пустой после обработки запрос и проверочный режим — полный перебор
+        if exhaustive or not query_key:
+            return find_best_match(query, self.choices, threshold)
+        
+        candidate_idx = self.candidates(query_key, threshold)
+        if len(candidate_idx) == 0:
+            return None, 0
+        return find_best_match(query, [self.choices[i] for i in candidate_idx], threshold)
+
+# --- Память сопоставлений ---
+
+class MatchMemo:
+    """
+    Память сопоставлений на диске (SQLite):
+    (хэш списка названий склада, порог, название из плана) -> (найденное название, сходство).
+    
+    Ключ — хэш именно названий, а не всего файла: ежедневная выгрузка меняет
+    количества, но не результат сопоставления. Размер ограничен MATCH_MEMO_MAX_ROWS,
+    при переполнении удаляются давно не использованные записи (LRU).
+    """
+    
+    def __init__(self, path, max_rows=None):
+        self.path = path
+        self.max_rows = max_rows or MATCH_MEMO_MAX_ROWS
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS match_memo (
+                    names_hash TEXT NOT NULL,
+                    threshold INTEGER NOT NULL,
+                    plan_name TEXT NOT NULL,
+                    stock_name TEXT,
+                    score INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (names_hash, threshold, plan_name)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS match_memo_last_used ON match_memo (last_used)")
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+    
+    def get_many(self, names_hash, threshold, plan_names):
+        """Возвращает {plan_name: (stock_name, score)} для уже известных названий."""
+        found = {}
+        now = time.time()
+        plan_names = list(plan_names)
+        with self._connect() as conn:
+            # Порциями, чтобы не упереться в лимит параметров SQLite
+            for start in range(0, len(plan_names), 500):
+                chunk = plan_names[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f"SELECT plan_name, stock_name, score FROM match_memo "
+                    f"WHERE names_hash = ? AND threshold = ? AND plan_name IN ({placeholders})",
+                    [names_hash, threshold, *chunk],
+                ).fetchall()
+                for plan_name, stock_name, score in rows:
+                    found[plan_name] = (stock_name, score)
+            conn.executemany(
+                "UPDATE match_memo SET last_used = ? WHERE names_hash = ? AND threshold = ? AND plan_name = ?",
+                [(now, names_hash, threshold, plan_name) for plan_name in found],
+            )
+        return found
+    
+    def put_many(self, names_hash, threshold, matches):
+        """Сохраняет {plan_name: (stock_name, score)} и вытесняет старые записи сверх лимита."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO match_memo VALUES (?, ?, ?, ?, ?, ?)",
+                [(names_hash, threshold, plan_name, stock_name, int(score), now)
+                 for plan_name, (stock_name, score) in matches.items()],
+            )
+            excess = conn.execute("SELECT COUNT(*) FROM match_memo").fetchone()[0] - self.max_rows
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM match_memo WHERE rowid IN "
+                    "(SELECT rowid FROM match_memo ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
@@ -0,0 +1,165 @@
+"""
+Импорт плана объекта: потоковое чтение Excel, очистка строк и запись только отличий.
+"""
+
+import hashlib
+import io
+import itertools
+
+import pandas as pd
+
+from sclad.storage import VersionConflict
+
+# --- КОНСТАНТЫ ---
+IMPORT_CHUNK_ROWS = 5000  # строк плана за один шаг импорта
+PLAN_WRITE_ATTEMPTS = 5  # попыток записать план, если объект меняется параллельно
+
+PLAN_COLUMNS = ['name', 'unit', 'qty']
+
+def iter_plan_chunks(file_source, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Потоково читает первые три столбца первого листа плана (openpyxl read_only),
+    отдаёт порции DataFrame. Первая строка — заголовок; индекс строк как у pd.read_excel.
+    """
+    import openpyxl
+    
+    wb = openpyxl.load_workbook(file_source, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(min_row=2, max_col=len(PLAN_COLUMNS), values_only=True)
+        start = 0
+        while True:
+            chunk = [tuple(row) + (None,) * (len(PLAN_COLUMNS) - len(row))
+                     for row in itertools.islice(rows, chunk_rows)]
+            if not chunk:
+                break
+            yield pd.DataFrame(chunk, columns=PLAN_COLUMNS, index=range(start, start + len(chunk)))
+            start += len(chunk)
+    finally:
+        wb.close()
+
+def parse_qty(values):
+    """Количество из ячеек: запятая как разделитель, неразрывные пробелы. Возвращает (числа, текст)."""
+    qty_text = (values.astype('string')
+                .str.replace(',', '.', regex=False)
+                .str.replace('\xa0', '', regex=False)
+                .str.strip())
+    return pd.to_numeric(qty_text, errors='coerce'), qty_text
+
+def clean_plan_chunk(frame):
+    """
+    Векторная очистка порции плана: название, ед. изм., количество
+    (запятая как разделитель, неразрывные пробелы). Возвращает (DataFrame строк, ошибки).
+    """
+    name = frame['name'].astype('string').str.strip()
+    keep = name.notna() & (name != '') & (name.str.lower() != 'nan')
+    
+    unit = frame['unit'].astype('string').str.strip().fillna('')
+    qty, qty_text = parse_qty(frame['qty'])
+    
+    # Нечисловое количество записывается как 0, но попадает в отчёт
+    bad = keep & qty.isna() & qty_text.notna() & (qty_text != '')
+    log = [f"Ошибка строки {i}: не удалось прочитать количество '{raw}', записано 0"
+           for i, raw in qty_text[bad].items()]
+    
+    rows = pd.DataFrame({
+        'name': name[keep].astype(object),
+        'unit': unit[keep].astype(object),
+        'planned_qty': qty[keep].astype('float64').fillna(0.0),
+    })
+    return rows, log
+
+def plan_keys(df):
+    """
+    Ключ строки плана: название и ед. изм. без учёта регистра и лишних пробелов
+    + номер повтора (одинаковые строки в плане сопоставляются по порядку).
+    """
+    # astype(object): в хранилище name — str, unit — category; ключ склеивается из обычных строк
+    name = df['name'].astype(object).map(lambda value: ' '.join(str(value).lower().split()))
+    unit = df['unit'].astype(object).fillna('').map(lambda value: str(value).lower().strip())
+    base = name + '\x1f' + unit
+    repeat = base.groupby(base).cumcount()
+    return pd.Index([f'{key}\x1f{n}' for key, n in zip(base, repeat)])
+
+def diff_plan(current_df, new_df):
+    """
+    Сравнивает текущий план объекта (с id и removed) с новым.
+    Возвращает (inserts, updates, removed_ids, unchanged) для Storage.apply_plan_diff.
+    """
+    current = current_df.sort_values('id').astype({'removed': bool})
+    current = current.set_index(plan_keys(current))
+    new = new_df.set_index(plan_keys(new_df))
+    
+    common = new.index.intersection(current.index, sort=False)
+    old, fresh = current.loc[common], new.loc[common]
+    changed = (
+        (old['name'] != fresh['name'])
+        | (old['unit'].astype(object).fillna('') != fresh['unit'])
+        | (old['planned_qty'] != fresh['planned_qty'])
+        | old['removed']  # строка вернулась в план
+    )
+    updates = fresh[changed].assign(id=old.loc[changed, 'id'].astype(int), removed=False)
+    
+    gone = current[~current.index.isin(new.index) & ~current['removed']]
+    added = new[~new.index.isin(current.index)]
+    
+    return (
+        added.to_dict('records'),
+        updates[['id', 'name', 'unit', 'planned_qty', 'removed']].to_dict('records'),
+        [int(material_id) for material_id in gone['id']],
+        int((~changed).sum()),
+    )
+
+def import_plan(storage, project_id, source):
+    """
+    Импорт плана объекта в хранилище storage: source — файл Excel (путь или открытый файл,
+    читается потоково) или уже прочитанный DataFrame.
+    Пишутся только отличия от текущего плана: id материалов сохраняются, история не теряется.
+    Возвращает (итоги: added/updated/removed/unchanged/same_file, ошибки строк).
+    """
+    pid = int(project_id)
+    summary = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'same_file': False}
+    
+    if isinstance(source, pd.DataFrame):
+        frame = source.iloc[:, :len(PLAN_COLUMNS)].copy()
+        frame.columns = PLAN_COLUMNS[:frame.shape[1]]
+        frame = frame.reindex(columns=PLAN_COLUMNS)
+        content_hash = hashlib.sha256(pd.util.hash_pandas_object(frame.astype(object), index=False).values.tobytes()).hexdigest()
+        chunks = [frame]
+    else:
+        if hasattr(source, 'read'):
+            content = source.read()
+        else:
+            with open(source, 'rb') as f:
+                content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        chunks = iter_plan_chunks(io.BytesIO(content))
+    
+    # Тот же файл, что и в прошлый раз, — ничего не делаем
+    if content_hash == storage.plan_hash(pid):
+        summary['same_file'] = True
+        return summary, []
+    
+    # 1. Подготавливаем новые данные
+    log = []
+    frames = []
+    for chunk in chunks:
+        rows, chunk_log = clean_plan_chunk(chunk)
+        frames.append(rows)
+        log.extend(chunk_log)
+    new_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['name', 'unit', 'planned_qty'])
+    
+    # 2. Сравниваем с текущим планом и записываем только отличия.
+    #    Если за это время объект изменился (приход, другая загрузка) — сравниваем заново
+    for attempt in range(PLAN_WRITE_ATTEMPTS):
+        version = storage.version(pid)
+        inserts, updates, removed_ids, unchanged = diff_plan(storage.project_materials(pid), new_df)
+        inserts = [dict(row, project_id=pid) for row in inserts]
+        try:
+            storage.apply_plan_diff(pid, inserts, updates, removed_ids, content_hash, expected_version=version)
+            break
+        except VersionConflict:
+            if attempt == PLAN_WRITE_ATTEMPTS - 1:
+                raise
+    
+    summary.update(added=len(inserts), updated=len(updates), removed=len(removed_ids), unchanged=unchanged)
+    return summary, log
@@ -0,0 +1,205 @@
+"""
+Замеры времени по участкам кода: вложенные спаны внутри одного прохода (run).
+
+    profiler = Profiler(jsonl_path='data/profiling/spans.jsonl', prom_path='data/profiling/sclad.prom')
+    with profiler.run(session='ab12'):
+        with profiler.span('get_data', project=3):
+            profiler.annotate(cache='miss')  # из кэшируемой функции: выполнилась — значит промах
+            ...
+
+Каждый завершённый проход попадает в историю последних N проходов (для панели в
+приложении), в файл JSON-lines (строка на спан) и в текстовый файл метрик в формате
+Prometheus (гистограмма длительностей и счётчики попаданий в кэш по имени спана).
+Вне прохода span() только измеряет время и ничего не записывает.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- КОНСТАНТЫ ---
+PROFILE_HISTORY = 50  # сколько последних проходов держать в памяти
+PROFILE_JSONL_MAX_BYTES = 20 * 2 ** 20  # размер файла спанов, после которого он сдвигается в .1
+PROFILE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # границы гистограммы, сек
+
+class Profiler:
+    """Собирает спаны проходов; безопасен для нескольких потоков (сессий) одновременно."""
+
+    def __init__(self, jsonl_path=None, prom_path=None, history=PROFILE_HISTORY, enabled=True):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.enabled = enabled
+        self.history = deque(maxlen=history)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Накопленные метрики для Prometheus: span -> (счётчики корзин, сумма, количество)
+        self.durations = {}
+        self.cache = {}  # (span, результат) -> количество
+        self.outcomes = {}  # исход прохода -> количество
+
+    # --- Запись спанов ---
+
+    @contextmanager
+    def run(self, name='rerun', **attrs):
+        """Один проход (например, перезапуск страницы): корневой спан, по завершении — в историю и файлы."""
+        if not self.enabled or getattr(self.local, 'stack', None):
+            yield
+            return
+
+        started = time.perf_counter()
+        record = {
+            'run_id': uuid.uuid4().hex[:12],
+            'started': datetime.now().isoformat(timespec='milliseconds'),
+            'spans': [],
+        }
+        self.local.run = record
+        self.local.started = started
+        self.local.stack = []
+        outcome = 'ok'
+        try:
+            with self.span(name, **attrs):
+                yield
+        except BaseException as e:
+            # st.rerun() / st.stop() тоже завершают проход исключением
+            outcome = type(e).__name__
+            raise
+        finally:
+            self.local.run = None
+            self.local.stack = []
+            record['ms'] = round((time.perf_counter() - started) * 1000, 3)
+            record['outcome'] = outcome
+            record['attrs'] = attrs
+            self._finish(record)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Участок кода внутри прохода. attrs (и annotate()) сохраняются вместе с длительностью."""
+        stack = getattr(self.local, 'stack', None)
+        if not stack and getattr(self.local, 'run', None) is None:
+            yield
+            return
+
+        span = {'name': name, 'depth': len(stack), 'attrs': dict(attrs)}
+        start = time.perf_counter()
+        span['start_ms'] = round((start - self.local.started) * 1000, 3)
+        # Порядок в проходе — по началу спана (родитель раньше вложенных)
+        self.local.run['spans'].append(span)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            span['ms'] = round((time.perf_counter() - start) * 1000, 3)
+            stack.pop()
+
+    def annotate(self, **attrs):
+        """Добавляет атрибуты текущему (самому вложенному) спану этого потока."""
+        stack = getattr(self.local, 'stack', None)
+        if stack:
+            stack[-1]['attrs'].update(attrs)
+
+    # --- Завершение прохода ---
+
+    def _finish(self, record):
+        with self.lock:
+            self.history.append(record)
+            self.outcomes[record['outcome']] = self.outcomes.get(record['outcome'], 0) + 1
+            for span in record['spans']:
+                self._observe(span)
+            # Ошибка записи метрик не должна ломать страницу
+            try:
+                # Под блокировкой: файл метрик не перезапишется более старым текстом
+                if self.prom_path:
+                    self._write_atomic(self.prom_path, self.prometheus_text())
+            except OSError:
+                pass
+
+        try:
+            if self.jsonl_path:
+                self._append_jsonl(record)
+        except OSError:
+            pass
+
+    def _observe(self, span):
+        buckets, total, count = self.durations.get(span['name'], ([0] * len(PROFILE_BUCKETS), 0.0, 0))
+        seconds = span['ms'] / 1000
+        buckets = [n + (seconds <= bound) for n, bound in zip(buckets, PROFILE_BUCKETS)]
+        self.durations[span['name']] = (buckets, total + seconds, count + 1)
+
+        result = span['attrs'].get('cache')
+        if result:
+            key = (span['name'], result)
+            self.cache[key] = self.cache.get(key, 0) + 1
+
+    def _append_jsonl(self, record):
+        lines = [json.dumps({
+            'ts': record['started'], 'run_id': record['run_id'], 'outcome': record['outcome'],
+            'span': span['name'], 'depth': span['depth'], 'start_ms': span['start_ms'], 'ms': span['ms'],
+            **span['attrs'],
+        }, ensure_ascii=False, default=str) + '\n' for span in record['spans']]
+
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.jsonl_path)), exist_ok=True)
+            if os.path.exists(self.jsonl_path) and os.path.getsize(self.jsonl_path) > PROFILE_JSONL_MAX_BYTES:
+                os.replace(self.jsonl_path, self.jsonl_path + '.1')
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+
+    @staticmethod
+    def _write_atomic(path, text):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Своё временное имя на каждую запись (в той же папке — для атомарного os.replace)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.chmod(tmp_path, 0o644)  # mkstemp создаёт 0600, а файл читает коллектор метрик
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    # --- Отчёты ---
+
+    def recent_runs(self):
+        """Завершённые проходы, новые первыми."""
+        with self.lock:
+            return list(reversed(self.history))
+
+    def prometheus_text(self):
+        """Накопленные метрики в текстовом формате Prometheus (для textfile-коллектора)."""
+        lines = [
+            '# HELP sclad_span_duration_seconds Длительность участков кода',
+            '# TYPE sclad_span_duration_seconds histogram',
+        ]
+        for name, (buckets, total, count) in sorted(self.durations.items()):
+            label = _escape_label(name)
+            for bound, n in zip(PROFILE_BUCKETS, buckets):
+                lines.append(f'sclad_span_duration_seconds_bucket{{span="{label}",le="{bound}"}} {n}')
+            lines.append(f'sclad_span_duration_seconds_bucket{{span="{label}",le="+Inf"}} {count}')
+            lines.append(f'sclad_span_duration_seconds_sum{{span="{label}"}} {total:.6f}')
+            lines.append(f'sclad_span_duration_seconds_count{{span="{label}"}} {count}')
+
+        lines += [
+            '# HELP sclad_cache_requests_total Обращения к кэшу по участкам кода (hit / miss)',
+            '# TYPE sclad_cache_requests_total counter',
+        ]
+        for (name, result), n in sorted(self.cache.items()):
+            lines.append(f'sclad_cache_requests_total{{span="{_escape_label(name)}",result="{_escape_label(result)}"}} {n}')
+
+        lines += [
+            '# HELP sclad_runs_total Завершённые проходы по исходу',
+            '# TYPE sclad_runs_total counter',
+        ]
+        for outcome, n in sorted(self.outcomes.items()):
+            lines.append(f'sclad_runs_total{{outcome="{_escape_label(outcome)}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
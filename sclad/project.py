@@ -0,0 +1,175 @@
+"""
+Данные одного объекта: план с фактом, история операций, приход и его отмена.
+"""
+
+import html
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from sclad.storage import TOTALS_TOLERANCE
+
+HISTORY_COLUMNS = ['id', 'Материал', 'Ед. изм.', 'Кол-во', 'Тип опер.', 'Кто', 'Магазин', '№ Док.', 'Примечание', 'Дата']
+DETAIL_COLUMNS = ['id', 'status', 'Статус', 'Материал', 'Ед. изм.', 'План', 'Факт', 'Выполнено', 'Осталось', 'Перерасход']
+# Состояние строки плана (ключ -> подпись в таблице детализации)
+MATERIAL_STATUSES = {
+    'not_started': '⚪ Не начато',
+    'in_progress': '⏳ В работе',
+    'done': '✅ Выполнено',
+    'overrun': '🔺 Перерасход',
+}
+
+def add_shipment(storage, material_id, qty, user, date, store, doc_number, note, op_type='Приход'):
+    new_row = {
+        'material_id': int(material_id),
+        'qty': float(qty),
+        'user_name': user,
+        'arrival_date': date.strftime('%Y-%m-%d %H:%M:%S'),
+        'store': store,
+        'doc_number': doc_number,
+        'note': note,
+        'op_type': op_type
+    }
+    
+    return storage.add_shipment(new_row)
+
+def undo_shipment(storage, shipment_id, current_user, project_id=None):
+    original_data = storage.get_shipment(int(shipment_id), project_id=None if project_id is None else int(project_id))
+    
+    if original_data:
+        # Записываем операцию "Отмена"
+        new_row = {
+            'material_id': int(original_data['material_id']),
+            'qty': -abs(float(original_data['qty'])),
+            'user_name': current_user,
+            'arrival_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'store': original_data['store'],
+            'doc_number': original_data['doc_number'],
+            'note': f"ОТМЕНА операции ID:{shipment_id}. Оригинальное Примечание: {original_data['note']}",
+            'op_type': 'Отмена'
+        }
+        
+        storage.add_shipment(new_row)
+        return True
+    return False
+
+def project_data(storage, project_id):
+    """План объекта с фактом и прогрессом + история операций (столбцы HISTORY_COLUMNS)."""
+    pid = int(project_id)
+    
+    # 1. План с фактом (total считает хранилище)
+    full_df = storage.project_materials(pid)
+    # Строки, исключённые из плана при повторной загрузке, не показываем (их история остаётся)
+    full_df = full_df[~full_df['removed'].astype(bool)].drop(columns='removed') if not full_df.empty else full_df
+    
+    if full_df.empty:
+        return pd.DataFrame(), pd.DataFrame(columns=HISTORY_COLUMNS)
+    
+    # 2. Расчет прогресса
+    planned = full_df['planned_qty'].astype('float64')
+    full_df['prog'] = (full_df['total'] / planned.where(planned > 0)).fillna(0.0)
+    
+    # 3. История операций
+    history_df = history_columns(storage.project_history(pid))
+    
+    return full_df, history_df
+
+def history_columns(history_df):
+    """Операции из хранилища (project_history, archived_history) со столбцами HISTORY_COLUMNS."""
+    if history_df.empty:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    
+    history_df = history_df.rename(columns={
+        'name': 'Материал',
+        'qty': 'Кол-во',
+        'op_type': 'Тип опер.',
+        'user_name': 'Кто',
+        'store': 'Магазин',
+        'doc_number': '№ Док.',
+        'note': 'Примечание',
+        'arrival_date': 'Дата',
+        'unit': 'Ед. изм.' # Добавляем единицу измерения в историю
+    })
+    
+    return history_df[HISTORY_COLUMNS]
+
+def archive_data(storage, project_id, date_from=None, date_to=None):
+    """Архив истории объекта (sclad.archive) за период [date_from, date_to] (даты включительно), столбцы HISTORY_COLUMNS."""
+    date_to = pd.Timestamp(date_to) + pd.Timedelta(days=1) if date_to is not None else None
+    return history_columns(storage.archived_history(int(project_id), date_from=date_from, date_to=date_to))
+
+def detail_table(full_df):
+    """
+    Детализация плана одной таблицей (DETAIL_COLUMNS): статус, план и факт, доля выполнения,
+    остаток и перерасход — столбцовыми операциями. Порядок — как раньше: по выполнению, затем по названию.
+    """
+    if full_df.empty:
+        return pd.DataFrame(columns=DETAIL_COLUMNS)
+    
+    planned = full_df['planned_qty'].astype('float64').to_numpy()
+    total = full_df['total'].astype('float64').to_numpy()
+    diff = planned - total
+    exact = np.abs(diff) <= TOTALS_TOLERANCE
+    
+    status = np.select(
+        [~exact & (diff < 0), exact & (planned > 0), total > 0],
+        ['overrun', 'done', 'in_progress'],
+        default='not_started',
+    )
+    
+    table = pd.DataFrame({
+        'id': full_df['id'].to_numpy(),
+        'status': status,
+        'Статус': pd.Series(status).map(MATERIAL_STATUSES).to_numpy(),
+        'Материал': full_df['name'].to_numpy(),
+        'Ед. изм.': full_df['unit'].to_numpy(),
+        'План': planned,
+        'Факт': total,
+        'Выполнено': full_df['prog'].astype('float64').to_numpy(),
+        'Осталось': np.where(exact, 0.0, np.clip(diff, 0.0, None)),
+        'Перерасход': np.where(exact, 0.0, np.clip(-diff, 0.0, None)),
+    })
+    return table.sort_values(by=['Выполнено', 'Материал'], ascending=[False, True], ignore_index=True)
+
+def prepare_history(hist_df):
+    """
+    История для просмотра: дата как datetime64 (столбец _date, для фильтра по периоду),
+    новые сверху, при одинаковой дате — более поздняя операция выше.
+    """
+    view = hist_df.assign(_date=pd.to_datetime(hist_df['Дата'], errors='coerce'))
+    return view.sort_values(by=['_date', 'id'], ascending=False, na_position='last', ignore_index=True)
+
+def filter_history(view, date_from=None, date_to=None, materials=(), users=()):
+    """Строки prepare_history за период [date_from, date_to] (даты включительно) по выбранным материалам и сотрудникам."""
+    mask = pd.Series(True, index=view.index)
+    if date_from is not None:
+        mask &= view['_date'] >= pd.Timestamp(date_from)
+    if date_to is not None:
+        mask &= view['_date'] < pd.Timestamp(date_to) + pd.Timedelta(days=1)
+    if materials:
+        mask &= view['Материал'].isin(materials)
+    if users:
+        mask &= view['Кто'].isin(users)
+    return view[mask]
+
+def history_html(page_df):
+    """
+    Страница истории в HTML: кол-во цветом (приход — зелёный «+», отмена — красный «-»),
+    остальной текст экранирован. Форматирование — столбцовыми операциями.
+    """
+    qty = page_df['Кол-во'].astype('float64').to_numpy()
+    op_type = page_df['Тип опер.'].to_numpy()
+    cancel = op_type == 'Отмена'
+    arrival = (op_type == 'Приход') & (qty > 0)
+    
+    amount = np.char.mod('%.2f', np.where(cancel, np.abs(qty), qty))
+    sign = np.select([cancel, arrival], ['- ', '+ '], '')
+    color = np.select([cancel, arrival], ['red', 'green'], 'black')
+    
+    display_df = page_df.drop(columns=['id', 'Тип опер.', '_date'], errors='ignore')
+    text_cols = [col for col in display_df.columns if col != 'Кол-во']
+    display_df[text_cols] = display_df[text_cols].astype(object).fillna('').astype(str).apply(lambda col: col.map(html.escape))
+    display_df['Кол-во'] = ("<span style='color: " + pd.Series(color, dtype=object) + "; font-weight: bold;'>"
+                            + pd.Series(sign, dtype=object) + pd.Series(amount, dtype=object) + "</span>").to_numpy()
+    return display_df.to_html(escape=False, index=False)
@@ -0,0 +1,113 @@
+"""
+Пакетный ввод приходов из CSV/xlsx: сопоставление строк с планом и запись одной операцией.
+"""
+
+from datetime import datetime
+
+import pandas as pd
+
+from sclad.plan import parse_qty
+
+RECEIPT_COLUMNS = ['material', 'qty', 'store', 'doc_number', 'note']
+RECEIPT_REPORT_COLUMNS = ['Строка', 'Материал (файл)', 'Материал (План)', 'Сходство (%)', 'Кол-во', 'Статус', 'ID операции']
+
+def read_receipts_file(source, filename):
+    """Файл пакета приходов (CSV или xlsx): первые пять столбцов — материал (название или id), кол-во, магазин, № док., примечание."""
+    if filename.lower().endswith('.csv'):
+        # Разделитель (; или ,) определяется по содержимому
+        df = pd.read_csv(source, sep=None, engine='python', dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    else:
+        df = pd.read_excel(source, dtype=object)
+    
+    df = df.iloc[:, :len(RECEIPT_COLUMNS)].copy()
+    df.columns = RECEIPT_COLUMNS[:df.shape[1]]
+    return df.reindex(columns=RECEIPT_COLUMNS)
+
+def resolve_materials(values, plan_df):
+    """
+    Сопоставляет значения столбца «материал» с планом объекта: id материала,
+    затем точное название (без учёта регистра и лишних пробелов), затем нечёткий поиск.
+    Возвращает список (material_id или None, название из плана, сходство).
+    """
+    plan_ids = dict(zip(plan_df['id'].astype(int), plan_df['name']))
+    by_name = {}
+    for material_id, name in zip(plan_df['id'].astype(int), plan_df['name']):
+        by_name.setdefault(' '.join(str(name).lower().split()), material_id)
+    
+    name_index = None
+    resolved = []
+    for value in values:
+        text = '' if pd.isna(value) else str(value).strip()
+        if text.endswith('.0') and text[:-2].isdigit():
+            text = text[:-2]  # id, прочитанный из Excel как число
+        
+        if text.isdigit() and int(text) in plan_ids:
+            resolved.append((int(text), plan_ids[int(text)], 100))
+            continue
+        
+        key = ' '.join(text.lower().split())
+        if key in by_name:
+            resolved.append((by_name[key], plan_ids[by_name[key]], 100))
+            continue
+        
+        if not key:
+            resolved.append((None, None, 0))
+            continue
+        
+        # Индекс по названиям плана строится только если дошло до нечёткого поиска
+        if name_index is None:
+            from sclad.matching import FUZZY_MATCH_THRESHOLD, StockNameIndex
+            name_index = StockNameIndex(plan_df['name'].astype(str).tolist())
+        match, score = name_index.find_best_match(text, FUZZY_MATCH_THRESHOLD)
+        resolved.append((by_name[' '.join(match.lower().split())], match, score) if match else (None, None, score))
+    return resolved
+
+def ingest_shipments(storage, project_id, receipts_df, user, commit=False):
+    """
+    Пакетный ввод приходов объекта в хранилище storage. Каждая строка проверяется (материал найден, кол-во > 0);
+    при commit=True и отсутствии ошибок весь пакет записывается одной операцией хранилища.
+    Возвращает отчёт по строкам (RECEIPT_REPORT_COLUMNS).
+    """
+    pid = int(project_id)
+    plan_df = storage.project_materials(pid)
+    if not plan_df.empty:
+        plan_df = plan_df[~plan_df['removed'].astype(bool)]
+    
+    qty, qty_text = parse_qty(receipts_df['qty'])
+    resolved = resolve_materials(receipts_df['material'], plan_df)
+    
+    report = pd.DataFrame({
+        'Строка': receipts_df.index + 2,  # номер строки в файле (после заголовка)
+        'Материал (файл)': receipts_df['material'].astype(object),
+        'Материал (План)': [name for _, name, _ in resolved],
+        'Сходство (%)': [score for _, _, score in resolved],
+        'Кол-во': qty.astype('float64'),
+        'Статус': 'Готово к записи',
+        'ID операции': None,
+    }, columns=RECEIPT_REPORT_COLUMNS)
+    
+    material_ids = pd.Series([material_id for material_id, _, _ in resolved], index=receipts_df.index, dtype=object)
+    report.loc[material_ids.isna().values, 'Статус'] = '❌ Материал не найден в плане'
+    report.loc[(material_ids.notna() & ~(qty > 0).fillna(False)).values, 'Статус'] = '❌ Кол-во должно быть больше 0'
+    if not user:
+        report['Статус'] = '❌ Не выбран сотрудник'
+    
+    has_errors = report['Статус'].str.startswith('❌').any()
+    if commit and not has_errors and not report.empty:
+        arrival_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        text_cols = receipts_df[['store', 'doc_number', 'note']].fillna('').astype(str)
+        rows = [{
+            'material_id': int(material_id),
+            'qty': float(q),
+            'user_name': user,
+            'arrival_date': arrival_date,
+            'store': store,
+            'doc_number': doc_number,
+            'note': note,
+            'op_type': 'Приход',
+        } for material_id, q, store, doc_number, note in zip(
+            material_ids, qty, text_cols['store'], text_cols['doc_number'], text_cols['note'])]
+        
+        report['ID операции'] = storage.add_shipments(rows)
+        report['Статус'] = '✅ Записано'
+    return report
@@ -0,0 +1,329 @@
+"""
+Хранилище в SQL-базе (SQLAlchemy).
+"""
+
+import os
+
+import pandas as pd
+import sqlalchemy as sa
+
+from sclad.plan import IMPORT_CHUNK_ROWS
+from sclad.storage import DATE_FORMAT, Storage, VersionConflict, compact_types, diff_totals, memory_report
+
+class SqlStorage(Storage):
+    """
+    Хранилище в SQL-базе через SQLAlchemy: PostgreSQL на сервере, SQLite локально.
+    
+    Запись — одна строка INSERT/UPDATE/DELETE в транзакции. Итог по материалу
+    хранится в таблице material_totals и обновляется в той же транзакции, что и операция.
+    """
+    
+    def __init__(self, url, pool_size=5, max_overflow=10):
+        engine_kwargs = {'pool_pre_ping': True}
+        
+        if url.startswith('sqlite'):
+            # Для файла SQLite создаём папку заранее
+            db_path = url.split(':///', 1)[-1]
+            if db_path and db_path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        else:
+            engine_kwargs.update(pool_size=pool_size, max_overflow=max_overflow)
+        
+        self.engine = sa.create_engine(url, **engine_kwargs)
+        
+        metadata = sa.MetaData()
+        # sqlite_autoincrement — id удалённых строк не выдаются повторно
+        self.projects_t = sa.Table(
+            'projects', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('name', sa.String(255), nullable=False, unique=True),
+            sa.Column('plan_hash', sa.String(64)),
+            sa.Column('version', sa.Integer, nullable=False, default=0, server_default='0'),
+            sqlite_autoincrement=True,
+        )
+        self.materials_t = sa.Table(
+            'materials', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('project_id', sa.Integer, nullable=False, index=True),
+            sa.Column('name', sa.Text),
+            sa.Column('unit', sa.String(64)),
+            sa.Column('planned_qty', sa.Float, nullable=False, default=0.0),
+            sa.Column('removed', sa.Boolean, nullable=False, default=False, server_default=sa.false()),
+            sqlite_autoincrement=True,
+        )
+        # material_id без внешнего ключа: при замене плана история приходов сохраняется
+        self.shipments_t = sa.Table(
+            'shipments', metadata,
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('material_id', sa.Integer, nullable=False, index=True),
+            sa.Column('qty', sa.Float, nullable=False),
+            sa.Column('user_name', sa.String(255)),
+            sa.Column('arrival_date', sa.String(19)),
+            sa.Column('store', sa.Text),
+            sa.Column('doc_number', sa.Text),
+            sa.Column('note', sa.Text),
+            sa.Column('op_type', sa.String(32)),
+            sqlite_autoincrement=True,
+        )
+        # Архив истории (sclad.archive): те же столбцы, id — прежние id операций
+        self.archive_t = sa.Table(
+            'shipments_archive', metadata,
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=False),
+            sa.Column('material_id', sa.Integer, nullable=False, index=True),
+            sa.Column('qty', sa.Float, nullable=False),
+            sa.Column('user_name', sa.String(255)),
+            sa.Column('arrival_date', sa.String(19)),
+            sa.Column('store', sa.Text),
+            sa.Column('doc_number', sa.Text),
+            sa.Column('note', sa.Text),
+            sa.Column('op_type', sa.String(32)),
+        )
+        self.totals_t = sa.Table(
+            'material_totals', metadata,
+            sa.Column('material_id', sa.Integer, primary_key=True),
+            sa.Column('total', sa.Float, nullable=False, default=0.0),
+        )
+        metadata.create_all(self.engine)
+        
+        # Первый запуск на существующей базе: добавляем новые столбцы и заполняем итоги по операциям
+        with self.engine.begin() as conn:
+            self._add_missing_columns(conn)
+            has_totals = conn.execute(sa.select(self.totals_t.c.material_id).limit(1)).first()
+            has_shipments = conn.execute(sa.select(self.shipments_t.c.id).limit(1)).first()
+            if has_shipments and not has_totals:
+                self._rebuild_totals(conn)
+    
+    def _add_missing_columns(self, conn):
+        """create_all не меняет существующие таблицы — недостающие столбцы добавляем через ALTER TABLE."""
+        inspector = sa.inspect(conn)
+        for table in (self.projects_t, self.materials_t):
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_ddl = sa.schema.CreateColumn(column).compile(dialect=self.engine.dialect)
+                    conn.execute(sa.text(f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}'))
+    
+    def _read(self, query):
+        """Результат запроса с типами TABLE_DTYPES (категории, int32, даты)."""
+        with self.engine.connect() as conn:
+            return compact_types(pd.read_sql(query, conn))
+    
+    def _project_material_ids(self, project_id):
+        m = self.materials_t
+        return sa.select(m.c.id).where(m.c.project_id == project_id).scalar_subquery()
+    
+    def _recompute_totals_query(self):
+        s = self.shipments_t
+        return sa.select(s.c.material_id, sa.func.sum(s.c.qty).label('total')).group_by(s.c.material_id)
+    
+    def _rebuild_totals(self, conn):
+        conn.execute(sa.delete(self.totals_t))
+        conn.execute(sa.insert(self.totals_t).from_select(['material_id', 'total'], self._recompute_totals_query()))
+    
+    def _bump_version(self, conn, project_id=None, material_id=None, expected_version=None):
+        """version += 1 для объекта (или объекта материала); при несовпадении expected_version — VersionConflict."""
+        p, m = self.projects_t, self.materials_t
+        if project_id is None:
+            project_id = sa.select(m.c.project_id).where(m.c.id == material_id).scalar_subquery()
+        stmt = sa.update(p).where(p.c.id == project_id).values(version=p.c.version + 1)
+        if expected_version is not None:
+            stmt = stmt.where(p.c.version == expected_version)
+            if conn.execute(stmt).rowcount == 0:
+                raise VersionConflict(f"Версия объекта изменилась (ожидалась {expected_version}): данные изменены другим пользователем")
+        else:
+            conn.execute(stmt)
+    
+    def _add_to_total(self, conn, material_id, qty):
+        """UPSERT: total += qty (INSERT ... ON CONFLICT DO UPDATE для PostgreSQL и SQLite)."""
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        
+        t = self.totals_t
+        stmt = upsert(t).values(material_id=material_id, total=qty)
+        stmt = stmt.on_conflict_do_update(index_elements=[t.c.material_id], set_={'total': t.c.total + stmt.excluded.total})
+        conn.execute(stmt)
+    
+    # --- Чтение ---
+    
+    def projects(self):
+        p = self.projects_t
+        return self._read(sa.select(p.c.id, p.c.name).order_by(p.c.name))
+    
+    def project_materials(self, project_id):
+        m, t = self.materials_t, self.totals_t
+        query = (
+            sa.select(m, sa.func.coalesce(t.c.total, 0.0).label('total'))
+            .select_from(m.outerjoin(t, t.c.material_id == m.c.id))
+            .where(m.c.project_id == project_id)
+            .order_by(m.c.id)
+        )
+        return self._read(query)
+    
+    def project_history(self, project_id):
+        m, s = self.materials_t, self.shipments_t
+        query = (
+            sa.select(s, m.c.name, m.c.unit)
+            .select_from(s.join(m, s.c.material_id == m.c.id))
+            .where(m.c.project_id == project_id)
+            .order_by(s.c.arrival_date.desc(), s.c.id.desc())
+        )
+        return self._read(query)
+    
+    def archived_history(self, project_id, date_from=None, date_to=None):
+        m, a = self.materials_t, self.archive_t
+        query = (
+            sa.select(a, m.c.name, m.c.unit)
+            .select_from(a.join(m, a.c.material_id == m.c.id))
+            .where(m.c.project_id == project_id)
+            .order_by(a.c.arrival_date.desc(), a.c.id.desc())
+        )
+        # Дата хранится текстом DATE_FORMAT — сравнение строк совпадает с хронологическим
+        if date_from is not None:
+            query = query.where(a.c.arrival_date >= pd.Timestamp(date_from).strftime(DATE_FORMAT))
+        if date_to is not None:
+            query = query.where(a.c.arrival_date < pd.Timestamp(date_to).strftime(DATE_FORMAT))
+        return self._read(query)
+    
+    def plan_hash(self, project_id):
+        p = self.projects_t
+        with self.engine.connect() as conn:
+            return conn.execute(sa.select(p.c.plan_hash).where(p.c.id == project_id)).scalar()
+    
+    def version(self, project_id):
+        p = self.projects_t
+        with self.engine.connect() as conn:
+            return conn.execute(sa.select(p.c.version).where(p.c.id == project_id)).scalar() or 0
+    
+    def project_versions(self):
+        p = self.projects_t
+        with self.engine.connect() as conn:
+            return {int(pid): version or 0 for pid, version in conn.execute(sa.select(p.c.id, p.c.version))}
+    
+    def get_shipment(self, shipment_id, project_id=None):
+        s = self.shipments_t
+        query = sa.select(s).where(s.c.id == shipment_id)
+        if project_id is not None:
+            query = query.where(s.c.material_id.in_(self._project_material_ids(project_id)))
+        with self.engine.connect() as conn:
+            row = conn.execute(query).mappings().first()
+        return dict(row) if row else None
+    
+    # --- Запись ---
+    
+    def add_project(self, name):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(sa.insert(self.projects_t).values(name=name))
+        except sa.exc.IntegrityError:
+            return False
+        return True
+    
+    def rename_project(self, project_id, new_name):
+        p = self.projects_t
+        try:
+            with self.engine.begin() as conn:
+                if conn.execute(sa.select(p.c.id).where(p.c.name == new_name)).first():
+                    return False
+                renamed = conn.execute(sa.update(p).where(p.c.id == project_id).values(name=new_name)).rowcount
+        except sa.exc.IntegrityError:
+            return False
+        return renamed > 0
+    
+    def delete_project(self, project_id):
+        m, s, p = self.materials_t, self.shipments_t, self.projects_t
+        t, a = self.totals_t, self.archive_t
+        with self.engine.begin() as conn:
+            conn.execute(sa.delete(s).where(s.c.material_id.in_(self._project_material_ids(project_id))))
+            conn.execute(sa.delete(a).where(a.c.material_id.in_(self._project_material_ids(project_id))))
+            conn.execute(sa.delete(t).where(t.c.material_id.in_(self._project_material_ids(project_id))))
+            conn.execute(sa.delete(m).where(m.c.project_id == project_id))
+            conn.execute(sa.delete(p).where(p.c.id == project_id))
+    
+    def clear_history(self, project_id):
+        s, t, a = self.shipments_t, self.totals_t, self.archive_t
+        with self.engine.begin() as conn:
+            conn.execute(sa.delete(s).where(s.c.material_id.in_(self._project_material_ids(project_id))))
+            conn.execute(sa.delete(a).where(a.c.material_id.in_(self._project_material_ids(project_id))))
+            conn.execute(sa.delete(t).where(t.c.material_id.in_(self._project_material_ids(project_id))))
+            self._bump_version(conn, project_id=project_id)
+    
+    def apply_plan_diff(self, project_id, inserts, updates, removed_ids, plan_hash, expected_version=None):
+        m, p = self.materials_t, self.projects_t
+        update_stmt = (
+            sa.update(m).where(m.c.id == sa.bindparam('b_id'))
+            .values(name=sa.bindparam('b_name'), unit=sa.bindparam('b_unit'),
+                    planned_qty=sa.bindparam('b_planned_qty'), removed=sa.bindparam('b_removed'))
+        )
+        with self.engine.begin() as conn:
+            # Версия проверяется первой: при конфликте транзакция откатывается целиком
+            self._bump_version(conn, project_id=project_id, expected_version=expected_version)
+            # Большой план пишется порциями в той же транзакции
+            for start in range(0, len(updates), IMPORT_CHUNK_ROWS):
+                chunk = updates[start:start + IMPORT_CHUNK_ROWS]
+                conn.execute(update_stmt, [{f'b_{key}': value for key, value in row.items()} for row in chunk])
+            for start in range(0, len(removed_ids), IMPORT_CHUNK_ROWS):
+                chunk = removed_ids[start:start + IMPORT_CHUNK_ROWS]
+                conn.execute(sa.update(m).where(m.c.id.in_(chunk)).values(removed=True))
+            for start in range(0, len(inserts), IMPORT_CHUNK_ROWS):
+                conn.execute(sa.insert(m), inserts[start:start + IMPORT_CHUNK_ROWS])
+            conn.execute(sa.update(p).where(p.c.id == project_id).values(plan_hash=plan_hash))
+        return True
+    
+    def add_shipment(self, row):
+        with self.engine.begin() as conn:
+            result = conn.execute(sa.insert(self.shipments_t).values(**row))
+            self._add_to_total(conn, row['material_id'], row['qty'])
+            self._bump_version(conn, material_id=row['material_id'])
+        return result.inserted_primary_key[0]
+    
+    def add_shipments(self, rows):
+        if not rows:
+            return []
+        s = self.shipments_t
+        totals = {}
+        for row in rows:
+            totals[row['material_id']] = totals.get(row['material_id'], 0.0) + float(row['qty'])
+        
+        with self.engine.begin() as conn:
+            # executemany с RETURNING: id возвращаются в порядке строк
+            new_ids = conn.execute(s.insert().returning(s.c.id, sort_by_parameter_order=True), rows).scalars().all()
+            for material_id, qty in totals.items():
+                self._add_to_total(conn, material_id, qty)
+            self._bump_version(conn, material_id=rows[0]['material_id'])
+        return list(new_ids)
+    
+    def archive_shipments(self, project_id, archived_df, balances, dropped_ids, expected_version=None):
+        s, t, a = self.shipments_t, self.totals_t, self.archive_t
+        archived_ids = [int(row_id) for row_id in archived_df['id']]
+        columns = [column.name for column in a.columns]
+        with self.engine.begin() as conn:
+            self._bump_version(conn, project_id=project_id, expected_version=expected_version)
+            # Строки переносятся внутри базы (INSERT ... SELECT) — значения те же, что в shipments
+            for start in range(0, len(archived_ids), IMPORT_CHUNK_ROWS):
+                chunk = archived_ids[start:start + IMPORT_CHUNK_ROWS]
+                conn.execute(sa.insert(a).from_select(columns, sa.select(*[s.c[name] for name in columns]).where(s.c.id.in_(chunk))))
+            removed = archived_ids + dropped_ids
+            for start in range(0, len(removed), IMPORT_CHUNK_ROWS):
+                conn.execute(sa.delete(s).where(s.c.id.in_(removed[start:start + IMPORT_CHUNK_ROWS])))
+            for start in range(0, len(balances), IMPORT_CHUNK_ROWS):
+                conn.execute(sa.insert(s), balances[start:start + IMPORT_CHUNK_ROWS])
+            # Итоги объекта пересчитываются по оставшимся строкам (сумма та же, без накопленной погрешности)
+            project_materials = self._project_material_ids(project_id)
+            conn.execute(sa.delete(t).where(t.c.material_id.in_(project_materials)))
+            conn.execute(sa.insert(t).from_select(['material_id', 'total'],
+                                                  self._recompute_totals_query().where(s.c.material_id.in_(project_materials))))
+        return True
+    
+    def memory_report(self):
+        # В памяти таблицы не держатся — оцениваем, сколько заняли бы прочитанные целиком
+        tables = (('projects', self.projects_t), ('materials', self.materials_t), ('shipments', self.shipments_t))
+        return memory_report([(name, self._read(sa.select(table))) for name, table in tables])
+    
+    def check_totals(self):
+        t = self.totals_t
+        with self.engine.connect() as conn:
+            stored = dict(conn.execute(sa.select(t.c.material_id, t.c.total)).all())
+            recomputed = dict(conn.execute(self._recompute_totals_query()).all())
+        return diff_totals(stored, recomputed)
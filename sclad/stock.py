@@ -0,0 +1,226 @@
+"""
+Файл остатков: загрузка с кэшем на диске, агрегат по названиям и сравнение с планом объекта.
+"""
+
+import hashlib
+import io
+import json
+import os
+
+import pandas as pd
+
+from sclad.matching import FUZZY_MATCH_THRESHOLD, MatchMemo, StockNameIndex
+from sclad.storage import DEFAULT_DATA_DIR, fsync_write
+
+# --- КОНСТАНТЫ ---
+STOCK_COLUMNS = {1: 'Name_Stock', 12: 'Store_Stock', 13: 'Qty_Stock', 16: 'Shelf_Stock'}  # номера столбцов в файле остатков
+STOCK_MIN_COLS = 17  # минимальное число столбцов в файле остатков
+STOCK_FETCH_TIMEOUT = (5, 60)  # таймауты загрузки: (соединение, чтение), сек
+STOCK_CACHE_DIR = os.path.join(DEFAULT_DATA_DIR, 'stock_cache')  # скачанные и разобранные файлы остатков
+MATCH_MEMO_PATH = os.path.join(STOCK_CACHE_DIR, 'match_memo.sqlite')  # память сопоставлений
+
+# --- Загрузка файла остатков ---
+
+def make_http_session():
+    """HTTP-сессия с пулом соединений и повтором при 502/503/504."""
+    import requests
+    from urllib3.util.retry import Retry
+    
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=['GET'])
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def normalize_stock_url(url):
+    """Ссылку на редактирование Google Таблицы превращает в ссылку на выгрузку xlsx."""
+    url = url.strip()
+    if "docs.google.com/spreadsheets/d/" in url and "/edit" in url:
+        start_index = url.find('/d/') + 3
+        end_index = url.find('/edit')
+        sheet_id = url[start_index:end_index]
+        url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
+    return url
+
+def fetch_stock_file(url, cache_dir, session=None, timeout=STOCK_FETCH_TIMEOUT):
+    """
+    Скачивает файл остатков с условным запросом (ETag / Last-Modified) и кэширует на диске:
+    
+        <sha256(url)>.json     — валидаторы ответа и хэш содержимого для этой ссылки
+        <content_hash>.xlsx    — исходный файл
+        <content_hash>.pkl     — разобранная таблица (нужные столбцы)
+    
+    Возвращает (content_hash, status), status: 'not_modified' (304, файл не разбирается),
+    'unchanged' (скачан тот же файл, что уже разобран), 'downloaded' или 'cached'
+    (сервер недоступен — взята последняя разобранная версия по этой ссылке).
+    """
+    import requests
+    
+    if session is None:
+        session = requests.Session()
+    os.makedirs(cache_dir, exist_ok=True)
+    
+    meta_path = os.path.join(cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+    
+    # Условный запрос — только если разобранный файл действительно есть в кэше
+    headers = {}
+    cached_hash = meta.get('content_hash')
+    has_cache = bool(cached_hash) and os.path.exists(os.path.join(cache_dir, f'{cached_hash}.pkl'))
+    if has_cache:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    
+    try:
+        response = session.get(url, headers=headers, timeout=timeout)
+        if response.status_code >= 500:
+            response.raise_for_status()
+    except (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError, requests.HTTPError):
+        # Сервер недоступен или отвечает ошибкой: сравниваем с последней загруженной версией
+        if has_cache:
+            return cached_hash, 'cached'
+        raise
+    if response.status_code == 304 and headers:
+        return cached_hash, 'not_modified'
+    response.raise_for_status()
+    
+    content = response.content
+    content_hash = hashlib.sha256(content).hexdigest()
+    parsed_path = os.path.join(cache_dir, f'{content_hash}.pkl')
+    
+    status = 'unchanged'
+    if not os.path.exists(parsed_path):
+        status = 'downloaded'
+        stock_df = pd.read_excel(io.BytesIO(content), header=None)
+        if stock_df.shape[1] < STOCK_MIN_COLS:
+            raise ValueError(f"В файле должно быть минимум {STOCK_MIN_COLS} столбцов. Найдено: {stock_df.shape[1]}")
+        
+        fsync_write(os.path.join(cache_dir, f'{content_hash}.xlsx'), content)
+        stock_df[list(STOCK_COLUMNS)].to_pickle(parsed_path + '.tmp')
+        os.replace(parsed_path + '.tmp', parsed_path)
+    
+    new_meta = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'content_hash': content_hash,
+    }
+    fsync_write(meta_path + '.tmp', json.dumps(new_meta).encode('utf-8'))
+    os.replace(meta_path + '.tmp', meta_path)
+    
+    # Прежняя версия файла по этой ссылке больше не нужна (если на неё не ссылается другая ссылка)
+    if cached_hash and cached_hash != content_hash:
+        _drop_unreferenced_stock_files(cache_dir, cached_hash)
+    
+    return content_hash, status
+
+def _drop_unreferenced_stock_files(cache_dir, content_hash):
+    for name in os.listdir(cache_dir):
+        if name.endswith('.json'):
+            with open(os.path.join(cache_dir, name), encoding='utf-8') as f:
+                if json.load(f).get('content_hash') == content_hash:
+                    return
+    for ext in ('xlsx', 'pkl'):
+        path = os.path.join(cache_dir, f'{content_hash}.{ext}')
+        if os.path.exists(path):
+            os.remove(path)
+
+# --- Агрегат остатков и сопоставление ---
+
+def _join_unique(stock_df, column):
+    """'; '.join уникальных значений столбца по каждому названию (в порядке появления)."""
+    unique_rows = stock_df.drop_duplicates(subset=['Name_Key', column])
+    return unique_rows.groupby('Name_Key', sort=False)[column].agg('; '.join)
+
+def build_stock_table(content_hash, cache_dir):
+    """
+    Один проход по файлу остатков: нормализованное название, сумма количества,
+    уникальные склады и полки + индекс названий (приложение кэширует результат по хэшу
+    содержимого файла). Разобранная таблица берётся из дискового кэша fetch_stock_file.
+    """
+    stock_df = pd.read_pickle(os.path.join(cache_dir, f'{content_hash}.pkl'))
+    stock_df = stock_df.rename(columns=STOCK_COLUMNS)[list(STOCK_COLUMNS.values())].copy()
+    stock_df.dropna(subset=['Name_Stock'], inplace=True)
+    
+    stock_df['Name_Key'] = stock_df['Name_Stock'].astype(str).str.strip().str.lower()
+    stock_df['Qty_Stock'] = pd.to_numeric(stock_df['Qty_Stock'], errors='coerce')
+    stock_df['Store_Stock'] = stock_df['Store_Stock'].map(str)
+    stock_df['Shelf_Stock'] = stock_df['Shelf_Stock'].map(str)
+    
+    stock_agg = pd.DataFrame({
+        'Qty_Stock_Agg': stock_df.groupby('Name_Key', sort=False)['Qty_Stock'].sum(),
+        'Store_Stock_Agg': _join_unique(stock_df, 'Store_Stock'),
+        'Shelf_Stock_Agg': _join_unique(stock_df, 'Shelf_Stock'),
+    })
+    
+    stock_names = stock_agg.index.tolist()
+    names_hash = hashlib.sha256('\n'.join(stock_names).encode('utf-8')).hexdigest()
+    return stock_agg, StockNameIndex(stock_names), names_hash
+
+def match_stock(stock_table, data_df, memo_path=MATCH_MEMO_PATH, threshold=FUZZY_MATCH_THRESHOLD, exhaustive=False,
+                progress=None):
+    """
+    Сопоставляет план объекта (data_df: name, unit) с остатками.
+    stock_table — результат build_stock_table; exhaustive — полный перебор для проверки индекса.
+    progress(done, total) — ход сопоставления по уникальным названиям плана (найденные в памяти — сразу).
+    В result.attrs — сколько названий взято из памяти (memo_hits) и пересчитано (memo_misses).
+    """
+    stock_agg, name_index, names_hash = stock_table
+    
+    project_materials = data_df[['name', 'unit']].copy()
+    project_materials.rename(columns={'name': 'Name_Project'}, inplace=True)
+    project_materials['Name_Project_Lower'] = project_materials['Name_Project'].astype(str).str.strip().str.lower()
+    
+    # Каждое уникальное название плана сопоставляется один раз; известные берутся из памяти
+    plan_names = project_materials['Name_Project_Lower'].unique().tolist()
+    memo = MatchMemo(memo_path)
+    matches = {} if exhaustive else memo.get_many(names_hash, threshold, plan_names)
+    memo_hits = len(matches)
+    
+    new_matches = {}
+    if progress:
+        progress(memo_hits, len(plan_names))
+    for project_name in plan_names:
+        if project_name not in matches:
+            new_matches[project_name] = name_index.find_best_match(project_name, threshold, exhaustive=exhaustive)
+            if progress:
+                progress(memo_hits + len(new_matches), len(plan_names))
+    
+    memo.put_many(names_hash, threshold, new_matches)
+    matches.update(new_matches)
+    
+    project_materials['Name_Stock_Match'] = project_materials['Name_Project_Lower'].map(lambda x: matches[x][0])
+    project_materials['Match_Score'] = project_materials['Name_Project_Lower'].map(lambda x: matches[x][1])
+    
+    # Остатки по найденным названиям — только поиск в готовом агрегате
+    final_df = project_materials.join(stock_agg, on='Name_Stock_Match').drop_duplicates(subset=['Name_Project'])
+    
+    result_df = final_df[[
+        'Name_Project', 'unit', 'Qty_Stock_Agg', 'Store_Stock_Agg', 'Shelf_Stock_Agg', 'Match_Score'
+    ]].copy()
+    
+    result_df.columns = ['Материал (План)', 'Ед. изм.', 'Количество (Склад)', 'Склады', 'Номера полок', 'Сходство (%)']
+    
+    result_df['Количество (Склад)'] = result_df['Количество (Склад)'].fillna(0).astype(float).round(2)
+    result_df['Склады'] = result_df['Склады'].fillna('—')
+    result_df['Номера полок'] = result_df['Номера полок'].fillna('—') 
+    
+    result_df['Сходство (%)'] = result_df['Сходство (%)'].apply(lambda x: f"{int(x)}%")
+    
+    result_df = result_df.sort_values(by=['Сходство (%)', 'Материал (План)'], ascending=[False, True])
+    result_df.attrs['memo_hits'] = memo_hits
+    result_df.attrs['memo_misses'] = len(new_matches)
+    return result_df
+
+def compare_with_stock(url, data_df, cache_dir=STOCK_CACHE_DIR, session=None, exhaustive=False):
+    """Загрузка остатков по ссылке + сопоставление с планом без кэша в памяти (для скриптов и CLI)."""
+    content_hash, _ = fetch_stock_file(normalize_stock_url(url), cache_dir, session=session)
+    stock_table = build_stock_table(content_hash, cache_dir)
+    return match_stock(stock_table, data_df, memo_path=os.path.join(cache_dir, 'match_memo.sqlite'), exhaustive=exhaustive)
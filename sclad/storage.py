@@ -0,0 +1,278 @@
+"""
+Интерфейс хранилища и общие для всех реализаций функции.
+
+Реализации подключаются лениво (open_storage): журнал на диске — sclad.journal
+(pyarrow), SQL-база — sclad.sql (SQLAlchemy).
+"""
+
+import io
+import json
+import os
+
+import pandas as pd
+
+# --- КОНСТАНТЫ ---
+DEFAULT_DATA_DIR = 'data'  # папка со снимком базы и журналом операций
+DEFAULT_SQL_URL = 'sqlite:///data/sclad.db'  # для backend = "sql", если url не задан
+TOTALS_TOLERANCE = 1e-6  # допустимое расхождение итогов при проверке целостности
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'  # arrival_date в журнале, SQL и старом JSON
+
+# Компактные типы столбцов в памяти: повторяющийся текст — category (пропуск = ''),
+# id — int32, дата операции — datetime64 (сортируется по времени, а не как строка).
+# Количества остаются float64: итоги сверяются с точностью TOTALS_TOLERANCE, а float32
+# держит только ~7 значащих цифр (1234.56 -> 1234.5601).
+TABLE_DTYPES = {
+    'projects': {'id': 'int32', 'name': 'str'},
+    'materials': {
+        'id': 'int32', 'project_id': 'int32', 'name': 'str', 'unit': 'category',
+        'planned_qty': 'float64', 'removed': 'bool',
+    },
+    'shipments': {
+        'id': 'int32', 'material_id': 'int32', 'qty': 'float64', 'user_name': 'category',
+        'arrival_date': 'datetime64[us]', 'store': 'category', 'doc_number': 'str', 'note': 'str', 'op_type': 'category',
+    },
+}
+# Одноимённые столбцы разных таблиц имеют один тип — годится и для выборок с join
+COLUMN_DTYPES = {column: dtype for columns in TABLE_DTYPES.values() for column, dtype in columns.items()}
+
+# Базовая структура БД для первого запуска
+EMPTY_DB_STRUCTURE = {
+    table_name: pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in columns.items()})
+    for table_name, columns in TABLE_DTYPES.items()
+}
+
+def compact_types(df):
+    """Приводит столбцы df, перечисленные в COLUMN_DTYPES, к компактным типам (уже приведённые не трогает)."""
+    for column in df.columns.intersection(list(COLUMN_DTYPES)):
+        values, dtype = df[column], COLUMN_DTYPES[column]
+        if dtype == 'category':
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                df[column] = values.fillna('').astype(str).astype('category')
+        elif dtype.startswith('datetime64'):
+            if not pd.api.types.is_datetime64_dtype(values):
+                df[column] = pd.to_datetime(values, format='ISO8601', errors='coerce')
+        elif dtype == 'str':
+            if values.dtype == object:
+                df[column] = values.astype('str')
+        elif dtype == 'bool':
+            df[column] = values.fillna(False).astype(bool)
+        elif values.dtype != dtype:
+            df[column] = pd.to_numeric(values, errors='coerce').fillna(0).astype(dtype)
+    return df
+
+def enforce_types(df, table_name):
+    """Приводит таблицу к типам TABLE_DTYPES: после загрузки (JSON, снимок, журнал) и перед записью снимка."""
+    if df.empty:
+        return EMPTY_DB_STRUCTURE[table_name].copy()
+    
+    # removed — строка исключена из плана при повторной загрузке (история по ней сохраняется)
+    if table_name == 'materials' and 'removed' not in df:
+        df['removed'] = False
+    return compact_types(df)
+
+def plain_types(df, columns=None):
+    """
+    Копия df в простых типах: категории и строки — object, целые — int64, даты — текст DATE_FORMAT.
+    columns — только эти столбцы (например, перед записью в них значений, которых нет среди категорий).
+    """
+    df = df.copy()
+    for column in (df.columns if columns is None else columns):
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values):
+            df[column] = values.astype(object)
+        elif pd.api.types.is_datetime64_dtype(values):
+            df[column] = values.dt.strftime(DATE_FORMAT).astype(object)
+        elif pd.api.types.is_integer_dtype(values):
+            df[column] = values.astype('int64')
+    return df
+
+def concat_rows(df, new_rows):
+    """pd.concat двух частей таблицы без потери категорий: словари категорий объединяются."""
+    if df.empty:
+        return new_rows
+    
+    updated, new_rows = {}, new_rows.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            categories = df[column].cat.categories
+            added = new_rows[column].astype(object).dropna().unique()
+            added = [value for value in added if value not in categories]
+            if added:
+                # Новые категории дописываются в конец — коды старых строк не меняются
+                updated[column] = df[column].cat.add_categories(added)
+                categories = updated[column].cat.categories
+            new_rows[column] = new_rows[column].astype(object).astype(pd.CategoricalDtype(categories))
+    return pd.concat([df.assign(**updated) if updated else df, new_rows])
+
+def memory_report(frames):
+    """
+    Память таблиц: frames — пары (таблица, DataFrame), части одной таблицы суммируются.
+    plain_mb — в простых типах (как до компактной схемы), compact_mb — как хранится сейчас.
+    """
+    totals = {}
+    for table_name, df in frames:
+        rows, plain, compact = totals.get(table_name, (0, 0, 0))
+        totals[table_name] = (
+            rows + len(df),
+            plain + plain_types(df).memory_usage(index=False, deep=True).sum(),
+            compact + df.memory_usage(index=False, deep=True).sum(),
+        )
+    
+    report = pd.DataFrame(
+        [(table_name, rows, plain / 2 ** 20, compact / 2 ** 20) for table_name, (rows, plain, compact) in totals.items()],
+        columns=['table', 'rows', 'plain_mb', 'compact_mb'],
+    )
+    report['saved_pct'] = (1 - report['compact_mb'] / report['plain_mb'].where(report['plain_mb'] > 0)).fillna(0.0) * 100
+    return report.round({'plain_mb': 2, 'compact_mb': 2, 'saved_pct': 1})
+
+def parse_db_json(db_json):
+    """Разбирает JSON-строку с таблицами (формат orient='split') в словарь DataFrame."""
+    db = {key: df.copy() for key, df in EMPTY_DB_STRUCTURE.items()}
+    if not db_json or db_json in ["{}", ""]:
+        return db
+    
+    db_data = json.loads(db_json)
+    for key, df_json in db_data.items():
+        df = pd.read_json(io.StringIO(df_json), orient='split')
+        db[key] = enforce_types(df, key)
+    return db
+
+def fsync_write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+class Storage:
+    """
+    Интерфейс хранилища. Функции ядра (импорт плана, приходы, данные объекта, ...)
+    и страницы приложения работают только через эти методы и не знают, где лежат данные.
+    """
+    
+    # --- Чтение ---
+    
+    def projects(self):
+        """Все объекты (id, name), отсортированные по имени."""
+        raise NotImplementedError
+    
+    def project_materials(self, project_id):
+        """Материалы объекта со столбцом total (сумма всех операций по материалу)."""
+        raise NotImplementedError
+    
+    def project_history(self, project_id):
+        """Операции по материалам объекта (+ name, unit материала), новые сверху."""
+        raise NotImplementedError
+    
+    def get_shipment(self, shipment_id, project_id=None):
+        """Одна операция в виде dict или None. project_id (если известен) — объект операции: ищется только в нём."""
+        raise NotImplementedError
+    
+    def plan_hash(self, project_id):
+        """Хэш содержимого последнего загруженного файла плана (None, если плана не было)."""
+        raise NotImplementedError
+    
+    def version(self, project_id):
+        """Версия данных объекта: растёт с каждой записью (для проверки конфликтов)."""
+        raise NotImplementedError
+    
+    def project_versions(self):
+        """Версии всех объектов одним чтением: {project_id: version}."""
+        return {int(pid): self.version(int(pid)) for pid in self.projects()['id']}
+    
+    # --- Запись ---
+    
+    def add_project(self, name):
+        """Создаёт объект. False, если имя уже занято."""
+        raise NotImplementedError
+    
+    def rename_project(self, project_id, new_name):
+        """Переименовывает объект. False, если имя уже занято или объекта нет."""
+        raise NotImplementedError
+    
+    def delete_project(self, project_id):
+        """Удаляет объект, его материалы и все операции по ним."""
+        raise NotImplementedError
+    
+    def clear_history(self, project_id):
+        """Удаляет все операции по материалам объекта (и архив его истории)."""
+        raise NotImplementedError
+    
+    def apply_plan_diff(self, project_id, inserts, updates, removed_ids, plan_hash, expected_version=None):
+        """
+        Применяет изменения плана одной операцией: inserts — новые строки (без id),
+        updates — dict с id и новыми name/unit/planned_qty/removed,
+        removed_ids — материалы, которых больше нет в плане (помечаются removed).
+        Если версия объекта уже не expected_version — VersionConflict, ничего не записано.
+        """
+        raise NotImplementedError
+    
+    def add_shipment(self, row):
+        """Добавляет операцию (row без id) и возвращает её id."""
+        raise NotImplementedError
+    
+    def add_shipments(self, rows):
+        """Добавляет пакет операций одного объекта одной записью; возвращает их id."""
+        raise NotImplementedError
+    
+    # --- Архив истории ---
+    
+    def archive_shipments(self, project_id, archived_df, balances, dropped_ids, expected_version=None):
+        """
+        Сжатие истории одной операцией (см. sclad.archive.plan_compaction): строки archived_df
+        переносятся в архив, dropped_ids удаляются, balances (без id) добавляются.
+        Если версия объекта уже не expected_version — VersionConflict, ничего не записано.
+        """
+        raise NotImplementedError
+    
+    def archived_history(self, project_id, date_from=None, date_to=None):
+        """Операции объекта из архива (как project_history), за период [date_from, date_to), новые сверху."""
+        raise NotImplementedError
+    
+    # --- Контроль ---
+    
+    def memory_report(self):
+        """Память таблиц хранилища до и после приведения к TABLE_DTYPES (sclad.storage.memory_report)."""
+        raise NotImplementedError
+    
+    def check_totals(self):
+        """
+        Сверяет материализованные итоги с пересчётом по всем операциям.
+        Возвращает расхождения (material_id, total, recomputed); пустой DataFrame — всё в порядке.
+        """
+        raise NotImplementedError
+
+def diff_totals(stored, recomputed):
+    """Сравнивает два набора итогов {material_id: total} с учётом погрешности float."""
+    rows = []
+    for material_id in set(stored) | set(recomputed):
+        total = stored.get(material_id, 0.0)
+        expected = recomputed.get(material_id, 0.0)
+        if abs(total - expected) > TOTALS_TOLERANCE:
+            rows.append({'material_id': material_id, 'total': total, 'recomputed': expected})
+    return pd.DataFrame(rows, columns=['material_id', 'total', 'recomputed'])
+
+class VersionConflict(Exception):
+    """Данные объекта изменились после чтения (версия не совпала с ожидаемой)."""
+
+def open_storage(storage_cfg):
+    """
+    Хранилище по настройкам секции [storage] (secrets.toml):
+    backend = "journal" (по умолчанию, data_dir) или "sql" (url, pool_size, max_overflow).
+    """
+    backend = storage_cfg.get('backend', 'journal')
+    
+    if backend == 'sql':
+        from sclad.sql import SqlStorage
+        return SqlStorage(
+            storage_cfg.get('url', DEFAULT_SQL_URL),
+            pool_size=int(storage_cfg.get('pool_size', 5)),
+            max_overflow=int(storage_cfg.get('max_overflow', 10)),
+        )
+    if backend == 'journal':
+        from sclad.journal import JournalStore
+        data_dir = storage_cfg.get('data_dir', DEFAULT_DATA_DIR)
+        # Старая база из secrets используется только как начальные данные при первом запуске
+        seed_json = storage_cfg.get('database_json', '{}')
+        return JournalStore(data_dir, seed_json=seed_json)
+    raise ValueError(f"Неизвестный тип хранилища: {backend}")
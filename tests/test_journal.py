@@ -0,0 +1,323 @@
+"""
+Поведение локального хранилища sclad.journal: перезапуск (снимок + хвост журнала),
+сворачивание журнала, параллельные записи, VersionConflict и согласованность
+журнала с памятью при ошибках.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import sclad.journal
+from sclad.journal import JournalShard, JournalStore
+from sclad.project import add_shipment, undo_shipment
+from sclad.storage import VersionConflict
+
+def plan_rows(pid, names):
+    return [{'project_id': pid, 'name': name, 'unit': 'шт', 'planned_qty': 10.0, 'removed': False} for name in names]
+
+def new_project(store, name, materials=('Бетон', 'Арматура')):
+    store.add_project(name)
+    pid = int(store.projects().set_index('name').loc[name, 'id'])
+    store.apply_plan_diff(pid, plan_rows(pid, materials), [], [], plan_hash=name)
+    return pid, [int(material_id) for material_id in store.project_materials(pid)['id']]
+
+def receive(store, material_id, qty, note=''):
+    return add_shipment(store, material_id, qty, 'Тест', datetime(2025, 1, 1, 12, 0), 'Склад', '', note)
+
+def state(store):
+    """Всё содержимое хранилища, которое видит приложение."""
+    result = {'projects': store.projects()[['id', 'name']].values.tolist()}
+    for pid, _ in result['projects']:
+        materials = store.project_materials(pid)
+        history = store.project_history(pid).sort_values('id')
+        result[pid] = {
+            'materials': materials[['id', 'name', 'planned_qty', 'total']].values.tolist(),
+            'history': history[['id', 'material_id', 'qty', 'note']].values.tolist(),
+            'version': store.version(pid),
+        }
+    return result
+
+@pytest.fixture
+def data_dir(tmp_path):
+    return str(tmp_path / 'data')
+
+def test_restart_replays_journal(data_dir):
+    store = JournalStore(data_dir)
+    pid, (concrete, rebar) = new_project(store, 'ЖК Север')
+    other_pid, (sand, _) = new_project(store, 'ЖК Юг', materials=('Песок', 'Щебень'))
+    receive(store, concrete, 5)
+    shipment_id = receive(store, rebar, 2.5)
+    undo_shipment(store, shipment_id, 'Тест', project_id=pid)
+    receive(store, sand, 7)
+    store.rename_project(other_pid, 'ЖК Юг-2')
+    before = state(store)
+
+    reopened = JournalStore(data_dir)
+    assert state(reopened) == before
+    assert reopened.check_totals().empty
+    # id продолжаются после зарезервированного блока, а не с начала
+    assert receive(reopened, concrete, 1) > shipment_id
+
+def test_restart_skips_torn_last_line(data_dir):
+    store = JournalStore(data_dir)
+    pid, (concrete, _) = new_project(store, 'ЖК Север')
+    receive(store, concrete, 5)
+    before = state(store)
+
+    # Сбой во время записи: оборванная последняя строка
+    with open(store.shard(pid).journal_path, 'a', encoding='utf-8') as f:
+        f.write('{"op": "insert", "table": "shipm')
+
+    assert state(JournalStore(data_dir)) == before
+
+def test_compaction_writes_snapshot_and_empties_journal(data_dir, monkeypatch):
+    monkeypatch.setattr(sclad.journal, 'JOURNAL_COMPACT_EVERY', 5)
+    store = JournalStore(data_dir)
+    pid, (concrete, rebar) = new_project(store, 'ЖК Север')
+    for i in range(12):
+        receive(store, concrete if i % 2 else rebar, 1.5)
+    shard = store.shard(pid)
+    before = state(store)
+
+    assert shard.journal_len < 5
+    with open(shard.current_path, encoding='utf-8') as f:
+        snapshot_name = f.read().strip()
+    # Старые снимки удалены, в журнале — только записи после снимка
+    assert [name for name in os.listdir(shard.shard_dir) if name.startswith('snapshot-')] == [snapshot_name]
+    with open(shard.journal_path, encoding='utf-8') as f:
+        seqs = [json.loads(line)['seq'] for line in f]
+    assert len(seqs) == shard.journal_len
+    assert all(seq > int(snapshot_name.split('-')[1]) for seq in seqs)
+
+    assert state(JournalStore(data_dir)) == before
+
+def test_snapshot_crash_before_journal_truncate(data_dir):
+    store = JournalStore(data_dir)
+    pid, (concrete, _) = new_project(store, 'ЖК Север')
+    receive(store, concrete, 5)
+    shard = store.shard(pid)
+    with open(shard.journal_path, encoding='utf-8') as f:
+        journal = f.read()
+    shard.compact()
+    # Сбой после записи снимка, но до очистки журнала: записи с seq <= снимка не применяются второй раз
+    with open(shard.journal_path, 'w', encoding='utf-8') as f:
+        f.write(journal)
+
+    reopened = JournalStore(data_dir)
+    assert reopened.project_materials(pid).set_index('id').loc[concrete, 'total'] == 5.0
+    assert len(reopened.project_history(pid)) == 1
+
+def test_concurrent_writes(data_dir):
+    store = JournalStore(data_dir)
+    pid, materials = new_project(store, 'ЖК Север', materials=[f'Материал {i}' for i in range(4)])
+    ids, errors = [], []
+
+    def worker(n):
+        try:
+            for i in range(25):
+                ids.append(receive(store, materials[(n + i) % len(materials)], 1.0))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(set(ids)) == 200
+    assert store.project_materials(pid)['total'].sum() == 200.0
+    assert store.version(pid) == 1 + 200
+    assert store.check_totals().empty
+    assert state(JournalStore(data_dir)) == state(store)
+
+def test_concurrent_reads_during_writes(data_dir):
+    store = JournalStore(data_dir)
+    pid, materials = new_project(store, 'ЖК Север', materials=[f'Материал {i}' for i in range(2000)])
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        try:
+            # Первый приход по материалу добавляет его в итоги, пока читатели строят таблицу
+            for material_id in materials[:150]:
+                receive(store, material_id, 1.0)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            stop.set()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                project_materials = store.project_materials(pid)
+                assert len(project_materials) == len(materials)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert store.project_materials(pid)['total'].sum() == 150.0
+
+def test_version_conflict_writes_nothing(data_dir):
+    store = JournalStore(data_dir)
+    pid, (concrete, _) = new_project(store, 'ЖК Север')
+    stale = store.version(pid)
+    receive(store, concrete, 5)
+    before = state(store)
+
+    with pytest.raises(VersionConflict):
+        store.apply_plan_diff(pid, plan_rows(pid, ['Песок']), [], [], plan_hash='new', expected_version=stale)
+    assert state(store) == before
+    assert store.plan_hash(pid) == 'ЖК Север'
+
+    store.apply_plan_diff(pid, plan_rows(pid, ['Песок']), [], [], plan_hash='new', expected_version=store.version(pid))
+    assert len(store.project_materials(pid)) == 3
+    assert state(JournalStore(data_dir)) == state(store)
+
+def test_concurrent_renames_keep_names_unique(data_dir):
+    store = JournalStore(data_dir)
+    for name in ('A', 'B', 'C', 'D'):
+        store.add_project(name)
+    pids = store.projects()['id'].tolist()
+    results = []
+    threads = [threading.Thread(target=lambda pid=pid: results.append(store.rename_project(pid, 'Общий'))) for pid in pids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False, False, False, True]
+    assert store.projects()['name'].tolist().count('Общий') == 1
+
+def test_rename_deleted_project(data_dir):
+    store = JournalStore(data_dir)
+    pid, _ = new_project(store, 'ЖК Север')
+    store.add_project('ЖК Юг')
+    store.delete_project(pid)
+
+    assert store.rename_project(pid, 'Призрак') is False
+    assert store.projects()['name'].tolist() == ['ЖК Юг']
+    assert JournalStore(data_dir).projects()['name'].tolist() == ['ЖК Юг']
+
+def test_invalid_record_is_not_journaled(data_dir):
+    store = JournalStore(data_dir)
+    pid, _ = new_project(store, 'ЖК Север')
+    shard = store.shard(pid)
+    seq, size = shard.seq, os.path.getsize(shard.journal_path)
+
+    with pytest.raises(ValueError):
+        shard.commit({'op': 'update', 'table': 'materials', 'id': 999_999, 'values': {'name': 'x'}})
+    with pytest.raises(ValueError):
+        shard.commit({'op': 'no_such_op'})
+    assert (shard.seq, os.path.getsize(shard.journal_path)) == (seq, size)
+
+def test_failed_apply_rolls_back(data_dir, monkeypatch):
+    store = JournalStore(data_dir)
+    pid, (concrete, _) = new_project(store, 'ЖК Север')
+    receive(store, concrete, 5)
+    before = state(store)
+    apply = JournalShard._apply
+
+    def broken_apply(self, record):
+        if record['op'] == 'clear_history':
+            self.totals.clear()  # часть изменений уже сделана
+            raise RuntimeError('сбой применения')
+        return apply(self, record)
+
+    monkeypatch.setattr(JournalShard, '_apply', broken_apply)
+    with pytest.raises(RuntimeError):
+        store.clear_history(pid)
+    monkeypatch.setattr(JournalShard, '_apply', apply)
+
+    assert state(store) == before
+    assert state(JournalStore(data_dir)) == before
+    receive(store, concrete, 1)
+    assert store.check_totals().empty
+
+def test_writer_survives_failed_batch(data_dir, monkeypatch):
+    store = JournalStore(data_dir)
+    write_batch = JournalShard._write_batch
+
+    def failing(self, items):
+        raise OSError('диск недоступен')
+
+    monkeypatch.setattr(JournalShard, '_write_batch', failing)
+    with pytest.raises(OSError):
+        store.add_project('ЖК Север')
+    monkeypatch.setattr(JournalShard, '_write_batch', write_batch)
+
+    assert store.writer.thread.is_alive()
+    assert store.add_project('ЖК Юг')
+    assert store.projects()['name'].tolist() == ['ЖК Юг']
+
+def test_writes_load_only_the_owning_shard(data_dir):
+    store = JournalStore(data_dir)
+    new_project(store, 'ЖК Север')
+    pid, (concrete, _) = new_project(store, 'ЖК Юг')
+    new_project(store, 'ЖК Запад')
+
+    reopened = JournalStore(data_dir)
+    shipment_id = receive(reopened, concrete, 3)
+    assert list(reopened.shards) == [pid]
+    assert reopened.get_shipment(shipment_id, project_id=pid)['qty'] == 3.0
+    assert list(reopened.shards) == [pid]
+
+def test_legacy_migration_survives_crash(tmp_path, monkeypatch):
+    data_dir = str(tmp_path / 'data')
+    os.makedirs(data_dir)
+    tables = {
+        'projects': pd.DataFrame({'id': [1], 'name': ['ЖК Север']}),
+        'materials': pd.DataFrame({'id': [1], 'project_id': [1], 'name': ['Бетон'], 'unit': ['м3'], 'planned_qty': [10.0]}),
+        'shipments': pd.DataFrame({'id': [1], 'material_id': [1], 'qty': [4.0], 'user_name': ['Тест'],
+                                   'arrival_date': ['2024-05-01 10:00:00'], 'store': [''], 'doc_number': [''],
+                                   'note': [''], 'op_type': ['Приход']}),
+    }
+    with open(os.path.join(data_dir, 'snapshot.json'), 'w', encoding='utf-8') as f:
+        json.dump({'seq': 0, 'tables': {name: df.to_json(orient='split') for name, df in tables.items()}}, f)
+
+    # Сбой после записи шардов объектов, до записи индекса
+    init = JournalShard.__init__
+
+    def crash_on_index(self, shard_dir, *args, **kwargs):
+        if os.path.basename(shard_dir) == 'index':
+            raise OSError('сбой')
+        init(self, shard_dir, *args, **kwargs)
+
+    monkeypatch.setattr(JournalShard, '__init__', crash_on_index)
+    with pytest.raises(OSError):
+        JournalStore(data_dir)
+    monkeypatch.setattr(JournalShard, '__init__', init)
+    assert os.path.exists(os.path.join(data_dir, 'snapshot.json'))
+
+    store = JournalStore(data_dir)
+    assert store.projects()['name'].tolist() == ['ЖК Север']
+    assert store.project_materials(1)['total'].tolist() == [4.0]
+    assert os.listdir(os.path.join(data_dir, 'legacy-migrated')) == ['snapshot.json']
+
+def test_project_versions_without_loading_shards(data_dir, monkeypatch):
+    monkeypatch.setattr(sclad.journal, 'JOURNAL_COMPACT_EVERY', 5)
+    store = JournalStore(data_dir)
+    pid, (concrete, _) = new_project(store, 'ЖК Север')
+    other_pid, _ = new_project(store, 'ЖК Юг')
+    for _ in range(7):
+        receive(store, concrete, 1.0)
+    expected = {pid: store.version(pid), other_pid: store.version(other_pid)}
+    with open(store.shard(pid).journal_path, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 999, "op": "ins')
+
+    reopened = JournalStore(data_dir)
+    assert reopened.project_versions() == expected
+    assert not reopened.shards
+    assert {p: reopened.version(p) for p in expected} == expected
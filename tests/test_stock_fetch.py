@@ -0,0 +1,165 @@
+"""
+sclad.stock.fetch_stock_file против локального HTTP-сервера: условные запросы (ETag /
+Last-Modified -> 304 без разбора), попадание в кэш по хэшу содержимого и работа
+с сохранённым файлом, когда сервер недоступен.
+"""
+
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+import requests
+
+import sclad.stock
+from sclad.stock import STOCK_MIN_COLS, fetch_stock_file
+
+def stock_xlsx(names):
+    """Файл остатков: название в столбце 1, склад, кол-во и полка — в 12, 13, 16."""
+    rows = []
+    for name in names:
+        row = [None] * STOCK_MIN_COLS
+        row[1], row[12], row[13], row[16] = name, 'Склад 1', 5, 'П-1'
+        rows.append(row)
+    output = io.BytesIO()
+    pd.DataFrame(rows).to_excel(output, index=False, header=False)
+    return output.getvalue()
+
+class StockServer:
+    """Отдаёт один файл; ETag и Last-Modified можно отключить. Запоминает заголовки запросов."""
+
+    def __init__(self, content, etag=True, last_modified=True):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                etag = f'"{hash(server.content) & 0xffffffff:x}"' if server.etag else None
+                modified = 'Wed, 01 Jan 2025 00:00:00 GMT' if server.last_modified else None
+                if (etag and self.headers.get('If-None-Match') == etag) or \
+                        (not etag and modified and self.headers.get('If-Modified-Since') == modified):
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                if etag:
+                    self.send_header('ETag', etag)
+                if modified:
+                    self.send_header('Last-Modified', modified)
+                self.send_header('Content-Length', str(len(server.content)))
+                self.end_headers()
+                self.wfile.write(server.content)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/stock.xlsx'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def parses(monkeypatch):
+    """Счётчик разборов Excel внутри fetch_stock_file."""
+    calls = []
+    read_excel = pd.read_excel
+
+    def counting_read_excel(*args, **kwargs):
+        calls.append(1)
+        return read_excel(*args, **kwargs)
+
+    monkeypatch.setattr(sclad.stock.pd, 'read_excel', counting_read_excel)
+    return calls
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(content, **kwargs):
+        servers.append(StockServer(content, **kwargs))
+        return servers[-1]
+
+    yield start
+    for srv in servers:
+        srv.stop()
+
+def test_etag_gives_304_without_parse(tmp_path, server, parses):
+    srv = server(stock_xlsx(['Бетон', 'Арматура']))
+    session = requests.Session()
+
+    content_hash, status = fetch_stock_file(srv.url, tmp_path, session=session)
+    assert status == 'downloaded'
+    assert len(parses) == 1
+    assert (tmp_path / f'{content_hash}.pkl').exists()
+    assert (tmp_path / f'{content_hash}.xlsx').exists()
+
+    again_hash, status = fetch_stock_file(srv.url, tmp_path, session=session)
+    assert (again_hash, status) == (content_hash, 'not_modified')
+    assert len(parses) == 1
+    assert srv.requests[-1].get('If-None-Match')
+
+def test_last_modified_gives_304_without_parse(tmp_path, server, parses):
+    srv = server(stock_xlsx(['Бетон']), etag=False)
+
+    content_hash, _ = fetch_stock_file(srv.url, tmp_path)
+    assert fetch_stock_file(srv.url, tmp_path) == (content_hash, 'not_modified')
+    assert len(parses) == 1
+    assert srv.requests[-1].get('If-Modified-Since') == 'Wed, 01 Jan 2025 00:00:00 GMT'
+
+def test_same_content_is_a_hash_hit(tmp_path, server, parses):
+    # Без валидаторов сервер каждый раз отдаёт файл целиком, но разбор не повторяется
+    content = stock_xlsx(['Бетон', 'Песок'])
+    srv = server(content, etag=False, last_modified=False)
+    content_hash, status = fetch_stock_file(srv.url, tmp_path)
+    assert status == 'downloaded'
+
+    assert fetch_stock_file(srv.url, tmp_path) == (content_hash, 'unchanged')
+    # Тот же файл по другой ссылке — тоже из кэша
+    other = server(content, etag=False, last_modified=False)
+    assert fetch_stock_file(other.url, tmp_path) == (content_hash, 'unchanged')
+    assert len(parses) == 1
+
+def test_changed_file_replaces_cached_version(tmp_path, server, parses):
+    srv = server(stock_xlsx(['Бетон']))
+    old_hash, _ = fetch_stock_file(srv.url, tmp_path)
+
+    srv.content = stock_xlsx(['Бетон', 'Щебень'])
+    new_hash, status = fetch_stock_file(srv.url, tmp_path)
+    assert status == 'downloaded' and new_hash != old_hash
+    assert len(parses) == 2
+    # Прежняя версия больше ни на что не ссылается и удалена
+    assert not (tmp_path / f'{old_hash}.pkl').exists()
+    assert not (tmp_path / f'{old_hash}.xlsx').exists()
+
+def test_server_down_falls_back_to_cache(tmp_path, server, parses):
+    srv = server(stock_xlsx(['Бетон']))
+    content_hash, _ = fetch_stock_file(srv.url, tmp_path)
+    srv.stop()
+
+    assert fetch_stock_file(srv.url, tmp_path, timeout=(1, 1)) == (content_hash, 'cached')
+    assert len(parses) == 1
+
+def test_server_down_without_cache_raises(tmp_path, server):
+    srv = server(stock_xlsx(['Бетон']))
+    srv.stop()
+
+    with pytest.raises(requests.ConnectionError):
+        fetch_stock_file(srv.url, tmp_path, timeout=(1, 1))
+
+def test_too_few_columns_is_rejected(tmp_path, server):
+    output = io.BytesIO()
+    pd.DataFrame([['Бетон', 1]]).to_excel(output, index=False, header=False)
+    srv = server(output.getvalue())
+
+    with pytest.raises(ValueError):
+        fetch_stock_file(srv.url, tmp_path)
+    assert not list(tmp_path.glob('*.pkl'))